@@ -24,6 +24,9 @@
         [-af, --all-files]          Prevent using Include/Exclude patterns on files
                                       (shows hidden files excluded by default)
 
+        [-ft, --file-type]          File media type
+        [-ms, --media-scan]         Media types scan level {extension|content|full}
+
         [-s, --sort]{na|nd|sa|sd}   Sort order for files / folders (name | date, asc | desc)
         [-ni, nested-indent]        Indent for printing nested directories
         [-q, --quiet]               Do not visualise changes / show messages during processing
@@ -137,8 +140,15 @@ class BatchMPArgParser:
                     choices = ['image', 'video', 'audio', 'media', 'nonmedia', 'playable', 'nonplayable', 'any'],
                     default =  FSEntryDefaults.DEFAULT_FILE_TYPE)
         media_types_group.add_argument("-ms", "--media-scan", dest = "media_scan",
-                    help = "Scan for media types, instead of using file extensions (can take a long time)",
-                    action = 'store_true')
+                    help = "Media types scan level: 'extension' uses file extensions, " \
+                           "'content' checks file content signatures, " \
+                           "'full' scans for media types (can take a long time). " \
+                           "Without a level, defaults to 'full'",
+                    type = str,
+                    nargs = '?',
+                    const = 'full',
+                    choices = ['extension', 'content', 'full'],
+                    default = FSEntryDefaults.DEFAULT_MEDIA_SCAN)
 
 
         # Add Default Miscellaneous Group
@@ -189,7 +199,7 @@ class BatchMPArgParser:
             args['end_level'] = sys.maxsize
 
 
-        if args['media_scan']:
+        if args['media_scan'] == 'full':
             if not FFH.ffmpeg_installed():
                 print('Advanced media-related operations require FFmpeg')
                 print(FFmpegNotInstalled().default_message)
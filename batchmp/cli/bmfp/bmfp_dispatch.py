@@ -21,7 +21,9 @@ from batchmp.ffmptools.ffcommands.silencesplit import SilenceSplitter
 from batchmp.ffmptools.ffcommands.denoise import Denoiser
 from batchmp.ffmptools.ffcommands.normalize_peak import PeakNormalizer
 from batchmp.ffmptools.ffcommands.cuesplit import CueSplitter
+from batchmp.ffmptools.ffcommands.chain import Chain
 from batchmp.ffmptools.processors.basefp import BaseFFProcessor
+from batchmp.ffmptools.ffrunner import FFMPRunner
 from batchmp.tags.output.formatters import OutputFormatType
 from batchmp.ffmptools.processors.ffentry import FFEntryParams, FFEntryParamsExt, FFEntryParamsSilenceSplit
 
@@ -61,6 +63,12 @@ class BMFPDispatcher(BatchMPDispatcher):
             elif args['sub_cmd'] == BMFPCommands.CUESPLIT:
                 self.cue_split(args)
 
+            elif args['sub_cmd'] == BMFPCommands.CHAIN:
+                self.chain(args)
+
+            elif args['sub_cmd'] == BMFPCommands.WORKER:
+                self.worker(args)
+
             else:
                 print('Nothing to dispatch')
                 return False
@@ -113,6 +121,18 @@ class BMFPDispatcher(BatchMPDispatcher):
         ff_entry_params = FFEntryParamsExt(args)
         CueSplitter().cue_split(ff_entry_params, encoding = args['encoding'])
 
+    def chain(self, args):
+        ff_entry_params = FFEntryParamsExt(args)
+        Chain().chain(ff_entry_params,
+                denoise = args['denoise'],
+                num_passes = args['num_passes'],
+                highpass = args['highpass'],
+                lowpass = args['lowpass'],
+                normalize = args['normalize'])
+
+    def worker(self, args):
+        FFMPRunner().run_worker(args['connect'], num_slots = args['num_slots'])
+
 
 def main():
     ''' BMFP entry point
@@ -39,6 +39,15 @@
 
           .. denoise        Reduces background audio noise in media files
 
+          .. chain          Chains denoising, peak normalization and conversion of media files
+                            into a single FFmpeg command per file, i.e. with one decode / encode cycle
+                                For example, to denoise, normalize and convert to mp3:
+                                    $ bmfp chain -dn -nm -tf mp3
+
+          .. worker         Runs media files processing commands served by a coordinator,
+                            e.g. by a "bmfp convert --coordinator" run on another node
+                                    $ BATCHMP_AUTHKEY=secret bmfp worker -cn node1:7000
+
           .. adjust volume  TDB: Adjust audio volume
           .. speed up       TDB: Uses Time Stretching to increase audio / video speed
           .. slow down      TDB: Uses Time Stretching to increase audio / video speed
@@ -77,9 +86,33 @@
       FFmpeg Commands Execution:
         [-q, --quiet]               Do not visualise changes / show messages during processing
         [-se, --serial-exec]        Run all task's commands in a single process
+        [-sm, --streaming]          Start processing media files as soon as they are found,
+                                    instead of after walking the whole source directory
+        [-rs, --resume]             Resume an interrupted run in its target directory,
+                                    skipping the media files already processed there
+        [-tt, --task-timeout]       Max running time of a media file processing command
+        [-ts, --stall-timeout]      Max time without progress of a media file processing command
+                                    Timed out commands are killed, and retried a couple of times
+        [-cr, --coordinator]        Serve the media files processing commands to "bmfp worker" processes,
+                                    at a "host:port" TCP address or a Unix socket path.
+                                    Workers on other nodes need the media files at the same paths
+                                    (shared storage), and the same BATCHMP_AUTHKEY environment variable
+        [-pl, --plan]               Plan only: write the tasks manifest (JSON) to a file, without processing
+                                    Shows the media duration / size, and the output size / running time
+                                    predicted from the throughput of previous runs
+        [-sa, --shard]              Process only the i-th of n shards ("i/n"), balanced by estimated cost,
+                                    e.g. in a Slurm job array: -sa $SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT
+        [-mf, --manifest]           Take the shards from a tasks manifest written via --plan
+        [-rc, --records]            Write the per-task records (JSON lines) to a file,
+                                    next to the run summary report
+        [-ac, --adaptive-concurrency]
+                                    Adapt the number of concurrently running commands to the system pressure
+                                    (CPU / memory / IO pressure, load, available memory), within "min-max" bounds
+        [-fw, --finalize-workers]   Number of threads tagging / moving the processed files to the target directory,
+                                    alongside the processing commands (0 to do that in the commands slots)
 
       Commands:
-        {print, convert, normalize, fragment, segment, silencesplit, cuesplit, denoise, version, info}
+        {print, convert, normalize, fragment, segment, silencesplit, cuesplit, denoise, chain, worker, version, info}
         $ bmfp {command} -h  #run this for detailed help on individual commands
 """
 import os, sys, argparse
@@ -91,6 +124,9 @@ from batchmp.ffmptools.ffcommands.denoise import Denoiser
 from batchmp.ffmptools.ffutils import FFH, FFmpegNotInstalled, FFHDefaults
 from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOptions
 from batchmp.fstools.builders.fsentry import FSEntryDefaults
+from batchmp.commons.distributed import AUTHKEY_ENV
+from batchmp.commons.taskplan import TasksPlan
+from batchmp.commons.taskprocessor import TasksProcessor
 
 class BMFPCommands(BatchMPBaseCommands):
     CONVERT = 'convert'
@@ -100,6 +136,8 @@ class BMFPCommands(BatchMPBaseCommands):
     SILENCESPLIT = 'silencesplit'
     CUESPLIT = 'cuesplit'
     DENOISE = 'denoise'
+    CHAIN = 'chain'
+    WORKER = 'worker'
 
     @classmethod
     def commands_meta(cls):
@@ -112,6 +150,8 @@ class BMFPCommands(BatchMPBaseCommands):
                         '{}, '.format(cls.SILENCESPLIT),
                         '{}, '.format(cls.CUESPLIT),
                         '{}, '.format(cls.DENOISE),
+                        '{}, '.format(cls.CHAIN),
+                        '{}, '.format(cls.WORKER),
                         '{}, '.format(cls.INFO),
                         '{}'.format(cls.VERSION),
                         '}'))
@@ -180,6 +220,60 @@ class BMFPArgParser(BatchMPArgParser):
         misc_group.add_argument("-se", "--serial-exec", dest='serial_exec',
                     help = "Run all task's commands in a single process",
                     action='store_true')
+        misc_group.add_argument("-sm", "--streaming", dest='streaming',
+                    help = "Start processing media files as soon as they are found, "
+                            "instead of after walking the whole source directory",
+                    action='store_true')
+        misc_group.add_argument("-rs", "--resume", dest='resume',
+                    help = "Resume an interrupted run in its target directory, "
+                            "skipping the media files already processed there",
+                    action='store_true')
+        misc_group.add_argument("-tt", "--task-timeout", dest='task_timeout',
+                    help = 'Max running time of a media file processing command, '
+                            'in seconds or in the "hh:mm:ss[.xxx]" format (no limit by default). '
+                            'Timed out commands are killed, and retried a couple of times',
+                    type = lambda tt: self._is_timedelta(parser, tt))
+        misc_group.add_argument("-ts", "--stall-timeout", dest='stall_timeout',
+                    help = 'Max time without progress of a media file processing command, '
+                            'in seconds or in the "hh:mm:ss[.xxx]" format (default is {} seconds). '
+                            'Stalled commands are killed, and retried a couple of times' \
+                                                .format(FFHDefaults.DEFAULT_STALL_TIMEOUT),
+                    type = lambda ts: self._is_timedelta(parser, ts))
+        misc_group.add_argument("-cr", "--coordinator", dest='coordinator',
+                    help = 'Serve the media files processing commands to "bmfp worker" processes, '
+                            'at a "host:port" TCP address or a Unix socket path. '
+                            'Workers on other nodes need the media files at the same paths (shared storage), '
+                            'and the same {} environment variable'.format(AUTHKEY_ENV),
+                    type = str)
+        misc_group.add_argument("-pl", "--plan", dest='plan_path',
+                    help = 'Plan only: write the tasks manifest (JSON) to a file, without processing. '
+                            'Shows the media duration / size, and the output size / running time '
+                            'predicted from the throughput of previous runs',
+                    type = str)
+        misc_group.add_argument("-sa", "--shard", dest='shard',
+                    help = 'Process only the i-th of n shards, specified as "i/n" (shards are numbered from 1). '
+                            'Shards are balanced by the tasks estimated costs, and share the target directory',
+                    type = lambda sa: self._is_shard(parser, sa))
+        misc_group.add_argument("-mf", "--manifest", dest='manifest_path',
+                    help = 'Take the shards from a tasks manifest written via --plan, '
+                            'rather than from the media files found at processing time',
+                    type = str)
+        misc_group.add_argument("-rc", "--records", dest='records_path',
+                    help = 'Write the per-task records (one JSON record per line) to a file, '
+                            'e.g. for analysing runs of many media files beyond the run summary report',
+                    type = str)
+        misc_group.add_argument("-ac", "--adaptive-concurrency", dest='concurrency_bounds',
+                    help = 'Adapt the number of concurrently running media files processing commands '
+                            'to the system pressure (CPU / memory / IO pressure, load, available memory), '
+                            'within "min-max" bounds, e.g. on shared hosts. '
+                            'The max defaults to the planned pool width, e.g.: -ac 2- or -ac 2-8',
+                    type = lambda ac: self._is_concurrency_bounds(parser, ac))
+        misc_group.add_argument("-fw", "--finalize-workers", dest='finalize_workers',
+                    help = 'Number of threads tagging / moving the processed media files to the target directory, '
+                            'alongside the processing commands, i.e. so that disk-bound and CPU-bound work overlap '
+                            '(default is {}, 0 to do that within the processing commands slots)' \
+                                                                    .format(TasksProcessor.FINALIZE_WORKERS),
+                    type = int)
         misc_group.add_argument("-q", "--quiet", dest = 'quiet',
                     help = "Do not display info messages during processing",
                     action = 'store_true')
@@ -349,6 +443,56 @@ class BMFPArgParser(BatchMPArgParser):
                     type = int,
                     default = Denoiser.DEFAULT_LOWPASS)
 
+        # Chain
+        chain_parser = subparsers.add_parser(BMFPCommands.CHAIN,
+                                        description = 'Chains denoising, peak normalization and conversion of media files '
+                                                      'into a single FFmpeg command per file, i.e. with one decode / encode cycle. '
+                                                      'The volume is analyzed only when normalizing, on the denoised audio',
+                                        formatter_class = BatchMPHelpFormatter)
+        group = chain_parser.add_argument_group('Chained Steps')
+        group.add_argument('-dn', '--denoise', dest='denoise',
+                help = 'Reduces background audio noise via filtering out highpass / low-pass frequencies',
+                action='store_true')
+        group.add_argument('-nm', '--normalize', dest='normalize',
+                help = 'Peak-normalizes the (denoised) audio',
+                action='store_true')
+        group.add_argument('-tf', '--target-format', dest='target_format',
+                help = 'Converts to target format file extension, e.g. mp3 / m4a / mp4 / mov /... ' \
+                       '(default is to keep the media files formats)',
+                type = str)
+        group.add_argument('-la', '--lossless-audio', dest='lossless_audio',
+                help = 'For media formats with support for lossless audio, tries a lossless conversion',
+                action='store_true')
+        group = chain_parser.add_argument_group('Denoise Filters')
+        group.add_argument('-np', '--numpasses', dest='num_passes',
+                help = 'Applies filters in multiple passes (chained, i.e. still with one encode)',
+                type = int,
+                default = Denoiser.DEFAULT_NUM_PASSES)
+        group.add_argument("-hp", "--highpass", dest='highpass',
+                    help = "Cutoff boundary for lower frequencies",
+                    type = int,
+                    default = Denoiser.DEFAULT_HIGHPASS)
+        group.add_argument("-lp", "--lowpass", dest='lowpass',
+                    help = "Cutoff boundary for higher frequencies",
+                    type = int,
+                    default = Denoiser.DEFAULT_LOWPASS)
+
+        # Worker
+        worker_parser = subparsers.add_parser(BMFPCommands.WORKER,
+                                        description = 'Runs media files processing commands served by a coordinator, '
+                                                      'i.e. by a bmfp run with the --coordinator option. '
+                                                      'Connections are authenticated via the {} environment variable' \
+                                                                                                .format(AUTHKEY_ENV),
+                                        formatter_class = BatchMPHelpFormatter)
+        worker_parser.add_argument('-cn', '--connect', dest='connect',
+                help = 'Coordinator address, "host:port" or a Unix socket path',
+                type = str,
+                required = True)
+        worker_parser.add_argument('-ns', '--num-slots', dest='num_slots',
+                help = 'Number of commands to run in parallel (default is the number of available CPUs)',
+                type = int,
+                default = 0)
+
         # Troubleshooting
         parser.add_argument('-.ll', dest='log_level',
             help=argparse.SUPPRESS,
@@ -398,6 +542,34 @@ class BMFPArgParser(BatchMPArgParser):
         # Always preserve metadata (experimental)
         args['preserve_metadata'] = True
 
+        # Tasks plans
+        if args['plan_path'] or args['shard'] or args['manifest_path']:
+            if args['sub_cmd'] in (BMFPCommands.PRINT, BMFPCommands.CUESPLIT, BMFPCommands.WORKER):
+                parser.error('bmfp {}:\n\t'
+                             'Tasks plans / shards are not supported for this command'.format(args['sub_cmd']))
+            if args['streaming']:
+                parser.error('bmfp tasks plans:\n\t'
+                             'Tasks plans / shards need all the tasks upfront, i.e. are not supported in streaming mode')
+            if args['manifest_path'] and not args['shard']:
+                parser.error('bmfp tasks plans:\n\t'
+                             'A tasks manifest is used together with a shard, e.g.: -mf plan.json -sa 1/4')
+
+        # Adaptive concurrency is for local pools
+        if args['concurrency_bounds'] and (args['coordinator'] or args['serial_exec']):
+            parser.error('bmfp adaptive concurrency:\n\t'
+                         'Adaptive concurrency is not supported for serial or distributed execution')
+
+        if args['finalize_workers'] is not None and args['finalize_workers'] < 0:
+            parser.error('bmfp finalize workers:\n\t'
+                         'The number of finalize workers can not be negative')
+
+        # Distributed execution needs a shared key
+        if args['coordinator'] or args['sub_cmd'] == BMFPCommands.WORKER:
+            if not os.environ.get(AUTHKEY_ENV):
+                parser.error('bmfp distributed execution:\n\t'
+                             'The {} environment variable needs to be set, '
+                             'to the same value on the coordinator and the workers'.format(AUTHKEY_ENV))
+
         # If advanced media options requested,
         # check ffmpeg presence
         if args['sub_cmd'] == 'print':
@@ -413,11 +585,19 @@ class BMFPArgParser(BatchMPArgParser):
                 parser.error('bmfp segment:\n\t'
                              'One of the command parameters needs to be specified: <filesize | duration>')
 
-        elif args['sub_cmd'] in (BMFPCommands.CONVERT, BMFPCommands.CUESPLIT):
+        elif args['sub_cmd'] in (BMFPCommands.CONVERT, BMFPCommands.CUESPLIT, BMFPCommands.CHAIN):
+            # Chain attributes check
+            if args['sub_cmd'] == BMFPCommands.CHAIN:
+                if not (args['denoise'] or args['normalize'] or args['target_format']):
+                    parser.error('bmfp chain:\n\t'
+                                 'At least one of the chained steps needs to be specified: '
+                                 '<denoise | normalize | target-format>')
+
             # Convert attributes check
-            args['target_format'] = args['target_format'].lower()
-            if not args['target_format'].startswith('.'):
-                args['target_format'] = '.{}'.format(args['target_format'])
+            if args['target_format']:
+                args['target_format'] = args['target_format'].lower()
+                if not args['target_format'].startswith('.'):
+                    args['target_format'] = '.{}'.format(args['target_format'])
 
             if args['ffmpeg_options'] == FFmpegCommands.CONVERT_COPY_VBR_QUALITY: #default
                 if args['lossless_audio']:
@@ -438,5 +618,25 @@ class BMFPArgParser(BatchMPArgParser):
     def _add_arg_misc_group(parser):
         pass
 
+    @staticmethod
+    def _is_shard(parser, shard_arg):
+        try:
+            return TasksPlan.parse_shard(shard_arg)
+        except ValueError as e:
+            parser.error(str(e))
+
+    @staticmethod
+    def _is_concurrency_bounds(parser, bounds_arg):
+        ''' "min-max" => (min, max), with max optional
+        '''
+        min_workers, _, max_workers = bounds_arg.partition('-')
+        try:
+            min_workers, max_workers = int(min_workers), int(max_workers) if max_workers else None
+        except ValueError:
+            parser.error('Invalid adaptive concurrency bounds: "{}", expected "min-max"'.format(bounds_arg))
+        if min_workers < 1 or (max_workers is not None and max_workers < min_workers):
+            parser.error('Invalid adaptive concurrency bounds: "{}", expected 1 <= min <= max'.format(bounds_arg))
+        return min_workers, max_workers
+
 
 
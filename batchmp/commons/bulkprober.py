@@ -0,0 +1,78 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Bulk probing of a sequence of items
+    Runs a (typically subprocess-bound) probe function in a bounded thread pool,
+    reading ahead of the consumer while still yielding results in the original order
+'''
+import os, collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BulkProber:
+    ''' Ordered read-ahead probing in a bounded thread pool
+    '''
+    DEFAULT_READ_AHEAD_FACTOR = 4
+
+    def __init__(self, probe, num_workers = None, read_ahead = None):
+        self.probe = probe
+        self.num_workers = num_workers if num_workers else self.default_num_workers()
+        self.read_ahead = max(read_ahead if read_ahead else self.num_workers * self.DEFAULT_READ_AHEAD_FACTOR,
+                                                                                        self.num_workers)
+
+    @staticmethod
+    def default_num_workers():
+        # probes mostly wait on child processes, so can oversubscribe the CPU cores
+        return min(32, (os.cpu_count() or 1) + 4)
+
+    def iprobe(self, items, key = None):
+        ''' Generates (item, probe result) pairs, in the original items order
+            key maps an item to the actual probe function argument
+        '''
+        if not key:
+            key = lambda item: item
+
+        if self.num_workers < 2:
+            for item in items:
+                yield item, self.probe(key(item))
+            return
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers = self.num_workers) as executor:
+            try:
+                for item in items:
+                    pending.append((item, executor.submit(self.probe, key(item))))
+                    if len(pending) >= self.read_ahead:
+                        item, future = pending.popleft()
+                        yield item, future.result()
+
+                while pending:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            finally:
+                # premature exit, no need to finish the read-ahead probes
+                for _, future in pending:
+                    future.cancel()
+
+    def filter(self, items, key = None):
+        ''' Generates items passing the probe, in the original items order
+        '''
+        for item, passed in self.iprobe(items, key = key):
+            if passed:
+                yield item
+
+    def map(self, items, key = None):
+        ''' List of probe results, in the original items order
+        '''
+        return [result for _, result in self.iprobe(items, key = key)]
@@ -0,0 +1,189 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Adaptive concurrency
+      . samples the system pressure: Linux PSI (/proc/pressure/cpu, memory, io),
+        the load average per CPU and the available memory
+      . raises / lowers the number of concurrently running tasks within configured bounds,
+        i.e. backs off when other jobs land on a shared host, and picks up again when they are gone
+      . memory pressure halves the concurrency, to keep the host out of swap
+      . signals not available on the platform are ignored
+'''
+import os, time
+from collections import namedtuple, deque
+from batchmp.commons.cpubudget import CPUBudgetPlanner
+
+
+# PSI "some" avg10 percents, load average per CPU, available memory fraction, None when not available
+SystemPressure = namedtuple('SystemPressure', ['cpu', 'memory', 'io', 'load', 'mem_available'])
+
+ConcurrencyDecision = namedtuple('ConcurrencyDecision', ['elapsed', 'concurrency', 'new_concurrency', 'reason'])
+
+
+class SystemPressureProbe:
+    ''' Samples the system pressure
+    '''
+    PSI_DIR = '/proc/pressure'
+    MEMINFO = '/proc/meminfo'
+
+    @classmethod
+    def sample(cls):
+        return SystemPressure(cls.psi('cpu'), cls.psi('memory'), cls.psi('io'),
+                                                            cls.load_per_cpu(), cls.mem_available())
+
+    @classmethod
+    def psi(cls, resource):
+        ''' Share of time (percent, over the last 10 secs) some tasks were stalled on the resource
+        '''
+        try:
+            with open(os.path.join(cls.PSI_DIR, resource)) as f:
+                for line in f:
+                    fields = line.split()
+                    if fields and fields[0] == 'some':
+                        return float(dict(field.split('=') for field in fields[1:])['avg10'])
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    @staticmethod
+    def load_per_cpu():
+        try:
+            return os.getloadavg()[0] / CPUBudgetPlanner.available_cpus()
+        except (AttributeError, OSError):
+            return None
+
+    @classmethod
+    def mem_available(cls):
+        ''' Available memory, as a fraction of the total
+        '''
+        meminfo = {}
+        try:
+            with open(cls.MEMINFO) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    meminfo[key] = int(value.split()[0])
+            return meminfo['MemAvailable'] / meminfo['MemTotal']
+        except (OSError, ValueError, IndexError, KeyError, ZeroDivisionError):
+            return None
+
+
+class AdaptiveConcurrency:
+    ''' Adapts the number of concurrently running tasks to the system pressure
+        Raises it by one while all the signals are low, lowers it by one when any is high
+        (halves it on memory pressure), and holds it in between
+    '''
+    # secs between the decisions, i.e. about the PSI averaging window
+    INTERVAL = 10.0
+
+    # (low, high) thresholds
+    CPU_PRESSURE = (10.0, 40.0)
+    IO_PRESSURE = (10.0, 40.0)
+    MEMORY_PRESSURE = (1.0, 10.0)
+    LOAD_PER_CPU = (0.8, 1.5)
+    # (high, low), i.e. less available memory is more pressure
+    MEM_AVAILABLE = (0.2, 0.1)
+
+    # latest decisions to keep for the run report
+    NUM_DECISIONS = 20
+
+    def __init__(self, min_workers = 1, max_workers = None, interval = None, probe = None):
+        ''' max_workers defaults to the planned number of pool workers
+        '''
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max_workers
+        self.interval = interval if interval is not None else self.INTERVAL
+        self.probe = probe if probe else SystemPressureProbe
+        self.concurrency = None
+        self.num_decisions = 0
+        self.decisions = deque(maxlen = self.NUM_DECISIONS)
+        self.lowest = self.highest = None
+
+    def start(self, num_workers):
+        ''' Starts at the planned number of workers, within the bounds
+            Returns the max concurrency, i.e. the pool width
+        '''
+        if not self.max_workers:
+            self.max_workers = num_workers
+        self.min_workers = min(self.min_workers, self.max_workers)
+        self.concurrency = max(self.min_workers, min(num_workers, self.max_workers))
+        self.lowest = self.highest = self.concurrency
+        self.num_decisions = 0
+        self.decisions.clear()
+        self._start = self._last_decision = time.monotonic()
+        return self.max_workers
+
+    def limit(self):
+        ''' Current number of tasks to run concurrently, re-decided at most every interval
+        '''
+        if self.concurrency is None:
+            raise RuntimeError('AdaptiveConcurrency is not started')
+        now = time.monotonic()
+        if now - self._last_decision >= self.interval:
+            self._last_decision = now
+            self._decide(self.probe.sample(), now - self._start)
+        return self.concurrency
+
+    # Helpers
+    def _decide(self, pressure, elapsed):
+        memory_high = [reason for reason in (
+                            self._above('memory pressure', pressure.memory, self.MEMORY_PRESSURE[1], '{:.1f}%'),
+                            self._below('available memory', pressure.mem_available, self.MEM_AVAILABLE[1]))
+                        if reason]
+        high = memory_high + [reason for reason in (
+                            self._above('CPU pressure', pressure.cpu, self.CPU_PRESSURE[1], '{:.1f}%'),
+                            self._above('I/O pressure', pressure.io, self.IO_PRESSURE[1], '{:.1f}%'),
+                            self._above('load', pressure.load, self.LOAD_PER_CPU[1], '{:.2f}/CPU'))
+                        if reason]
+        low = [value <= threshold for value, threshold in ((pressure.cpu, self.CPU_PRESSURE[0]),
+                                                          (pressure.io, self.IO_PRESSURE[0]),
+                                                          (pressure.memory, self.MEMORY_PRESSURE[0]),
+                                                          (pressure.load, self.LOAD_PER_CPU[0]))
+                                                                                    if value is not None]
+        if pressure.mem_available is not None:
+            low.append(pressure.mem_available >= self.MEM_AVAILABLE[0])
+
+        concurrency = self.concurrency
+        if memory_high:
+            concurrency, reason = concurrency // 2, ', '.join(high)
+        elif high:
+            concurrency, reason = concurrency - 1, ', '.join(high)
+        elif low and all(low):
+            concurrency, reason = concurrency + 1, 'low pressure'
+        else:
+            return
+        concurrency = max(self.min_workers, min(concurrency, self.max_workers))
+        if concurrency == self.concurrency:
+            return
+
+        self.num_decisions += 1
+        self.decisions.append(ConcurrencyDecision(elapsed, self.concurrency, concurrency, reason))
+        self.concurrency = concurrency
+        self.lowest, self.highest = min(self.lowest, concurrency), max(self.highest, concurrency)
+
+    @staticmethod
+    def _above(name, value, threshold, fmt):
+        if value is not None and value > threshold:
+            return '{0} {1}'.format(name, fmt.format(value))
+        return None
+
+    @staticmethod
+    def _below(name, value, threshold):
+        if value is not None and value < threshold:
+            return '{0} {1:.0%}'.format(name, value)
+        return None
+
+
+# Quick dev test, i.e. the current system pressure
+if __name__ == '__main__':
+    print(SystemPressureProbe.sample())
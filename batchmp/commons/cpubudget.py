@@ -0,0 +1,93 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' CPU budget planning
+      . figures out the CPUs actually available to the process,
+        i.e. respecting its CPU affinity mask and the cgroup CPU quota (containers)
+      . splits them between the pool width and the threads of each task child process,
+        so that N workers x M child threads do not oversubscribe the CPUs
+'''
+import os, math, multiprocessing
+from collections import namedtuple
+
+
+CPUBudget = namedtuple('CPUBudget', ['num_cpus', 'num_workers', 'threads_per_task'])
+
+
+class CPUBudgetPlanner:
+    ''' Plans the CPU budget of a run
+    '''
+    CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+    CGROUP_V1_CPU_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+    CGROUP_V1_CPU_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+    def __init__(self, num_cpus = None):
+        self.num_cpus = num_cpus if num_cpus else self.available_cpus()
+
+    @classmethod
+    def available_cpus(cls):
+        ''' Number of CPUs the process can actually use
+        '''
+        try:
+            num_cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            num_cpus = multiprocessing.cpu_count()
+
+        cgroup_cpus = cls.cgroup_cpus()
+        if cgroup_cpus:
+            num_cpus = min(num_cpus, cgroup_cpus)
+        return max(1, num_cpus)
+
+    @classmethod
+    def cgroup_cpus(cls):
+        ''' CPUs allowed by the cgroup CPU quota, None if not limited
+        '''
+        quota = period = None
+        try:
+            with open(cls.CGROUP_V2_CPU_MAX) as f:
+                quota, period = f.read().split()[:2]
+        except (OSError, ValueError):
+            try:
+                with open(cls.CGROUP_V1_CPU_QUOTA) as f:
+                    quota = f.read().strip()
+                with open(cls.CGROUP_V1_CPU_PERIOD) as f:
+                    period = f.read().strip()
+            except OSError:
+                return None
+
+        try:
+            quota, period = int(quota), int(period)
+        except (TypeError, ValueError):
+            # 'max', i.e. not limited
+            return None
+        if quota <= 0 or period <= 0:
+            return None
+        return max(1, math.ceil(quota / period))
+
+    def plan(self, threads_hints, num_workers = None):
+        ''' Plans the CPU budget for a set of tasks
+            threads_hints are the numbers of threads each task child process can make good use of,
+            e.g. 1 for audio encodes / stream copies, more for video encodes
+            When num_workers is given, just splits the CPUs between them
+        '''
+        num_tasks = len(threads_hints)
+        if not num_tasks:
+            return CPUBudget(self.num_cpus, 1, self.num_cpus)
+
+        if not num_workers:
+            mean_hint = sum(min(max(1, hint), self.num_cpus) for hint in threads_hints) / num_tasks
+            num_workers = max(1, round(self.num_cpus / mean_hint))
+        num_workers = min(num_workers, num_tasks)
+
+        return CPUBudget(self.num_cpus, num_workers, max(1, self.num_cpus // num_workers))
@@ -0,0 +1,363 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Distributed tasks execution
+      . a coordinator serves tasks over a TCP or a Unix socket to worker processes,
+        typically on other nodes with the tasks files on shared storage
+      . workers lease tasks, run them in local worker slots and send back the results
+      . workers heartbeat their leases; when a worker dies (or stops heartbeating),
+        its leased tasks are reassigned to other workers
+      . tasks and results are pickled, so connections are authenticated
+        via a shared key (the BATCHMP_AUTHKEY environment variable),
+        in the connections threads, i.e. peers not authenticating in time do not hold up the others
+'''
+import os, time, socket, queue, threading, itertools, collections
+from multiprocessing.connection import Listener, Client, deliver_challenge, answer_challenge
+from multiprocessing import AuthenticationError
+from batchmp.commons.executors import TasksExecutor, execute_task
+from batchmp.commons.cpubudget import CPUBudgetPlanner
+
+
+AUTHKEY_ENV = 'BATCHMP_AUTHKEY'
+
+
+class DistributedMessage:
+    HELLO = 'hello'
+    GET = 'get'
+    TASK = 'task'
+    WAIT = 'wait'
+    DONE = 'done'
+    RESULT = 'result'
+    HEARTBEAT = 'heartbeat'
+    OK = 'ok'
+
+
+def parse_address(address):
+    ''' (address, family) of a "host:port" TCP address, or of a Unix socket path
+    '''
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in address:
+        return (host if host else 'localhost', int(port)), 'AF_INET'
+    return address, 'AF_UNIX'
+
+
+def resolve_authkey(authkey = None):
+    ''' Connections shared key, from the BATCHMP_AUTHKEY environment variable unless given
+    '''
+    if not authkey:
+        authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise ValueError('Distributed execution requires a shared key, '
+                                    'please set the {} environment variable'.format(AUTHKEY_ENV))
+    return authkey.encode('utf-8') if isinstance(authkey, str) else authkey
+
+
+class DistributedTasksExecutor(TasksExecutor):
+    ''' Coordinator, i.e. serves tasks to remote workers
+        A task is leased to a worker till it sends back the result,
+        leases of workers that disconnect or stop heartbeating are reassigned
+    '''
+    WORKERS_DESCRIPTION = 'remote worker slots'
+
+    # secs without hearing from a worker before its leased tasks are reassigned
+    LEASE_TIMEOUT = 30.0
+    # secs for idle workers to wait before asking for tasks again
+    WAIT_INTERVAL = 0.5
+    # secs for connecting peers to authenticate, before being disconnected
+    HANDSHAKE_TIMEOUT = 10.0
+
+    def __init__(self, num_workers = None, address = None, authkey = None, lease_timeout = None):
+        # i.e. the remote worker slots, as they connect
+        self.num_workers = num_workers if num_workers else 1
+        self.address_description = address
+        self.address, self.family = parse_address(address)
+        self.authkey = resolve_authkey(authkey)
+        self.lease_timeout = lease_timeout if lease_timeout else self.LEASE_TIMEOUT
+
+        self._lock = threading.Lock()
+        self._tasks_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._results = queue.Queue()
+        self._leases = {}
+        self._lease_ids = itertools.count()
+        self._conn_ids = itertools.count()
+        self._slots = {}
+        self._reassigned = collections.deque()
+        self._tasks = None
+        self._tasks_done = True
+        self.num_reassigned = 0
+
+    def start(self):
+        # connections are authenticated in their own threads, see _handshake
+        self._listener = Listener(self.address, self.family)
+        threading.Thread(target = self._accept, daemon = True).start()
+
+    def shutdown(self):
+        # workers get DONE on their next request
+        self._closed.set()
+        self._listener.close()
+
+    def imap_unordered(self, tasks, max_pending = None):
+        ''' Tasks are pulled as workers ask for them, i.e. at the pace of the remote worker slots
+        '''
+        with self._tasks_lock:
+            self._tasks, self._tasks_done = iter(tasks), False
+
+        while True:
+            # not while a task is being leased
+            with self._tasks_lock, self._lock:
+                if self._tasks_done and not self._leases and not self._reassigned and self._results.empty():
+                    break
+            try:
+                result = self._results.get(timeout = self.WAIT_INTERVAL)
+            except queue.Empty:
+                self._reassign(lambda lease: lease.expires < time.monotonic())
+            else:
+                if isinstance(result, BaseException):
+                    raise result
+                yield result
+
+    # Coordinator helpers
+    _Lease = collections.namedtuple('_Lease', ['task', 'conn_id', 'expires'])
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                # listener closed
+                break
+            threading.Thread(target = self._serve, args = (conn, next(self._conn_ids)), daemon = True).start()
+
+    def _handshake(self, conn):
+        ''' Authenticates a connection both ways via the shared key,
+            peers still not done after the handshake timeout are disconnected
+        '''
+        timer = threading.Timer(self.HANDSHAKE_TIMEOUT, self._disconnect, args = (conn,))
+        timer.start()
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+        finally:
+            timer.cancel()
+
+    @staticmethod
+    def _disconnect(conn):
+        ''' Shuts down a connection socket, i.e. interrupts its blocked receives
+        '''
+        try:
+            with socket.socket(fileno = os.dup(conn.fileno())) as sock:
+                sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, ValueError):
+            # e.g. already closed
+            pass
+
+    def _serve(self, conn, conn_id):
+        ''' Authenticates, then serves a worker connection
+        '''
+        try:
+            self._handshake(conn)
+        except (AuthenticationError, EOFError, OSError):
+            conn.close()
+            return
+        try:
+            while True:
+                message = conn.recv()
+                self._renew(conn_id)
+                if message[0] == DistributedMessage.GET:
+                    conn.send(self._lease(conn_id))
+                elif message[0] == DistributedMessage.RESULT:
+                    _, lease_id, result = message
+                    self._complete(lease_id, result)
+                    conn.send((DistributedMessage.OK,))
+                elif message[0] == DistributedMessage.HELLO:
+                    _, _, num_slots = message
+                    with self._lock:
+                        self._slots[conn_id] = num_slots
+                        self.num_workers = max(self.num_workers, sum(self._slots.values()))
+                    conn.send((DistributedMessage.OK,))
+                else:
+                    # HEARTBEAT
+                    conn.send((DistributedMessage.OK,))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            # the worker is gone
+            with self._lock:
+                self._slots.pop(conn_id, None)
+            self._reassign(lambda lease: lease.conn_id == conn_id)
+
+    def _lease(self, conn_id):
+        ''' Leases the next task to a worker
+            The task is taken and its lease registered in one step,
+            i.e. the run is never seen as done with a task on its way to a worker
+        '''
+        with self._tasks_lock:
+            task = None
+            with self._lock:
+                if self._reassigned:
+                    task = self._reassigned.popleft()
+            if task is None and not self._tasks_done:
+                try:
+                    task = next(self._tasks)
+                except StopIteration:
+                    self._tasks_done = True
+            if task is None:
+                return (DistributedMessage.DONE,) if self._closed.is_set() else \
+                                                            (DistributedMessage.WAIT, self.WAIT_INTERVAL)
+            lease_id = self._register_lease(task, conn_id)
+        return (DistributedMessage.TASK, lease_id, task)
+
+    def _register_lease(self, task, conn_id):
+        with self._lock:
+            lease_id = next(self._lease_ids)
+            self._leases[lease_id] = self._Lease(task, conn_id, time.monotonic() + self.lease_timeout)
+        return lease_id
+
+    def _complete(self, lease_id, result):
+        with self._lock:
+            # results of already reassigned leases are dropped
+            if self._leases.pop(lease_id, None):
+                self._results.put(result)
+
+    def _renew(self, conn_id):
+        expires = time.monotonic() + self.lease_timeout
+        with self._lock:
+            for lease_id, lease in self._leases.items():
+                if lease.conn_id == conn_id:
+                    self._leases[lease_id] = lease._replace(expires = expires)
+
+    def _reassign(self, lease_filter):
+        with self._lock:
+            for lease_id in [lease_id for lease_id, lease in self._leases.items() if lease_filter(lease)]:
+                self._reassigned.append(self._leases.pop(lease_id).task)
+                self.num_reassigned += 1
+
+
+class TasksWorker:
+    ''' Runs tasks leased from a coordinator, in local worker slots
+    '''
+    HEARTBEAT_INTERVAL = 5.0
+    # secs to wait for the coordinator to come up
+    CONNECT_TIMEOUT = 60.0
+
+    def __init__(self, address, authkey = None, num_slots = None, name = None):
+        self.address, self.family = parse_address(address)
+        self.authkey = resolve_authkey(authkey)
+        self.num_slots = num_slots if num_slots else CPUBudgetPlanner.available_cpus()
+        self.name = name if name else '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self.num_done = 0
+
+        self._lock = threading.Lock()
+        self._conn_lock = threading.Lock()
+        self._done = threading.Event()
+
+    def run(self):
+        ''' Serves the coordinator till it is done (or gone)
+            Returns the number of tasks done
+        '''
+        self._conn = self._connect()
+        try:
+            self._request(DistributedMessage.HELLO, self.name, self.num_slots)
+            threading.Thread(target = self._heartbeat, daemon = True).start()
+
+            slots = [threading.Thread(target = self._slot) for _ in range(self.num_slots)]
+            for slot in slots:
+                slot.start()
+            for slot in slots:
+                slot.join()
+        finally:
+            self._done.set()
+            self._conn.close()
+        return self.num_done
+
+    # Worker helpers
+    def _connect(self):
+        deadline = time.monotonic() + self.CONNECT_TIMEOUT
+        while True:
+            try:
+                return Client(self.address, self.family, authkey = self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _request(self, *message):
+        with self._conn_lock:
+            self._conn.send(message)
+            return self._conn.recv()
+
+    def _slot(self):
+        # the worker CPUs are split between its slots
+        threads_per_slot = max(1, CPUBudgetPlanner.available_cpus() // self.num_slots)
+        try:
+            while not self._done.is_set():
+                reply = self._request(DistributedMessage.GET)
+                if reply[0] == DistributedMessage.TASK:
+                    _, lease_id, task = reply
+                    task.cpu_threads = max(1, min(task.threads_hint(), threads_per_slot))
+                    try:
+                        result = execute_task(task)
+                    except Exception as e:
+                        # re-raised by the coordinator, as with local pools
+                        result = e
+                    self._request(DistributedMessage.RESULT, lease_id, result)
+                    with self._lock:
+                        self.num_done += 1
+                elif reply[0] == DistributedMessage.WAIT:
+                    time.sleep(reply[1])
+                else:
+                    break
+        except (EOFError, OSError):
+            # the coordinator is gone
+            pass
+        finally:
+            self._done.set()
+
+    def _heartbeat(self):
+        while not self._done.wait(self.HEARTBEAT_INTERVAL):
+            try:
+                self._request(DistributedMessage.HEARTBEAT)
+            except (EOFError, OSError):
+                break
+
+
+# Quick dev test, i.e. a coordinator with local worker processes
+#   python -m batchmp.commons.distributed [num_tasks] [num_workers]
+if __name__ == '__main__':
+    import sys, tempfile, subprocess
+    from batchmp.commons.taskprocessor import TasksProcessor
+    from batchmp.commons.executors import TasksExecutorType
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        print('worker done {} tasks'.format(TasksWorker(sys.argv[2], num_slots = 2).run()))
+        sys.exit(0)
+
+    num_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    os.environ.setdefault(AUTHKEY_ENV, 'batchmp-dev-test')
+
+    from tests.commons.test_commons import _PidTask
+
+    address = os.path.join(tempfile.mkdtemp(), 'coordinator.sock')
+    workers = [subprocess.Popen([sys.executable, '-m', 'batchmp.commons.distributed', '--worker', address])
+                                                                                for _ in range(num_workers)]
+    tasks_processor = TasksProcessor(executor_options = dict(address = address))
+    (tasks_results, _), elapsed = tasks_processor.process_tasks([_PidTask(num) for num in range(num_tasks)],
+                                                                executor_type = TasksExecutorType.DISTRIBUTED)
+    print('{0} results from {1} worker processes in {2:.2f}s'.format(len(tasks_results),
+                                len({result.task_output.split()[1] for result in tasks_results}), elapsed))
+    for worker in workers:
+        worker.wait()
@@ -0,0 +1,249 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Pluggable TasksProcessor execution backends
+      . THREADS:     a thread pool, for tasks that mostly wait on child processes (e.g. ffmpeg)
+                     no worker forks, no tasks pickling
+      . PROCESSES:   a pool of worker processes, for Python-heavy tasks
+      . SERIAL:      runs tasks one by one, in the calling thread
+      . DISTRIBUTED: serves tasks to remote workers, see batchmp.commons.distributed
+'''
+import os, queue, multiprocessing
+from enum import IntEnum
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+
+class TasksExecutorType(IntEnum):
+    SERIAL      =  0x100000
+    THREADS     =  0x100001
+    PROCESSES   =  0x100002
+    DISTRIBUTED =  0x100003
+
+
+def execute_task(task):
+    ''' Module-level, so that process pools can pickle it by reference
+    '''
+    result = task.execute()
+    if result is not None:
+        # ties the result back to the task, e.g. for the job journal / retries
+        result.journal_key = task.journal_key()
+        result.task_id = task.task_id
+    return result
+
+
+class TasksExecutor(metaclass = ABCMeta):
+    ''' Abstract tasks execution backend
+        Used as a context manager, i.e.:
+            with TasksExecutor.create(TasksExecutorType.THREADS, num_workers = 4) as executor:
+                for result in executor.imap_unordered(tasks):
+                    ...
+    '''
+    # workers description, for progress messages
+    WORKERS_DESCRIPTION = 'workers'
+
+    # tasks run in the calling process, i.e. can report their progress via callbacks
+    IN_PROCESS = False
+
+    # tasks run on the calling host, i.e. can defer their I/O-bound work to the caller finalize stage
+    STAGED = False
+
+    # secs between re-checks of an adaptive max pending, while waiting on the pending tasks
+    ADAPTIVE_CHECK_INTERVAL = 1.0
+
+    def __init__(self, num_workers = None):
+        self.num_workers = num_workers if num_workers else self.default_num_workers()
+
+    @staticmethod
+    def default_num_workers():
+        return multiprocessing.cpu_count()
+
+    @staticmethod
+    def create(executor_type, num_workers = None, **executor_options):
+        ''' executor_options are backend-specific, e.g. the coordinator address for DISTRIBUTED
+        '''
+        if executor_type == TasksExecutorType.DISTRIBUTED:
+            from batchmp.commons.distributed import DistributedTasksExecutor
+            return DistributedTasksExecutor(num_workers = num_workers, **executor_options)
+        executor_class = {TasksExecutorType.SERIAL: SerialTasksExecutor,
+                          TasksExecutorType.THREADS: ThreadPoolTasksExecutor,
+                          TasksExecutorType.PROCESSES: ProcessPoolTasksExecutor}[executor_type]
+        return executor_class(num_workers = num_workers)
+
+    @abstractmethod
+    def imap_unordered(self, tasks, max_pending = None):
+        ''' Generates tasks results, in the order of completion
+            With max_pending, pulls the next task only when less tasks are pending,
+            i.e. lazy tasks generators are consumed at the pace of the pool
+            max_pending can also be adaptive, i.e. a callable returning the current limit
+        '''
+        pass
+
+    @staticmethod
+    def _pending_limit(max_pending):
+        ''' (current max pending callable, wait timeout for re-checking it)
+        '''
+        if callable(max_pending):
+            return max_pending, TasksExecutor.ADAPTIVE_CHECK_INTERVAL
+        return (lambda: max_pending), None
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+
+class SerialTasksExecutor(TasksExecutor):
+    ''' Runs tasks one by one
+    '''
+    IN_PROCESS = True
+
+    def __init__(self, num_workers = None):
+        super().__init__(num_workers = 1)
+
+    def imap_unordered(self, tasks, max_pending = None):
+        for task in tasks:
+            yield execute_task(task)
+
+
+class ThreadPoolTasksExecutor(TasksExecutor):
+    ''' Runs tasks in a pool of threads
+    '''
+    WORKERS_DESCRIPTION = 'worker threads'
+    IN_PROCESS = True
+    STAGED = True
+
+    def start(self):
+        self._pool = ThreadPoolExecutor(max_workers = self.num_workers)
+
+    def shutdown(self):
+        # on premature exits, do not start the still queued tasks
+        for future in getattr(self, '_pending', ()):
+            future.cancel()
+        self._pool.shutdown(wait = True)
+
+    def imap_unordered(self, tasks, max_pending = None):
+        if not max_pending:
+            self._pending = [self._pool.submit(execute_task, task) for task in tasks]
+        else:
+            pending_limit, timeout = self._pending_limit(max_pending)
+            self._pending = set()
+            for task in tasks:
+                self._pending.add(self._pool.submit(execute_task, task))
+                while len(self._pending) >= pending_limit():
+                    done, self._pending = wait(self._pending, timeout = timeout, return_when = FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+        for future in as_completed(self._pending):
+            yield future.result()
+
+
+class ProcessPoolTasksExecutor(TasksExecutor):
+    ''' Runs tasks in a pool of worker processes
+    '''
+    WORKERS_DESCRIPTION = 'worker processes'
+    STAGED = True
+
+    def start(self):
+        self._pool = multiprocessing.Pool(self.num_workers)
+
+    def shutdown(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def imap_unordered(self, tasks, max_pending = None):
+        if not max_pending:
+            # the pool tasks handler thread consumes the tasks eagerly
+            return self._pool.imap_unordered(execute_task, tasks)
+        return self._bounded_imap_unordered(tasks, max_pending)
+
+    def _bounded_imap_unordered(self, tasks, max_pending):
+        pending_limit, timeout = self._pending_limit(max_pending)
+        results = queue.Queue()
+        def _result():
+            result = results.get()
+            if isinstance(result, BaseException):
+                raise result
+            return result
+
+        num_pending = 0
+        for task in tasks:
+            self._pool.apply_async(execute_task, (task,), callback = results.put, error_callback = results.put)
+            num_pending += 1
+            while num_pending >= pending_limit():
+                try:
+                    result = results.get(timeout = timeout)
+                except queue.Empty:
+                    # re-check the limit
+                    continue
+                num_pending -= 1
+                if isinstance(result, BaseException):
+                    raise result
+                yield result
+
+        for _ in range(num_pending):
+            yield _result()
+
+
+# Quick dev test / execution backends benchmark
+#   python -m batchmp.commons.executors [num_tasks] [num_workers]
+if __name__ == '__main__':
+    import sys, time, resource, subprocess
+    from batchmp.commons.launcher import CmdLauncher
+
+    class _ShortTask:
+        ''' A short subprocess-bound task, i.e. ffprobe-like
+        '''
+        def execute(self):
+            return CmdLauncher.run(['true']).returncode
+
+    def run_backend(executor_type, num_tasks, num_workers):
+        start = time.perf_counter()
+        with TasksExecutor.create(executor_type, num_workers = num_workers) as executor:
+            results = executor.imap_unordered(_ShortTask() for _ in range(num_tasks))
+            next(results)
+            startup = time.perf_counter() - start
+            for _ in results:
+                pass
+        elapsed = time.perf_counter() - start
+
+        # max RSS is in bytes on macOS, in kilobytes elsewhere
+        rss_scale = 1 if sys.platform == 'darwin' else 1024
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale
+        children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rss_scale
+        print('{0:<10} {1} tasks, {2} workers: startup {3:.1f}ms, {4:.0f} tasks/s, '
+              'max RSS {5:.1f}MB (largest child {6:.1f}MB)'.format(executor_type.name, num_tasks,
+                                                        executor.num_workers, startup * 1e3, num_tasks / elapsed,
+                                                        rss / 2**20, children_rss / 2**20))
+
+    args = sys.argv[1:]
+    if args and args[0] == '--backend':
+        run_backend(TasksExecutorType[args[1]], int(args[2]), int(args[3]) or None)
+    else:
+        num_tasks = args[0] if args else '1000'
+        num_workers = args[1] if len(args) > 1 else '0'
+        # each backend in a separate process, to keep the RSS numbers apart
+        for executor_type in (TasksExecutorType.SERIAL, TasksExecutorType.THREADS, TasksExecutorType.PROCESSES):
+            subprocess.run([sys.executable, '-m', 'batchmp.commons.executors',
+                                                    '--backend', executor_type.name, num_tasks, num_workers])
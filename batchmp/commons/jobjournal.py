@@ -0,0 +1,171 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Durable job journal
+      . an append-only log of planned / started / completed / failed tasks,
+        one JSON record per line, so an interrupted job leaves at most a torn last line
+      . completed records hold the task input fingerprint and its output files sizes
+      . on resume, a task is done only if its input is unchanged and all of its outputs
+        are still there in full, otherwise it is redone
+      . tasks are recorded as planned once per journal, i.e. resumed runs do not grow it over again;
+        a journal whose job is done in full is discarded
+'''
+import os, json, time, threading
+from collections import namedtuple
+
+
+JournalEntry = namedtuple('JournalEntry', ['key', 'fingerprint', 'outputs'])
+
+
+class JobJournalEvent:
+    PLANNED = 'planned'
+    STARTED = 'started'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+
+class JobJournal:
+    ''' Append-only job journal, keyed by the tasks journal keys (e.g. their input file paths)
+    '''
+    JOURNAL_FNAME = '.batchmp_journal'
+
+    def __init__(self, journal_dir, name = None):
+        ''' Named journals share a journal dir, e.g. one per shard of a sharded run
+        '''
+        self.journal_path = self.path(journal_dir, name)
+        self._lock = threading.Lock()
+        self._file = None
+        self._completed, self._planned = self._load()
+
+    @classmethod
+    def path(cls, journal_dir, name = None):
+        fname = '{0}.{1}'.format(cls.JOURNAL_FNAME, name) if name else cls.JOURNAL_FNAME
+        return os.path.join(journal_dir, fname)
+
+    @classmethod
+    def exists(cls, journal_dir, name = None):
+        return os.path.isfile(cls.path(journal_dir, name))
+
+    @staticmethod
+    def fingerprint(fpath):
+        ''' Input file fingerprint, None if not accessible
+        '''
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    @property
+    def num_completed(self):
+        return len(self._completed)
+
+    def is_completed(self, key):
+        ''' Checks if a task was completed in a previous run,
+            and its outputs are still there in full
+        '''
+        entry = self._completed.get(key)
+        if not entry or entry.fingerprint != self.fingerprint(key):
+            return False
+        for output_path, output_size in entry.outputs:
+            try:
+                if os.path.getsize(output_path) != output_size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    # Records
+    def planned(self, key):
+        if key in self._planned:
+            return
+        self._planned.add(key)
+        self._record(JobJournalEvent.PLANNED, key)
+
+    def started(self, key):
+        self._record(JobJournalEvent.STARTED, key)
+
+    def completed(self, key, output_paths = ()):
+        outputs = []
+        for output_path in output_paths:
+            try:
+                outputs.append([output_path, os.path.getsize(output_path)])
+            except OSError:
+                pass
+        self._record(JobJournalEvent.COMPLETED, key, fingerprint = self.fingerprint(key), outputs = outputs)
+        self._completed[key] = JournalEntry(key, self.fingerprint(key), outputs)
+
+    def failed(self, key):
+        self._record(JobJournalEvent.FAILED, key)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def discard(self):
+        ''' Closes and removes the journal, i.e. once its job is done in full
+        '''
+        self.close()
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Helpers
+    def _record(self, event, key, **fields):
+        record = dict(event = event, key = key, time = time.time(), **fields)
+        line = '{}\n'.format(json.dumps(record))
+        with self._lock:
+            if not self._file:
+                os.makedirs(os.path.dirname(self.journal_path), exist_ok = True)
+                self._file = open(self.journal_path, 'a', encoding = 'utf-8')
+            self._file.write(line)
+            self._file.flush()
+            if event == JobJournalEvent.COMPLETED:
+                # completions are what a resume relies on
+                os.fsync(self._file.fileno())
+
+    def _load(self):
+        ''' Completed entries and planned keys of previous runs
+        '''
+        completed, planned = {}, set()
+        try:
+            with open(self.journal_path, encoding = 'utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        event, key = record['event'], record['key']
+                    except (ValueError, KeyError, TypeError):
+                        # torn record of an interrupted run
+                        continue
+                    if event == JobJournalEvent.PLANNED:
+                        planned.add(key)
+                    elif event == JobJournalEvent.COMPLETED:
+                        completed[key] = JournalEntry(key, record.get('fingerprint'),
+                                                            [tuple(output) for output in record.get('outputs', ())])
+                    elif event == JobJournalEvent.STARTED:
+                        # redone since, its outputs might be half-written
+                        completed.pop(key, None)
+        except OSError:
+            pass
+        return completed, planned
@@ -0,0 +1,394 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Low-overhead launcher for external commands (ffmpeg, ffprobe, etc.)
+      . takes argv lists directly, no shell quoting / splitting round trips
+      . resolves executables once per $PATH and reuses a single /dev/null stdin fd
+      . spawn strategy is tunable: with close_fds off (fds are non-inheritable
+        by default since Python 3.4) subprocess switches to posix_spawn where available,
+        otherwise it uses its (v)fork / exec path. Which one is faster depends on the platform,
+        see the benchmark below
+      . separate stdout / stderr capture, optionally bounded to the last N bytes,
+        and / or streamed line by line to callbacks
+      . line generators over a command output, with early termination
+      . records per-invocation wall time and child resource usage
+      . optional wall-clock timeout and no-progress stall detection,
+        killing the whole child process group on expiry
+'''
+import os, sys, time, shutil, signal, threading, subprocess, selectors
+from collections import namedtuple, deque
+
+
+class CmdProcessingError(Exception):
+    def __init__(self, message = None, result = None):
+        super().__init__(message)
+        self.result = result
+
+
+class CmdTimeoutError(CmdProcessingError):
+    ''' A command ran out of time, or stopped making progress
+    '''
+    def __init__(self, message = None, result = None, stalled = False):
+        super().__init__(message, result)
+        self.stalled = stalled
+
+
+CmdRUsage = namedtuple('CmdRUsage', ['user_time', 'system_time', 'max_rss', 'in_blocks', 'out_blocks'])
+CmdResult = namedtuple('CmdResult', ['argv', 'returncode', 'stdout', 'stderr', 'elapsed', 'rusage'])
+
+
+class CmdOutputCapture:
+    ''' Captures a child process output stream
+          . keeps at most capture_limit last bytes (None for unbounded, 0 for nothing)
+          . passes decoded lines to the on_line callback, if any
+    '''
+    MAX_LINE_SIZE = 1 << 20
+
+    def __init__(self, capture_limit = None, on_line = None, encoding = 'utf-8'):
+        self.capture_limit = capture_limit
+        self.on_line = on_line
+        self.encoding = encoding
+        self._chunks = deque()
+        self._size = 0
+        self._partial_line = b''
+
+    def feed(self, data):
+        if self.capture_limit != 0:
+            self._chunks.append(data)
+            self._size += len(data)
+            if self.capture_limit:
+                while self._size - len(self._chunks[0]) >= self.capture_limit:
+                    self._size -= len(self._chunks.popleft())
+
+        if self.on_line:
+            # ffmpeg ends its status lines with '\r'
+            lines = (self._partial_line + data).replace(b'\r', b'\n').split(b'\n')
+            self._partial_line = lines.pop()
+            if len(self._partial_line) > self.MAX_LINE_SIZE:
+                lines.append(self._partial_line)
+                self._partial_line = b''
+            for line in lines:
+                if line:
+                    self.on_line(line.decode(self.encoding, errors = 'replace'))
+
+    def close(self):
+        if self.on_line and self._partial_line:
+            self.on_line(self._partial_line.decode(self.encoding, errors = 'replace'))
+            self._partial_line = b''
+
+    @property
+    def output(self):
+        output = b''.join(self._chunks)
+        if self.capture_limit and len(output) > self.capture_limit:
+            output = output[-self.capture_limit:]
+        return output.decode(self.encoding, errors = 'replace')
+
+
+class CmdWatchdog:
+    ''' Watches a running command for a wall-clock timeout, and for stalls,
+        i.e. no progress for stall_timeout secs
+        is_progress tells if an output line means progress, by default any output line does
+    '''
+    def __init__(self, timeout = None, stall_timeout = None, is_progress = None):
+        now = time.monotonic()
+        self.deadline = now + timeout if timeout else None
+        self.stall_timeout = stall_timeout
+        self.is_progress = is_progress
+        self.last_progress = now
+
+    def line(self, line):
+        if not self.is_progress or self.is_progress(line):
+            self.last_progress = time.monotonic()
+
+    def watched(self, on_line):
+        ''' Wraps an output lines callback
+        '''
+        if not on_line:
+            return self.line
+        def _on_line(line):
+            self.line(line)
+            on_line(line)
+        return _on_line
+
+    @property
+    def wait_time(self):
+        ''' Secs till the next expiry check
+        '''
+        now = time.monotonic()
+        expiries = []
+        if self.deadline:
+            expiries.append(self.deadline - now)
+        if self.stall_timeout:
+            expiries.append(self.last_progress + self.stall_timeout - now)
+        return max(0.0, min(expiries)) if expiries else None
+
+    def check(self):
+        ''' Raises CmdTimeoutError on expiry
+        '''
+        now = time.monotonic()
+        if self.deadline and now >= self.deadline:
+            raise CmdTimeoutError('Timed out')
+        if self.stall_timeout and now - self.last_progress >= self.stall_timeout:
+            raise CmdTimeoutError('Stalled, no progress for {:.0f} secs'.format(self.stall_timeout),
+                                                                                            stalled = True)
+
+
+class CmdLauncher:
+    ''' Runs external commands
+    '''
+    READ_SIZE = 1 << 16
+
+    # output kept for error messages of streamed commands
+    ERROR_CAPTURE_LIMIT = 1 << 14
+
+    # close_fds = False lets subprocess use posix_spawn
+    CLOSE_FDS = True
+
+    _executables = {}
+    _executables_lock = threading.Lock()
+    _devnull = None
+
+    # poll() does not need a selector fd of its own, i.e. is cheaper for short-lived watches
+    _Selector = getattr(selectors, 'PollSelector', selectors.DefaultSelector)
+
+    @classmethod
+    def resolve(cls, executable):
+        ''' Full path of an executable, looked up once per $PATH value
+        '''
+        if os.path.dirname(executable):
+            return executable
+        key = (executable, os.environ.get('PATH'))
+        path = cls._executables.get(key)
+        if path is None:
+            path = shutil.which(executable) or executable
+            with cls._executables_lock:
+                cls._executables[key] = path
+        return path
+
+    @classmethod
+    def devnull(cls):
+        ''' Shared /dev/null fd, for the child processes stdin / discarded output
+        '''
+        if cls._devnull is None:
+            with cls._executables_lock:
+                if cls._devnull is None:
+                    cls._devnull = os.open(os.devnull, os.O_RDWR)
+        return cls._devnull
+
+    @classmethod
+    def run(cls, argv, *, shell = False, merge_stderr = False, capture_limit = None,
+                                    on_stdout = None, on_stderr = None, check = True, encoding = 'utf-8',
+                                    capture_stdout = True, timeout = None, stall_timeout = None, is_progress = None):
+        ''' Runs a command, returning CmdResult
+            argv is a list of arguments, or a command line string for shell commands
+            With merge_stderr, stderr goes to stdout (i.e. to its capture and its callback)
+            Without capture_stdout, stdout only goes to its callback (e.g. for progress output)
+            With check, raises CmdProcessingError if the command fails
+            With timeout / stall_timeout, kills the command process group and raises CmdTimeoutError
+            when the command runs out of time / does not progress for stall_timeout secs
+        '''
+        if not shell:
+            argv = list(argv)
+            argv[0] = cls.resolve(argv[0])
+
+        watchdog = None
+        if (timeout or stall_timeout) and sys.platform != 'win32':
+            watchdog = CmdWatchdog(timeout, stall_timeout, is_progress)
+            on_stdout = watchdog.watched(on_stdout)
+            if not merge_stderr:
+                on_stderr = watchdog.watched(on_stderr)
+
+        stdout_capture = CmdOutputCapture(capture_limit if capture_stdout else 0, on_stdout, encoding)
+        stderr_capture = stdout_capture if merge_stderr else CmdOutputCapture(capture_limit, on_stderr, encoding)
+
+        start = time.perf_counter()
+        proc = subprocess.Popen(argv, shell = shell, close_fds = cls.CLOSE_FDS,
+                                stdin = cls.devnull(), stdout = subprocess.PIPE,
+                                stderr = subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                                # own process group, to kill the command along with its children
+                                start_new_session = watchdog is not None)
+        try:
+            cls._pump(proc, stdout_capture, stderr_capture, watchdog)
+            returncode, rusage = cls._wait(proc)
+        except BaseException as e:
+            returncode, rusage = None, None
+            if proc.returncode is None:
+                cls._kill(proc, group = watchdog is not None)
+                returncode, rusage = cls._wait(proc)
+            for stream in (proc.stdout, proc.stderr):
+                if stream:
+                    stream.close()
+            if isinstance(e, CmdTimeoutError):
+                e.args = ('{0}: {1}\n{2}'.format(e.args[0], ' '.join(argv) if not shell else argv,
+                                                                    stderr_capture.output),)
+                # the killed command resources usage still counts
+                e.result = CmdResult(argv, returncode, '', stderr_capture.output,
+                                                                time.perf_counter() - start, rusage)
+            raise
+        elapsed = time.perf_counter() - start
+
+        result = CmdResult(argv, returncode, stdout_capture.output,
+                                    '' if merge_stderr else stderr_capture.output, elapsed, rusage)
+        if check and returncode != 0:
+            raise CmdProcessingError(result.stdout if merge_stderr else (result.stderr or result.stdout),
+                                                                                                result = result)
+        return result
+
+    @classmethod
+    def ilines(cls, argv, *, stderr = True, capture_limit = ERROR_CAPTURE_LIMIT, check = True, encoding = 'utf-8'):
+        ''' Runs a command, generating lines of its stderr (or stdout) output as they arrive
+            The other output stream is discarded
+            Closing the generator before the command is done terminates the command
+            With check, raises CmdProcessingError if the command fails,
+            with the last capture_limit bytes of the output as the message
+        '''
+        argv = list(argv)
+        argv[0] = cls.resolve(argv[0])
+
+        lines = deque()
+        capture = CmdOutputCapture(capture_limit if check else 0, lines.append, encoding)
+
+        proc = subprocess.Popen(argv, close_fds = cls.CLOSE_FDS, stdin = cls.devnull(),
+                                stdout = cls.devnull() if stderr else subprocess.PIPE,
+                                stderr = subprocess.PIPE if stderr else cls.devnull())
+        output = proc.stderr if stderr else proc.stdout
+        try:
+            for data in iter(lambda: os.read(output.fileno(), cls.READ_SIZE), b''):
+                capture.feed(data)
+                while lines:
+                    yield lines.popleft()
+            capture.close()
+            while lines:
+                yield lines.popleft()
+            returncode, _ = cls._wait(proc)
+        finally:
+            if proc.returncode is None:
+                # terminated early
+                proc.kill()
+                proc.wait()
+            output.close()
+
+        if check and returncode != 0:
+            raise CmdProcessingError(capture.output)
+
+    # Internal helpers
+    @classmethod
+    def _pump(cls, proc, stdout_capture, stderr_capture, watchdog = None):
+        ''' Reads the child output streams until EOF
+            With a watchdog, raises CmdTimeoutError on expiry
+        '''
+        captures = {proc.stdout: stdout_capture}
+        if proc.stderr:
+            captures[proc.stderr] = stderr_capture
+
+        if sys.platform == 'win32':
+            # no select() on pipes
+            stdout, stderr = proc.communicate()
+            for stream, data in ((proc.stdout, stdout), (proc.stderr, stderr)):
+                if data:
+                    captures[stream].feed(data)
+        elif len(captures) == 1 and not watchdog:
+            # merged output, can just read it through
+            for data in iter(lambda: os.read(proc.stdout.fileno(), cls.READ_SIZE), b''):
+                stdout_capture.feed(data)
+            proc.stdout.close()
+        else:
+            with cls._Selector() as selector:
+                for stream in captures:
+                    selector.register(stream, selectors.EVENT_READ)
+                while selector.get_map():
+                    events = selector.select(watchdog.wait_time if watchdog else None)
+                    if watchdog:
+                        watchdog.check()
+                    for key, _ in events:
+                        data = os.read(key.fd, cls.READ_SIZE)
+                        if data:
+                            captures[key.fileobj].feed(data)
+                        else:
+                            selector.unregister(key.fileobj)
+                            key.fileobj.close()
+
+        for capture in set(captures.values()):
+            capture.close()
+
+    @staticmethod
+    def _kill(proc, group = False):
+        if group:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+                return
+            except OSError:
+                pass
+        proc.kill()
+
+    @staticmethod
+    def _wait(proc):
+        ''' Waits for the child process, returning (returncode, CmdRUsage)
+        '''
+        if not hasattr(os, 'wait4'):
+            return proc.wait(), None
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+        except ChildProcessError:
+            return proc.wait(), None
+
+        proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        # max rss is in bytes on macOS, in kilobytes elsewhere
+        max_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        return proc.returncode, CmdRUsage(rusage.ru_utime, rusage.ru_stime, max_rss,
+                                                                    rusage.ru_inblock, rusage.ru_oublock)
+
+
+# Quick dev test / spawn overhead benchmark
+#   python -m batchmp.commons.launcher [num_calls]
+if __name__ == '__main__':
+    import shlex, tempfile, json
+
+    num_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    # ffprobe-sized output, i.e. a typical ffprobe JSON
+    probe_output = json.dumps({'streams': [{'index': 0, 'codec_name': 'mp3', 'codec_type': 'audio',
+                                            'sample_rate': '44100', 'channels': 2, 'duration': '5.297619',
+                                            'disposition': {'default': 0, 'dub': 0, 'original': 0}}],
+                               'format': {'filename': 'noise.mp3', 'format_name': 'mp3', 'duration': '5.328980',
+                                          'tags': {'title': 'Background noise', 'artist': 'batchmp'}}}, indent = 4)
+    with tempfile.NamedTemporaryFile('w', suffix = '.json', delete = False) as f:
+        f.write(probe_output * 4)
+    cmd = 'cat {}'.format(shlex.quote(f.name))
+
+    def legacy_run(cmd):
+        proc = subprocess.Popen(shlex.split(cmd), stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+        return proc.communicate()[0].decode('utf-8')
+
+    def launcher_run(argv, close_fds, merge_stderr):
+        CmdLauncher.CLOSE_FDS = close_fds
+        return CmdLauncher.run(argv, merge_stderr = merge_stderr).stdout
+
+    benchmarks = (('shell string / Popen', lambda: legacy_run(cmd)),
+                  ('launcher, merged', lambda: launcher_run(['cat', f.name], True, True)),
+                  ('launcher', lambda: launcher_run(['cat', f.name], True, False)),
+                  ('launcher, posix_spawn', lambda: launcher_run(['cat', f.name], False, False)))
+    try:
+        for title, run in benchmarks:
+            start = time.perf_counter()
+            for _ in range(num_calls):
+                run()
+            elapsed = time.perf_counter() - start
+            print('{0:<22} {1} calls: {2:.2f}s, {3:.1f}us per call'.format(title, num_calls, elapsed,
+                                                                                elapsed / num_calls * 1e6))
+        CmdLauncher.CLOSE_FDS = True
+        result = CmdLauncher.run(['cat', f.name])
+        print('last call: {0:.1f}us wall, {1}'.format(result.elapsed * 1e6, result.rusage))
+    finally:
+        os.remove(f.name)
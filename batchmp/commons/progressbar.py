@@ -15,6 +15,7 @@
 ''' A simple single-line console progress bar
     Displays progress by fractions of 10%
     Supports premature stops & info messages during execution
+    Optionally polls a live status, i.e. finer-grained progress with a readout (ETA, speed, ...)
 '''
 import sys, time
 from bisect import bisect as bs
@@ -29,10 +30,10 @@ class CmdProgressBarRefreshRate:
 
 
 @contextmanager
-def progress_bar(starts_from = 0, refresh_rate = CmdProgressBarRefreshRate.MODERATE):
+def progress_bar(starts_from = 0, refresh_rate = CmdProgressBarRefreshRate.MODERATE, live_status = None):
     ''' Enables usage via a runtime context
     '''
-    p_bar = CmdProgressBar(starts_from, refresh_rate)
+    p_bar = CmdProgressBar(starts_from, refresh_rate, live_status)
     p_bar.start()
     try:
         yield p_bar
@@ -46,7 +47,14 @@ class CmdProgressBarUpdateTypes:
 
 
 class CmdProgressBar(object):
-    def __init__(self, start_from=0, refresh_rate = CmdProgressBarRefreshRate.MODERATE):
+    # cleared line width
+    LINE_WIDTH = 110
+
+    def __init__(self, start_from=0, refresh_rate = CmdProgressBarRefreshRate.MODERATE, live_status = None):
+        ''' live_status is a callable returning (progress, readout),
+            polled by the worker thread, i.e. with no queueing
+            When set, its progress takes over the enqueued one
+        '''
         self._queue = queue.Queue(1)  # used to communicate with the worker thread
         self._end_event = threading.Event()  # used to exit
 
@@ -54,7 +62,8 @@ class CmdProgressBar(object):
         self._info_msg = None
 
         self._bar_thread = threading.Thread(target=self._show_progress,
-                                            args=(start_from, refresh_rate, self._end_event, self._queue,))
+                                            args=(start_from, refresh_rate, self._end_event, self._queue,
+                                                                                            live_status))
         self._bar_thread.daemon = True
 
     @property
@@ -79,10 +88,11 @@ class CmdProgressBar(object):
 
     # the worker thread method
     @staticmethod
-    def _show_progress(last_known_progress, refresh_rate, end_event, queue):
+    def _show_progress(last_known_progress, refresh_rate, end_event, queue, live_status = None):
         progress_values = [i for i in range(0, 110, 10)]  # [0, 10, ..., 100]
         chars = '|/-\\'
         msg = None
+        readout = ''
         while True:
             if not queue.full():
                 # nothing in the queue yet, keep showing the last known progres
@@ -98,19 +108,23 @@ class CmdProgressBar(object):
                 # signal that the value has been consumed
                 queue.task_done()
 
+            if live_status and not end_event.is_set():
+                progress, readout = live_status()
+                readout = ' {}'.format(readout)
+
             num_progress_vals = bs(progress_values, progress)
             progress_info = '..'.join([''.join((str(i), '%')) for i in progress_values[:num_progress_vals]])
             progress_info = ''.join((progress_info, '.' * (53 - len(progress_info))))
 
             # for info msg updates, display the message
             if msg != None:
-                sys.stdout.write(''.join(('\r', ' ' * 70, '\r')))
+                sys.stdout.write(''.join(('\r', ' ' * CmdProgressBar.LINE_WIDTH, '\r')))
                 sys.stdout.write(''.join((msg, '\n')))
                 msg = None
 
             # show pogress
             for c in chars:
-                sys.stdout.write('\r[ {0} ..{1}.. ]'.format(c, progress_info))
+                sys.stdout.write('\r[ {0} ..{1}.. ]{2}'.format(c, progress_info, readout))
                 sys.stdout.flush()
                 time.sleep(refresh_rate)
 
@@ -136,7 +150,7 @@ class CmdProgressBar(object):
         # OK to stop now
         self._end_event.set()
         self._bar_thread.join()
-        sys.stdout.write(''.join(('\r', ' ' * 70, '\r')))
+        sys.stdout.write(''.join(('\r', ' ' * CmdProgressBar.LINE_WIDTH, '\r')))
         sys.stdout.flush()
 
 # Quick Dev Test
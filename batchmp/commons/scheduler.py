@@ -0,0 +1,97 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Cost-aware tasks scheduling
+      . estimates tasks costs via pluggable cost models
+      . dispatches the most expensive tasks first (Longest Processing Time first),
+        so that a long task does not end up as the last straggler keeping the pool waiting
+      . predicts the makespan (i.e. the pool total running time) of a schedule,
+        for comparing with the actual one
+'''
+import heapq
+from collections import namedtuple
+from abc import ABCMeta, abstractmethod
+from batchmp.commons.bulkprober import BulkProber
+
+
+SchedulingReport = namedtuple('SchedulingReport', ['predicted_makespan', 'submit_order_makespan',
+                                                                                    'actual_makespan'])
+
+
+class TasksCostModel(metaclass = ABCMeta):
+    ''' Abstract tasks cost model
+    '''
+    @abstractmethod
+    def cost(self, task):
+        ''' Estimated task cost, in arbitrary (but consistent) units
+        '''
+        return 1.0
+
+
+class UniformCostModel(TasksCostModel):
+    ''' All tasks cost the same, i.e. keeps the submit order
+    '''
+    def cost(self, task):
+        return 1.0
+
+
+class TaskEstimateCostModel(TasksCostModel):
+    ''' Asks the tasks themselves, via Task.estimated_cost()
+        Tasks that can not tell cost the default cost
+    '''
+    def __init__(self, default_cost = 1.0):
+        self.default_cost = default_cost
+
+    def cost(self, task):
+        estimated_cost = task.estimated_cost()
+        return estimated_cost if estimated_cost is not None else self.default_cost
+
+
+class LPTScheduler:
+    ''' Longest Processing Time first tasks scheduler
+    '''
+    def __init__(self, cost_model = None):
+        self.cost_model = cost_model if cost_model else TaskEstimateCostModel()
+        self.submit_order_costs = self.costs = ()
+
+    def schedule(self, tasks):
+        ''' Tasks in the dispatch order, most expensive first
+            Cost estimates can be subprocess-bound (e.g. media probes), so are bulk-probed
+        '''
+        tasks = list(tasks)
+        self.submit_order_costs = BulkProber(self.cost_model.cost).map(tasks)
+
+        # sorted is stable, i.e. tasks of the same cost keep their submit order
+        order = sorted(range(len(tasks)), key = lambda idx: self.submit_order_costs[idx], reverse = True)
+        self.costs = [self.submit_order_costs[idx] for idx in order]
+        return [tasks[idx] for idx in order]
+
+    @staticmethod
+    def makespan(costs, num_workers):
+        ''' Makespan of dispatching tasks in the costs order to the first available worker
+        '''
+        workers = [0.0] * max(1, min(num_workers, len(costs)))
+        for cost in costs:
+            heapq.heapreplace(workers, workers[0] + cost)
+        return max(workers) if costs else 0.0
+
+    def report(self, num_workers, actual_work, actual_makespan):
+        ''' Predicted vs actual makespans
+            Cost units are calibrated to seconds via the actual total work, i.e. the sum of the tasks durations
+        '''
+        total_cost = sum(self.costs)
+        scale = actual_work / total_cost if total_cost else 0.0
+        return SchedulingReport(self.makespan(self.costs, num_workers) * scale,
+                                self.makespan(self.submit_order_costs, num_workers) * scale,
+                                actual_makespan)
@@ -0,0 +1,104 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Static tasks plans
+      . a deterministic, diffable JSON manifest of the tasks of a run and their estimated costs
+      . splits the tasks into shards balanced by cost (not by count),
+        so that independent processes (e.g. a Slurm job array, cron jobs across boxes)
+        can each run their own shard, with no coordinator
+'''
+import os, json, heapq
+from collections import namedtuple
+from batchmp.commons.bulkprober import BulkProber
+from batchmp.commons.scheduler import TaskEstimateCostModel
+
+
+TaskPlanEntry = namedtuple('TaskPlanEntry', ['key', 'task_type', 'cost'])
+
+
+class TasksPlan:
+    ''' Tasks plan, keyed by the tasks journal keys (e.g. their input file paths)
+    '''
+    VERSION = 1
+
+    def __init__(self, entries, **info):
+        # sorted by key, i.e. independent of the directory walk order
+        self.entries = sorted(entries, key = lambda entry: entry.key)
+        self.info = info
+
+    @classmethod
+    def build(cls, tasks, cost_model = None, **info):
+        ''' Plans tasks that have journal keys
+            info is any extra JSON-serializable run info, e.g. the source / target directories
+        '''
+        tasks = [task for task in tasks if task.journal_key() is not None]
+        cost_model = cost_model if cost_model else TaskEstimateCostModel()
+        costs = BulkProber(cost_model.cost).map(tasks)
+        return cls([TaskPlanEntry(task.journal_key(), type(task).__name__, round(cost, 3))
+                                                                for task, cost in zip(tasks, costs)], **info)
+
+    @staticmethod
+    def parse_shard(shard_spec):
+        ''' "i/n" => (i, n), shards are numbered from 1
+        '''
+        try:
+            shard, num_shards = (int(value) for value in shard_spec.split('/'))
+        except ValueError:
+            raise ValueError('Invalid shard: "{}", expected "i/n"'.format(shard_spec))
+        if not 1 <= shard <= num_shards:
+            raise ValueError('Invalid shard: "{}", expected 1 <= i <= n'.format(shard_spec))
+        return shard, num_shards
+
+    @property
+    def total_cost(self):
+        return sum(entry.cost for entry in self.entries)
+
+    def partition(self, num_shards):
+        ''' Plan entries split into shards of balanced costs
+            Most expensive first, each to the least loaded shard (ties go to the lower shard),
+            i.e. the same plan is always split the same way
+        '''
+        shards = [[] for _ in range(num_shards)]
+        loads = [(0.0, idx) for idx in range(num_shards)]
+        for entry in sorted(self.entries, key = lambda entry: (-entry.cost, entry.key)):
+            load, idx = heapq.heappop(loads)
+            shards[idx].append(entry)
+            heapq.heappush(loads, (load + entry.cost, idx))
+        return [sorted(shard_entries, key = lambda entry: entry.key) for shard_entries in shards]
+
+    def shard_tasks(self, tasks, shard, num_shards):
+        ''' Tasks of a shard, i.e. tasks not in the plan are left out
+        '''
+        keys = {entry.key for entry in self.partition(num_shards)[shard - 1]}
+        return [task for task in tasks if task.journal_key() in keys]
+
+    # Manifest
+    def save(self, manifest_path):
+        manifest = dict(version = self.VERSION, info = self.info,
+                        tasks = [entry._asdict() for entry in self.entries])
+        # written in full or not at all
+        tmp_path = '{}.part'.format(manifest_path)
+        with open(tmp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(manifest, f, indent = 2, sort_keys = True, ensure_ascii = False)
+            f.write('\n')
+        os.replace(tmp_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path):
+        with open(manifest_path, encoding = 'utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != cls.VERSION:
+            raise ValueError('Unsupported tasks manifest version: {}'.format(manifest.get('version')))
+        return cls([TaskPlanEntry(entry['key'], entry['task_type'], entry['cost']) for entry in manifest['tasks']],
+                                                                                        **manifest.get('info', {}))
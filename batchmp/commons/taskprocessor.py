@@ -12,19 +12,80 @@
 ## GNU General Public License for more details.
 
 
-import copyreg, types, multiprocessing
 from abc import ABCMeta, abstractmethod
 from batchmp.commons.progressbar import progress_bar, CmdProgressBarRefreshRate
+import time, itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 from batchmp.commons.utils import timed, MiscHelpers
+from batchmp.commons.executors import TasksExecutor, TasksExecutorType
+from batchmp.commons.scheduler import LPTScheduler
+from batchmp.commons.cpubudget import CPUBudgetPlanner
+from batchmp.commons.taskprogress import TasksProgress
+from batchmp.commons.taskreport import TasksReport
 
 
 class Task(metaclass = ABCMeta):
     ''' Abstract TasksProcessor task
     '''
+    # preferred execution backend
+    # tasks that mostly wait on child processes do well with threads,
+    # Python-heavy tasks should ask for TasksExecutorType.PROCESSES
+    executor_type = TasksExecutorType.THREADS
+
+    # CPU threads budget of the task child processes, None if not planned
+    cpu_threads = None
+
+    # dispatch id, for tying the task results back to the task
+    task_id = None
+
+    # intra-task progress callback, taking the progress weight done so far and the output bytes
+    # set for tasks running in the calling process (e.g. in a thread pool), None otherwise
+    progress_reporter = None
+
+    # set when the task I/O-bound work (e.g. moving its outputs to the target dir)
+    # can be deferred to the finalize stage, i.e. to free the task pool slot for the next task
+    staged = False
+
     @abstractmethod
     def execute(self):
         return TaskResult()
 
+    def finalize(self, task_result):
+        ''' Finalize stage of results with deferred I/O-bound work (i.e. with finalize_pending),
+            run in the finalize stage pool of the calling process
+        '''
+        return task_result
+
+    def estimated_cost(self):
+        ''' Estimated task cost, for scheduling
+            None if not known
+        '''
+        return None
+
+    def threads_hint(self):
+        ''' Number of CPU threads the task can make good use of
+        '''
+        return 1
+
+    def journal_key(self):
+        ''' Key of the task in a job journal, e.g. its input file path
+            None if the task is not journaled
+        '''
+        return None
+
+    def progress_weight(self):
+        ''' Task weight in the run progress, e.g. its media duration
+            None if not known
+        '''
+        return None
+
+    def throughput_key(self):
+        ''' Key of the task kind of processing in the throughput history, e.g. its operation / codec
+            The task throughput is its progress weight per sec
+            None if not recorded
+        '''
+        return None
+
 
 class TaskResult:
     ''' TasksProcessor Task result
@@ -32,7 +93,26 @@ class TaskResult:
     def __init__(self):
         self._task_steps_info_msgs = []
         self._task_steps_durations = []
+        self._output_paths = []
         self._succeeded = False
+        self.journal_key = None
+        self.task_id = None
+
+        # state of the I/O-bound work deferred to the finalize stage, if any
+        self.finalize_state = None
+
+        # timed out / stalled task runs can be retried
+        self.retryable = False
+        self.num_retries = 0
+        self.num_timeouts = 0
+        self.num_stalls = 0
+
+        # resource usage of the task child processes, i.e. of the commands it ran
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.max_rss = 0
+        self.in_blocks = 0
+        self.out_blocks = 0
 
     def add_task_step_duration(self, step_duration):
         self._task_steps_durations.append(step_duration)
@@ -40,6 +120,50 @@ class TaskResult:
     def add_task_step_info_msg(self, step_info_msg):
         self._task_steps_info_msgs.append(step_info_msg)
 
+    def add_timeout(self, stalled = False):
+        ''' Records a timed out (or stalled) task run
+        '''
+        if stalled:
+            self.num_stalls += 1
+        else:
+            self.num_timeouts += 1
+        self.retryable = True
+
+    def add_retried(self, previous_result):
+        ''' Accounts for a previous, retried run of the task
+        '''
+        self.num_retries += previous_result.num_retries + 1
+        self.num_timeouts += previous_result.num_timeouts
+        self.num_stalls += previous_result.num_stalls
+        self._task_steps_durations.extend(previous_result._task_steps_durations)
+        self.add_rusage(previous_result)
+
+    def add_rusage(self, rusage):
+        ''' Accounts for a child process resource usage, e.g. a CmdRUsage
+        '''
+        if rusage is None:
+            return
+        self.user_time += rusage.user_time
+        self.system_time += rusage.system_time
+        self.max_rss = max(self.max_rss, rusage.max_rss)
+        self.in_blocks += rusage.in_blocks
+        self.out_blocks += rusage.out_blocks
+
+    @property
+    def cpu_time(self):
+        return self.user_time + self.system_time
+
+    @property
+    def finalize_pending(self):
+        return self.finalize_state is not None
+
+    def add_output_path(self, output_path):
+        self._output_paths.append(output_path)
+
+    @property
+    def output_paths(self):
+        return self._output_paths
+
     def add_report_msg(self, processed_fpath):
         task_duration_str = MiscHelpers.time_delta_str(self.task_duration)
         self.add_task_step_info_msg('Done processing\n {0}\n in {1}'.format(
@@ -53,97 +177,374 @@ class TaskResult:
 
     @property
     def task_output(self):
-        task_output = None
-        for info_msg in self._task_steps_info_msgs:
-            task_output = '{0}{1}{2}'.format(task_output if task_output else '',
-                                                '\n' if task_output else '',
-                                                info_msg)
-        return task_output
+        if not self._task_steps_info_msgs:
+            return None
+        return '\n'.join(self._task_steps_info_msgs)
 
     @property
     def task_duration(self):
-        task_duration = 0.0
-        for step_duration in self._task_steps_durations:
-            task_duration += step_duration
-        return task_duration
+        return sum(self._task_steps_durations, 0.0)
+
+
+class _FinalizeStage:
+    ''' Finalizes results with deferred I/O-bound work in a pool of threads
+        Pending finalizations are bounded, i.e. when the finalize pool falls behind
+        the caller is held back (and so are the tasks temp outputs)
+    '''
+    # max pending finalizations per finalize worker
+    PENDING_FACTOR = 2
+
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self._pool = None
+        self._pending = {}
+
+    def __enter__(self):
+        if self.num_workers:
+            self._pool = ThreadPoolExecutor(max_workers = self.num_workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # pending finalizations are completed even on premature exits, i.e. no outputs are left behind
+        if self._pool:
+            self._pool.shutdown(wait = True)
+        return False
+
+    def submit(self, task, result):
+        ''' Generates the (task, result) finalized while waiting for a free finalize slot
+        '''
+        self._pending[self._pool.submit(task.finalize, result)] = task
+        while len(self._pending) >= self.num_workers * self.PENDING_FACTOR:
+            yield from self._wait(return_when = FIRST_COMPLETED)
+
+    def finalized(self):
+        ''' Generates the (task, result) finalized so far
+        '''
+        return self._wait(timeout = 0)
+
+    def drain(self):
+        return self._wait(return_when = ALL_COMPLETED)
+
+    def _wait(self, return_when = FIRST_COMPLETED, timeout = None):
+        if not self._pending:
+            return
+        done, _ = wait(self._pending, timeout = timeout, return_when = return_when)
+        for future in done:
+            task = self._pending.pop(future)
+            yield task, future.result()
 
 
 class TasksProcessor:
-    ''' Runs cmd-line Tasks, sequentially or in a pool of processes
-        Displays progress / tasks done
+    ''' Runs cmd-line Tasks, sequentially or in a pool of threads / processes
+        Pooled tasks are dispatched most expensive first, as estimated by the cost model
+        The available CPUs are split between the pool workers and the tasks threads
+        Tasks streams are dispatched as they come, with a bounded number of pending tasks
+        With a job journal, skips tasks completed in previous runs and records the tasks progress
+        Timed out / stalled tasks are re-queued, with bounded retries and backoff
+        With a concurrency controller, adapts the number of running pool tasks to the system pressure
+        Pooled tasks I/O-bound work (e.g. moving their outputs) is finalized in a separate finalize pool,
+        so that it overlaps with the CPU-bound work of the next tasks
+        Aggregates the tasks results into a run report as they come, keeping them only if asked
+        Displays progress / tasks done, with rate-limited info messages
     '''
-    def _process_task(self, task):
-        result = task.execute()
-        return result
+    # streaming, max pending tasks per pool worker
+    STREAM_PENDING_FACTOR = 2
+
+    # retries of timed out / stalled tasks
+    MAX_RETRIES = 2
+    # secs before the first retry round, doubled with each next round
+    RETRY_BACKOFF = 5.0
+
+    # min secs between the info messages, the tasks done in between are summarized
+    INFO_MSG_INTERVAL = 1.0
+
+    # finalize stage pool width, 0 for finalizing within the tasks pool slots
+    FINALIZE_WORKERS = 2
+
+    def __init__(self, cost_model = None, cpu_budget_planner = None, journal = None,
+                                        max_retries = None, retry_backoff = None, executor_options = None,
+                                        records_path = None, concurrency_controller = None,
+                                        finalize_workers = None, throughput_history = None):
+        self.cost_model = cost_model
+        self.cpu_budget_planner = cpu_budget_planner
+        self.journal = journal
+        self.max_retries = max_retries if max_retries is not None else self.MAX_RETRIES
+        self.retry_backoff = retry_backoff if retry_backoff is not None else self.RETRY_BACKOFF
+        self.executor_options = executor_options if executor_options else {}
+        self.records_path = records_path
+        self.concurrency_controller = concurrency_controller
+        self.finalize_workers = finalize_workers if finalize_workers is not None else self.FINALIZE_WORKERS
+        self.throughput_history = throughput_history
+        self.tasks_report = None
+        self.scheduling_report = None
+        self.cpu_budget = None
+        self.num_skipped = 0
 
     @timed
-    def process_tasks(self, tasks_queue, serial_exec = False, num_workers = None, quiet = False):
+    def process_tasks(self, tasks_queue, serial_exec = False, num_workers = None, quiet = False,
+                                                                    executor_type = None, keep_results = True):
+        ''' With keep_results off, the tasks results are only aggregated into the tasks report
+        '''
         tasks_results = []
-        cpu_core_time = 0.0
+        self.tasks_report = TasksReport(self.records_path)
 
+        tasks_queue = list(self._pending_tasks(tasks_queue))
         num_tasks = len(tasks_queue)
         serial_exec = serial_exec or num_tasks == 1
         if num_tasks > 0:
+            executor_type = self._executor_type(tasks_queue, serial_exec, executor_type)
+
+            scheduler = None
+            if executor_type != TasksExecutorType.SERIAL:
+                scheduler = LPTScheduler(self.cost_model)
+                tasks_queue = scheduler.schedule(tasks_queue)
+
+            num_workers = self._plan_cpu_budget(tasks_queue, executor_type, num_workers)
+            num_workers, max_pending = self._start_concurrency_controller(executor_type, num_workers)
+            executor = TasksExecutor.create(executor_type, num_workers = num_workers, **self.executor_options)
+
             # Pre-processing msgs
-            if serial_exec:
+            if executor_type == TasksExecutorType.SERIAL:
                 print('Processing {0} {1}'.format(num_tasks,
                                                         'task' if num_tasks == 1 else 'tasks sequentially'))
+            elif executor_type == TasksExecutorType.DISTRIBUTED:
+                print('Serving {0} tasks to remote workers at {1}'.format(num_tasks, executor.address_description))
             else:
-                if not num_workers:
-                    num_workers = multiprocessing.cpu_count()
-                print('Processing {0} tasks with pool of {1} worker processes'.format(num_tasks, num_workers))
-
-            # start showing progress
-            with progress_bar(refresh_rate = CmdProgressBarRefreshRate.MODERATE) as p_bar:
-                def _make_progress(result):
-                    nonlocal cpu_core_time
-                    tasks_results.append(result)
-                    if not quiet:
-                        p_bar.info_msg = result.task_output
-                    cpu_core_time += result.task_duration
-                    p_bar.progress = len(tasks_results) / num_tasks * 100
-
-                if serial_exec:
-                    # just loop through the queue of tasks
-                    for task in tasks_queue:
-                        result = self._process_task(task)
-                        _make_progress(result)
-                else:
-                    # init the pool and kick it off
-                    with multiprocessing.Pool(num_workers) as pool:
-                        for result in pool.imap_unordered(self._process_task, tasks_queue):
-                            _make_progress(result)
+                print('Processing {0} tasks with pool of {1} {2}'.format(num_tasks, executor.num_workers,
+                                                                            executor.WORKERS_DESCRIPTION))
+            self._concurrency_msg(max_pending)
+
+            # start showing progress, weighted by the tasks progress weights
+            tasks_progress = TasksProgress(tasks_queue)
+            with progress_bar(refresh_rate = CmdProgressBarRefreshRate.MODERATE,
+                                                            live_status = tasks_progress.status) as p_bar:
+                # kick off the executor
+                start = time.perf_counter()
+                with executor, self.tasks_report:
+                    results = self._execute(executor, tasks_queue, max_pending = max_pending,
+                                                                            tasks_progress = tasks_progress)
+                    tasks_results = self._collect_results(results, p_bar, lambda: num_tasks,
+                                                                        quiet = quiet, keep_results = keep_results)
+
+            if scheduler:
+                self.scheduling_report = scheduler.report(executor.num_workers, self.tasks_report.tasks_duration,
+                                                                            time.perf_counter() - start)
 
         # return tasks results, aggregate CPU cores time, and total time elapsed (via @timed)
-        return tasks_results, cpu_core_time
-
-
-"""
-    Python multiprocessing pickles stuff, and bound methods are not picklable
-    The code below serves as a workaround, more at:
-    http://bytes.com/topic/python/answers/552476-why-cant-you-pickle-instancemethods#edit2155350
-"""
-def _pickle_method(method):
-    func_name = method.im_func.__name__
-    obj = method.im_self
-    cls = method.im_class
-
-    if func_name.startswith('__') and not func_name.endswith('__'):
-        cls_name = cls.__name__.lstrip('_')
-        if cls_name:
-            func_name = '_' + cls_name + func_name
-
-    return _unpickle_method, (func_name, obj, cls)
-
-def _unpickle_method(func_name, obj, cls):
-    for cls in cls.mro():
-        try:
-            func = cls.__dict__[func_name]
-        except KeyError:
-            pass
-        else:
-            break
-    return func.__get__(obj, cls)
+        return tasks_results, self.tasks_report.tasks_duration
+
+    @timed
+    def process_tasks_stream(self, tasks_stream, serial_exec = False, num_workers = None, quiet = False,
+                                                                    executor_type = None, keep_results = True):
+        ''' Processes tasks as they are generated, e.g. by a lazy directory walk
+            Tasks generation is held back while the pool has enough pending tasks,
+            so memory stays flat regardless of the number of tasks (with keep_results off)
+            The executor type and the CPU budget are planned on the stream head
+        '''
+        tasks_results = []
+        self.tasks_report = TasksReport(self.records_path)
+
+        tasks_stream = self._pending_tasks(tasks_stream)
+        planner = self.cpu_budget_planner if self.cpu_budget_planner else CPUBudgetPlanner()
+        head = list(itertools.islice(tasks_stream, planner.num_cpus * self.STREAM_PENDING_FACTOR))
+        if head:
+            executor_type = self._executor_type(head, serial_exec, executor_type)
+            num_workers = self._plan_cpu_budget(head, executor_type, num_workers)
+            num_workers, max_pending = self._start_concurrency_controller(executor_type, num_workers)
+            executor = TasksExecutor.create(executor_type, num_workers = num_workers, **self.executor_options)
+            if not max_pending:
+                max_pending = executor.num_workers * self.STREAM_PENDING_FACTOR
+
+            if executor_type == TasksExecutorType.SERIAL:
+                print('Processing tasks sequentially, as discovered')
+            elif executor_type == TasksExecutorType.DISTRIBUTED:
+                print('Serving tasks as discovered to remote workers at {}'.format(executor.address_description))
+            else:
+                print('Processing tasks as discovered, with pool of {0} {1}'.format(executor.num_workers,
+                                                                            executor.WORKERS_DESCRIPTION))
+            self._concurrency_msg(max_pending)
+            num_submitted = 0
+            tasks_progress = TasksProgress()
+            def _budgeted_tasks():
+                nonlocal num_submitted
+                for task in itertools.chain(head, tasks_stream):
+                    if task.cpu_threads is None and self.cpu_budget:
+                        task.cpu_threads = self._task_cpu_threads(task.threads_hint())
+                    num_submitted += 1
+                    tasks_progress.add(task)
+                    yield task
+
+            # progress is relative to the tasks discovered so far
+            with progress_bar(refresh_rate = CmdProgressBarRefreshRate.MODERATE,
+                                                            live_status = tasks_progress.status) as p_bar:
+                with executor, self.tasks_report:
+                    results = self._execute(executor, _budgeted_tasks(), max_pending = max_pending,
+                                                                            tasks_progress = tasks_progress)
+                    tasks_results = self._collect_results(results, p_bar, lambda: num_submitted,
+                                                                        quiet = quiet, keep_results = keep_results)
+
+        # return tasks results, aggregate CPU cores time, and total time elapsed (via @timed)
+        return tasks_results, self.tasks_report.tasks_duration
+
+    def _collect_results(self, results, p_bar, num_tasks, quiet = False, keep_results = True):
+        ''' Records the tasks results in the tasks report / the job journal, keeping them only if asked
+            The info messages are rate-limited: tasks done in between are shown as a summary,
+            so that the console keeps up with any number of quick tasks
+        '''
+        def show_progress():
+            if not quiet:
+                p_bar.info_msg = last_output if num_unshown == 1 else self.tasks_report.summary_msg()
+            num_done = self.tasks_report.num_tasks
+            p_bar.progress = num_done / max(num_tasks(), num_done) * 100
+
+        tasks_results = []
+        last_msg_time, num_unshown, last_output = 0.0, 0, None
+        for result in results:
+            if keep_results:
+                tasks_results.append(result)
+            self.tasks_report.add(result)
+            self._record_result(result)
+            num_unshown, last_output = num_unshown + 1, result.task_output
+
+            now = time.monotonic()
+            if now - last_msg_time >= self.INFO_MSG_INTERVAL:
+                show_progress()
+                last_msg_time, num_unshown = now, 0
+
+        # the results since the last update
+        if num_unshown:
+            show_progress()
+        return tasks_results
+
+    def _execute(self, executor, tasks, max_pending = None, tasks_progress = None):
+        ''' Generates the tasks final results
+            Tasks that ran out of time are re-queued for another round, after a backoff
+            With tasks_progress, tasks running in the calling process report their progress there
+            Results with deferred I/O-bound work are finalized in the finalize stage,
+            while the executor goes on with the next tasks
+            Final results are recorded in the throughput history, if any
+        '''
+        in_flight, previous_results = {}, {}
+        task_ids = itertools.count()
+        staged = executor.STAGED and self.finalize_workers > 0
+        def _dispatched(tasks):
+            for task in self._started_tasks(tasks):
+                task.task_id = next(task_ids)
+                task.staged = staged
+                in_flight[task.task_id] = task
+                if tasks_progress:
+                    progress_reporter = tasks_progress.started(task)
+                    if executor.IN_PROCESS:
+                        task.progress_reporter = progress_reporter
+                yield task
+
+        def _completed(finalized):
+            for task, result in finalized:
+                if task and tasks_progress:
+                    tasks_progress.completed(task)
+                if task and self.throughput_history:
+                    self.throughput_history.record_task(task, result)
+                yield result
+
+        with _FinalizeStage(self.finalize_workers if staged else 0) as finalize_stage:
+            for retry_round in range(self.max_retries + 1):
+                if retry_round:
+                    time.sleep(self.retry_backoff * 2 ** (retry_round - 1))
+                retries = []
+                for result in executor.imap_unordered(_dispatched(tasks), max_pending = max_pending):
+                    task = in_flight.pop(result.task_id, None)
+                    previous_result = previous_results.pop(id(task), None)
+                    if previous_result:
+                        result.add_retried(previous_result)
+
+                    if task and result.retryable and not result.succeeded and retry_round < self.max_retries:
+                        previous_results[id(task)] = result
+                        retries.append(task)
+                    elif task and result.finalize_pending:
+                        yield from _completed(finalize_stage.submit(task, result))
+                    else:
+                        yield from _completed([(task, result)])
+                    yield from _completed(finalize_stage.finalized())
+                if not retries:
+                    break
+                tasks = retries
+            yield from _completed(finalize_stage.drain())
+
+    # Job journal
+    def _pending_tasks(self, tasks):
+        ''' Generates tasks not completed in previous runs, recording them as planned
+        '''
+        for task in tasks:
+            key = task.journal_key() if self.journal else None
+            if key is not None:
+                if self.journal.is_completed(key):
+                    self.num_skipped += 1
+                    continue
+                self.journal.planned(key)
+            yield task
+
+    def _started_tasks(self, tasks):
+        for task in tasks:
+            key = task.journal_key() if self.journal else None
+            if key is not None:
+                self.journal.started(key)
+            yield task
+
+    def _record_result(self, result):
+        if self.journal and result.journal_key is not None:
+            if result.succeeded:
+                self.journal.completed(result.journal_key, result.output_paths)
+            else:
+                self.journal.failed(result.journal_key)
+
+    def _plan_cpu_budget(self, tasks_queue, executor_type, num_workers):
+        ''' Splits the available CPUs between the pool workers and the tasks threads
+            Each task gets up to the threads it can make good use of
+            Returns the number of pool workers
+            Remote workers plan their own CPU budgets
+        '''
+        if executor_type == TasksExecutorType.DISTRIBUTED:
+            self.cpu_budget = None
+            return num_workers
+        if executor_type == TasksExecutorType.SERIAL:
+            num_workers = 1
+        planner = self.cpu_budget_planner if self.cpu_budget_planner else CPUBudgetPlanner()
+        threads_hints = [task.threads_hint() for task in tasks_queue]
+        self.cpu_budget = planner.plan(threads_hints, num_workers = num_workers)
+
+        for task, threads_hint in zip(tasks_queue, threads_hints):
+            task.cpu_threads = self._task_cpu_threads(threads_hint)
+        return self.cpu_budget.num_workers
+
+    def _start_concurrency_controller(self, executor_type, num_workers):
+        ''' With adaptive concurrency, the pool is as wide as the max concurrency,
+            and the running pool tasks are limited by the concurrency controller
+            Returns (number of pool workers, adaptive max pending or None)
+            Serial runs and remote workers are not adapted
+        '''
+        if not self.concurrency_controller or \
+                        executor_type not in (TasksExecutorType.THREADS, TasksExecutorType.PROCESSES):
+            return num_workers, None
+        return self.concurrency_controller.start(num_workers), self.concurrency_controller.limit
+
+    def _concurrency_msg(self, max_pending):
+        if callable(max_pending):
+            controller = self.concurrency_controller
+            print('Adaptive concurrency: {0}-{1} running tasks, starting with {2}'.format(controller.min_workers,
+                                                                controller.max_workers, controller.concurrency))
 
-copyreg.pickle(types.MethodType, _pickle_method, _unpickle_method)
+    def _task_cpu_threads(self, threads_hint):
+        return max(1, min(threads_hint, self.cpu_budget.threads_per_task))
 
+    @staticmethod
+    def _executor_type(tasks_queue, serial_exec, executor_type):
+        ''' Execution backend, unless explicitly specified
+            goes with a process pool if any of the tasks prefers it
+        '''
+        if serial_exec:
+            return TasksExecutorType.SERIAL
+        if executor_type is not None:
+            return executor_type
+        if any(task.executor_type == TasksExecutorType.PROCESSES for task in tasks_queue):
+            return TasksExecutorType.PROCESSES
+        return TasksExecutorType.THREADS
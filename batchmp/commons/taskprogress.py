@@ -0,0 +1,142 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Intra-task progress tracking
+      . running tasks report how far they are, e.g. the media time an ffmpeg command processed so far
+      . the run progress is weighted by the tasks progress weights (e.g. their media durations),
+        tasks of unknown weight count as the average known one
+      . the ETA, the speed (weight per sec, e.g. x realtime) and the output throughput
+        are from the run so far
+'''
+import time, datetime, threading
+
+
+class _TaskProgress:
+    __slots__ = ('weight', 'fraction', 'output_bytes')
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.fraction = 0.0
+        self.output_bytes = 0
+
+
+class TasksProgress:
+    ''' Progress of a run
+    '''
+    def __init__(self, tasks = ()):
+        self._lock = threading.Lock()
+        # progress of the tasks not completed yet, by their ids
+        self._tasks = {}
+        self._known_weight = 0.0
+        self._num_known = 0
+        self._num_unknown = 0
+        # done so far, i.e. sum of (fraction x weight) of tasks with known weights,
+        # and sum of fractions of tasks with unknown weights
+        self._known_done = 0.0
+        self._unknown_done = 0.0
+        self._output_bytes = 0
+        self.start = time.monotonic()
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        ''' Registers a task, e.g. as it is discovered
+        '''
+        if id(task) in self._tasks:
+            return
+        weight = task.progress_weight()
+        with self._lock:
+            self._tasks[id(task)] = _TaskProgress(weight)
+            if weight:
+                self._known_weight += weight
+                self._num_known += 1
+            else:
+                self._num_unknown += 1
+
+    def started(self, task):
+        ''' (Re)starts a task, returning its progress reporter,
+            i.e. a callable taking the weight done so far and the output bytes
+        '''
+        self.add(task)
+        task_progress = self._tasks[id(task)]
+        self._update(task_progress, 0.0, 0)
+
+        def _report(done_weight, output_bytes = 0):
+            if task_progress.weight:
+                self._update(task_progress, min(1.0, max(task_progress.fraction, done_weight / task_progress.weight)),
+                                                                    max(task_progress.output_bytes, output_bytes))
+        return _report
+
+    def completed(self, task):
+        task_progress = self._tasks.pop(id(task), None)
+        if task_progress:
+            self._update(task_progress, 1.0, task_progress.output_bytes)
+
+    @property
+    def fraction(self):
+        with self._lock:
+            average_weight = self._average_weight()
+            total_weight = self._known_weight + self._num_unknown * average_weight
+            if not total_weight:
+                return 0.0
+            return (self._known_done + self._unknown_done * average_weight) / total_weight
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    @property
+    def speed(self):
+        ''' Weight done per sec, e.g. media secs per sec (i.e. x realtime) for media durations weights
+        '''
+        with self._lock:
+            done = self._known_done + self._unknown_done * self._average_weight()
+        return done / self.elapsed
+
+    @property
+    def throughput(self):
+        ''' Output bytes per sec
+        '''
+        return self._output_bytes / self.elapsed
+
+    @property
+    def eta(self):
+        ''' Secs to go, None till there is some progress
+        '''
+        fraction = self.fraction
+        if not fraction:
+            return None
+        return self.elapsed * (1.0 - fraction) / fraction
+
+    def status(self):
+        ''' (progress percent, readout), e.g. for CmdProgressBar live status
+        '''
+        fraction, eta = self.fraction, self.eta
+        readout = '{0:.0%} ETA {1}, {2:.1f}x, {3:.1f}MB/s'.format(fraction,
+                                                datetime.timedelta(seconds = round(eta)) if eta is not None else '-',
+                                                self.speed, self.throughput / 1e6)
+        return fraction * 100, readout
+
+    # Helpers
+    def _update(self, task_progress, fraction, output_bytes):
+        with self._lock:
+            if task_progress.weight:
+                self._known_done += (fraction - task_progress.fraction) * task_progress.weight
+            else:
+                self._unknown_done += fraction - task_progress.fraction
+            self._output_bytes += output_bytes - task_progress.output_bytes
+            task_progress.fraction, task_progress.output_bytes = fraction, output_bytes
+
+    def _average_weight(self):
+        return self._known_weight / self._num_known if self._num_known else 1.0
@@ -0,0 +1,161 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Streaming run report
+      . aggregates the tasks results as they come, i.e. in bounded memory regardless of the number of tasks:
+        counters, resources usage totals, a tasks durations histogram,
+        samples of the failed tasks and the peak memory tasks
+      . optionally writes the full per-task records to a file, one JSON record per line
+'''
+import os, json, heapq
+from bisect import bisect_left
+
+
+class TasksReport:
+    ''' Run report, built from the tasks results
+    '''
+    # upper bounds of the tasks durations histogram buckets, secs
+    DURATION_BUCKETS = (1, 10, 60, 300, 900, 3600)
+    # failed tasks to sample
+    NUM_FAILURE_SAMPLES = 5
+    # max sampled failed task output, chars
+    FAILURE_OUTPUT_LIMIT = 500
+    # peak memory tasks to keep
+    NUM_PEAK_MEMORY_TASKS = 3
+
+    def __init__(self, records_path = None):
+        self.records_path = records_path
+        self._file = None
+
+        self.num_tasks = 0
+        self.num_succeeded = 0
+        self.num_retried = 0
+        self.num_timeouts = 0
+        self.num_stalls = 0
+
+        # cumulative tasks running time
+        self.tasks_duration = 0.0
+        self.durations = [0] * (len(self.DURATION_BUCKETS) + 1)
+
+        # tasks child processes resources usage
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.in_blocks = 0
+        self.out_blocks = 0
+
+        # (journal key, output) of the first failed tasks
+        self.failure_samples = []
+        # min-heap of (max rss, num, journal key)
+        self._peak_memory = []
+
+    def add(self, result):
+        self.num_tasks += 1
+        if result.succeeded:
+            self.num_succeeded += 1
+        elif len(self.failure_samples) < self.NUM_FAILURE_SAMPLES:
+            task_output = result.task_output
+            if task_output and len(task_output) > self.FAILURE_OUTPUT_LIMIT:
+                task_output = '{}...'.format(task_output[:self.FAILURE_OUTPUT_LIMIT])
+            self.failure_samples.append((result.journal_key, task_output))
+        if result.num_retries:
+            self.num_retried += 1
+        self.num_timeouts += result.num_timeouts
+        self.num_stalls += result.num_stalls
+
+        task_duration = result.task_duration
+        self.tasks_duration += task_duration
+        self.durations[bisect_left(self.DURATION_BUCKETS, task_duration)] += 1
+
+        self.user_time += result.user_time
+        self.system_time += result.system_time
+        self.in_blocks += result.in_blocks
+        self.out_blocks += result.out_blocks
+        if result.max_rss:
+            peak = (result.max_rss, self.num_tasks, result.journal_key)
+            if len(self._peak_memory) < self.NUM_PEAK_MEMORY_TASKS:
+                heapq.heappush(self._peak_memory, peak)
+            else:
+                heapq.heappushpop(self._peak_memory, peak)
+
+        if self.records_path:
+            self._record(result)
+
+    @property
+    def num_failed(self):
+        return self.num_tasks - self.num_succeeded
+
+    @property
+    def cpu_time(self):
+        return self.user_time + self.system_time
+
+    @property
+    def peak_memory(self):
+        ''' (max rss, journal key) of the peak memory tasks, highest first
+        '''
+        return [(max_rss, key) for max_rss, _, key in sorted(self._peak_memory, reverse = True)]
+
+    def durations_histogram(self):
+        ''' (bucket label, number of tasks) of the non-empty tasks durations buckets
+        '''
+        histogram = []
+        lower = 0
+        for upper, count in zip(self.DURATION_BUCKETS + (None,), self.durations):
+            if count:
+                if upper is None:
+                    label = '>{}'.format(self._duration_label(lower))
+                else:
+                    label = '{0}-{1}'.format(self._duration_label(lower), self._duration_label(upper))
+                histogram.append((label, count))
+            lower = upper
+        return histogram
+
+    def summary_msg(self):
+        return '{0} task{1} done (Succeeded: {2}, Failed: {3})'.format(self.num_tasks,
+                                                        '' if self.num_tasks == 1 else 's',
+                                                        self.num_succeeded, self.num_failed)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Helpers
+    def _record(self, result):
+        record = dict(key = result.journal_key, succeeded = result.succeeded,
+                      duration = round(result.task_duration, 3),
+                      retries = result.num_retries, timeouts = result.num_timeouts, stalls = result.num_stalls,
+                      user_time = round(result.user_time, 3), system_time = round(result.system_time, 3),
+                      max_rss = result.max_rss, in_blocks = result.in_blocks, out_blocks = result.out_blocks,
+                      outputs = result.output_paths, output = result.task_output)
+        if not self._file:
+            records_dir = os.path.dirname(self.records_path)
+            if records_dir:
+                os.makedirs(records_dir, exist_ok = True)
+            self._file = open(self.records_path, 'w', encoding = 'utf-8')
+        self._file.write('{}\n'.format(json.dumps(record, ensure_ascii = False)))
+
+    @staticmethod
+    def _duration_label(secs):
+        if secs >= 3600:
+            return '{}h'.format(secs // 3600)
+        if secs >= 60:
+            return '{}m'.format(secs // 60)
+        return '{}s'.format(secs)
@@ -0,0 +1,211 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Tasks throughput history
+      . persisted per kind of processing (e.g. operation / codec), as reported by Task.throughput_key()
+      . recorded from the succeeded tasks of previous runs: their work (e.g. media secs),
+        running times and output sizes
+      . older runs fade out past a number of recorded tasks, i.e. the history follows hardware / settings changes
+      . predicts the running time, the makespan and the output size of planned tasks, without running them
+'''
+import os, json, threading
+from collections import namedtuple
+from contextlib import contextmanager
+from batchmp.fstools.fsutils import FSH
+from batchmp.commons.scheduler import LPTScheduler
+
+try:
+    import fcntl
+except ImportError:
+    # e.g. on Windows, concurrent saves are not serialized
+    fcntl = None
+
+
+ThroughputStats = namedtuple('ThroughputStats', ['num_tasks', 'work', 'duration', 'output_bytes'])
+
+# predicted tasks running time / makespan / output size are None when no planned task has history
+PlanEstimate = namedtuple('PlanEstimate', ['num_tasks', 'num_predicted', 'num_workers', 'work',
+                                                            'tasks_duration', 'makespan', 'output_bytes'])
+
+
+class ThroughputHistory:
+    ''' Throughput history, keyed by the tasks throughput keys
+    '''
+    DEFAULT_HISTORY_FNAME = 'throughput.json'
+    VERSION = 1
+
+    # recorded tasks kept per key, older ones fade out proportionally
+    MAX_TASKS = 1000
+
+    def __init__(self, history_path = None):
+        self.history_path = history_path
+        self._lock = threading.Lock()
+        self._stats = self._read()
+        # recorded in this run, merged into the history as saved on disk (e.g. by concurrent shards)
+        self._recorded = {}
+
+    @classmethod
+    def default(cls):
+        ''' History in the user cache dir,
+            None if disabled via the BATCHMP_NO_THROUGHPUT_HISTORY environment variable
+        '''
+        if os.environ.get('BATCHMP_NO_THROUGHPUT_HISTORY'):
+            return None
+        try:
+            return cls(os.path.join(FSH.user_cache_dir(), cls.DEFAULT_HISTORY_FNAME))
+        except OSError:
+            return None
+
+    def record(self, key, work, duration, output_bytes = 0):
+        if not key or not work or not duration or duration <= 0:
+            return
+        with self._lock:
+            self._recorded[key] = self._merged(self._recorded.get(key),
+                                                    ThroughputStats(1, work, duration, output_bytes))
+
+    def record_task(self, task, result):
+        ''' Records a task succeeded first time round, i.e. its running time is not skewed by retries
+        '''
+        if not result.succeeded or result.num_retries:
+            return
+        key = task.throughput_key()
+        if key:
+            self.record(key, task.progress_weight(), result.task_duration, self._output_bytes(result))
+
+    def stats(self, key):
+        ''' Throughput stats of a key, recorded in this run included
+            None if no history
+        '''
+        with self._lock:
+            return self._merged(self._stats.get(key), self._recorded.get(key))
+
+    def predict(self, key, work):
+        ''' (running time, output bytes) of a task of a throughput key,
+            None if not known
+        '''
+        stats = self.stats(key) if key else None
+        if not stats or not work or not stats.work:
+            return None
+        return work * stats.duration / stats.work, work * stats.output_bytes / stats.work
+
+    def estimate(self, tasks, costs, num_workers):
+        ''' Predicted figures of planned tasks and their estimated costs
+            Tasks with no history are extrapolated from the tasks with one,
+            i.e. the running time by their costs and the output size by their work
+        '''
+        predicted, others = [], []
+        total_work = 0.0
+        for task, cost in zip(tasks, costs):
+            work = task.progress_weight()
+            total_work += work if work else 0.0
+            prediction = self.predict(task.throughput_key(), work)
+            if prediction:
+                predicted.append((cost, work, prediction))
+            else:
+                others.append((cost, work))
+
+        num_tasks = len(predicted) + len(others)
+        if not predicted:
+            return PlanEstimate(num_tasks, 0, num_workers, total_work, None, None, None)
+
+        durations = [duration for _, _, (duration, _) in predicted]
+        output_bytes = sum(output for _, _, (_, output) in predicted)
+        if others:
+            predicted_cost = sum(cost for cost, _, _ in predicted)
+            secs_per_cost = sum(durations) / predicted_cost if predicted_cost else 0.0
+            bytes_per_work = output_bytes / sum(work for _, work, _ in predicted)
+            durations.extend(cost * secs_per_cost for cost, _ in others)
+            output_bytes += sum(work * bytes_per_work for _, work in others if work)
+
+        makespan = LPTScheduler.makespan(sorted(durations, reverse = True), num_workers)
+        return PlanEstimate(num_tasks, len(predicted), num_workers, total_work,
+                                                            sum(durations), makespan, output_bytes)
+
+    def save(self):
+        ''' Merges the recorded stats into the history on disk, written in full or not at all
+            Read / merge / write is serialized across processes, via the history lock file
+        '''
+        if not self.history_path:
+            return
+        with self._lock:
+            if not self._recorded:
+                return
+            try:
+                with self._history_lock():
+                    stats = self._read()
+                    for key, recorded in self._recorded.items():
+                        stats[key] = self._merged(stats.get(key), recorded)
+                    history = dict(version = self.VERSION,
+                                   stats = {key: key_stats._asdict() for key, key_stats in stats.items()})
+                    tmp_path = '{0}.{1}.tmp'.format(self.history_path, os.getpid())
+                    with open(tmp_path, 'w', encoding = 'utf-8') as f:
+                        json.dump(history, f, indent = 2, sort_keys = True)
+                    os.replace(tmp_path, self.history_path)
+            except OSError:
+                return
+            self._stats, self._recorded = stats, {}
+
+    # Helpers
+    @contextmanager
+    def _history_lock(self):
+        ''' Holds the history lock file, i.e. saves of concurrent processes (e.g. shards) do not lose each other's stats
+        '''
+        if fcntl is None:
+            yield
+            return
+        with open('{}.lock'.format(self.history_path), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        if not self.history_path:
+            return {}
+        try:
+            with open(self.history_path, encoding = 'utf-8') as f:
+                history = json.load(f)
+            if history.get('version') != self.VERSION:
+                return {}
+            return {key: ThroughputStats(**key_stats) for key, key_stats in history['stats'].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {}
+
+    @classmethod
+    def _merged(cls, stats, other):
+        if not stats or not other:
+            return stats or other
+        merged = ThroughputStats(*(value + other_value for value, other_value in zip(stats, other)))
+        if merged.num_tasks > cls.MAX_TASKS:
+            fade = cls.MAX_TASKS / merged.num_tasks
+            merged = ThroughputStats(*(value * fade for value in merged))
+        return merged
+
+    @staticmethod
+    def _output_bytes(result):
+        output_bytes = 0
+        for output_path in result.output_paths:
+            try:
+                output_bytes += os.path.getsize(output_path)
+            except OSError:
+                pass
+        return output_bytes
+
+
+# Quick dev test, i.e. the recorded history
+if __name__ == '__main__':
+    history = ThroughputHistory.default()
+    for key in sorted(history._stats if history else ()):
+        print(key, history.stats(key))
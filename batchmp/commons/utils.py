@@ -17,6 +17,7 @@ from functools import wraps
 from urllib.parse import urlparse
 import urllib.request, urllib.error
 from contextlib import contextmanager
+from batchmp.commons.launcher import CmdLauncher, CmdProcessingError
 
 ''' General-level utilities
 '''
@@ -45,20 +46,15 @@ def timed(f):
     return wrapper
 
 
-class CmdProcessingError(Exception):
-    pass
-
 @timed
 def run_cmd(cmd, shell = False):
     ''' Runs shell commands in a separate process
+        Takes either a command line string or an argv list,
+        returns the merged stdout / stderr output
     '''
-    if not shell:
+    if not shell and isinstance(cmd, str):
         cmd = shlex.split(cmd)
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell = shell)
-    output = proc.communicate()[0].decode('utf-8')
-    if proc.returncode != 0:
-        raise CmdProcessingError(output)
-    return output
+    return CmdLauncher.run(cmd, shell = shell, merge_stderr = True).stdout
 
 
 def strtobool(val):
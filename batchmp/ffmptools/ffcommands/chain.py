@@ -0,0 +1,157 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" Chained processing of media files
+      . the denoise filters, the peak normalization gain and the target format conversion
+        are fused into a single FFmpeg command per media file,
+        i.e. one decode / encode cycle instead of one per processing step
+      . the volume is analyzed (decoding only) just when normalizing, on the denoised audio
+"""
+import os, shlex
+from batchmp.ffmptools.ffutils import FFH
+from batchmp.ffmptools.ffrunner import FFMPRunner, LogLevel
+from batchmp.commons.taskprocessor import TaskResult
+from batchmp.ffmptools.ffcommands.convert import ConvertorTask
+from batchmp.ffmptools.ffcommands.denoise import Denoiser, DenoiserTask
+from batchmp.ffmptools.ffcommands.normalize_peak import PeakNormalizerTask
+from batchmp.commons.utils import (
+    timed,
+    CmdProcessingError
+)
+
+class ChainTask(ConvertorTask):
+    ''' Chained processing TasksProcessor task
+    '''
+    def __init__(self, fpath, target_dir, log_level,
+                                ff_general_options, ff_other_options, preserve_metadata,
+                                target_format = None, denoise_filters = None, normalize = False):
+        # without a target format, the media files keep their own
+        self.convert = bool(target_format)
+        if not target_format:
+            target_format = os.path.splitext(fpath)[1]
+
+        self.denoise_filters = denoise_filters
+        self.normalize = normalize
+
+        super().__init__(fpath, target_dir, log_level,
+                                ff_general_options, ff_other_options, preserve_metadata, target_format)
+
+    def af_filters(self, volume_gain = None):
+        ''' Chained audio filters, i.e. denoising then the normalization gain
+        '''
+        volume_filter = PeakNormalizerTask.volume_filter(volume_gain) if volume_gain else None
+        return ', '.join(af_filter for af_filter in (self.denoise_filters, volume_filter) if af_filter)
+
+    def ff_chain_cmd(self, af_filters):
+        ''' Chain command builder
+        '''
+        return ''.join((self.ff_cmd,
+                            ' -af {}'.format(shlex.quote(af_filters)) if af_filters else ''))
+
+    def cost_factor(self, video):
+        # volume detection if normalizing, then a single encode
+        return super().cost_factor(video) + (self.ANALYSIS_COST_FACTOR if self.normalize else 0.0)
+
+    def execute(self):
+        ''' detects the volume if needed, then builds and runs the chained FFmpeg command in a subprocess
+        '''
+        task_result = TaskResult()
+
+        volume_entry = None
+        if self.normalize:
+            volume_entry, task_elapsed = self._detect_volumes()
+            task_result.add_task_step_duration(task_elapsed)
+        af_filters = self.af_filters(volume_entry.max_volume if volume_entry else None)
+
+        if self.normalize and not volume_entry:
+            task_result.add_task_step_info_msg('A problem analyzing volume in media file:\n\t{}' \
+                                                                                .format(self.fpath))
+        elif not af_filters and not self.convert:
+            task_result.add_task_step_info_msg( \
+                                        'Already normalized:\n\t{0}'.format(self.fpath))
+            # nothing else to do, copy source file to target dir
+            self._finalize_output(self.fpath, task_result, copy = True, restore_tags = False)
+
+            # all well
+            task_result.succeeded = True
+        else:
+            # store tags if needed
+            self._store_tags()
+
+            with self._stage_dir(task_result) as tmp_dir:
+                # prepare the tmp output path
+                chain_fname = ''.join((os.path.splitext(os.path.basename(self.fpath))[0], self.target_format))
+                chain_fpath = os.path.join(tmp_dir, chain_fname)
+
+                # build ffmpeg cmd string
+                p_in = ''.join((self.ff_chain_cmd(af_filters), ' {}'.format(shlex.quote(chain_fpath))))
+                self._log(p_in, LogLevel.FFMPEG)
+
+                # run ffmpeg command as a subprocess
+                try:
+                    _, task_elapsed = self._run_ff_cmd(p_in, task_result)
+                    task_result.add_task_step_duration(task_elapsed)
+                except CmdProcessingError as e:
+                    task_result.add_task_step_info_msg('A problem while processing media file:\n\t{0}' \
+                                                       '\nOriginal error message:\n\t{1}' \
+                                                            .format(self.fpath, e.args[0]))
+                else:
+                    # restore tags if needed, and move processed file to target dir
+                    self._finalize_output(chain_fpath, task_result)
+
+                    # all well
+                    task_result.succeeded = True
+
+        task_result.add_report_msg(self.fpath)
+        return task_result
+
+    def _operation(self):
+        # chains of different steps go at different speeds
+        steps = [step for step, chained in (('denoise', self.denoise_filters), ('normalize', self.normalize),
+                                                                        ('convert', self.convert)) if chained]
+        return '{0}[{1}]'.format(super()._operation(), '+'.join(steps))
+
+    @timed
+    def _detect_volumes(self):
+        return FFH.volume_detector(self.fpath, af_filters = self.denoise_filters)
+
+
+class Chain(FFMPRunner):
+    def chain(self, ff_entry_params, denoise = False, highpass = None, lowpass = None, num_passes = None,
+                                                                                        normalize = False):
+        ''' Denoises, peak-normalizes and / or converts media files to ff_entry_params.target_format,
+            in a single FFmpeg command per media file
+            Denoise passes are chained filters, i.e. do not add encode cycles
+        '''
+        denoise_filters = None
+        if denoise:
+            denoise_filters = DenoiserTask.af_filters(
+                                    highpass if highpass is not None else Denoiser.DEFAULT_HIGHPASS,
+                                    lowpass if lowpass is not None else Denoiser.DEFAULT_LOWPASS,
+                                    num_passes if num_passes else Denoiser.DEFAULT_NUM_PASSES)
+        steps = [step for step, chained in (('denoised', denoise), ('normalized', normalize)) if chained]
+        if ff_entry_params.target_format:
+            steps.append(ff_entry_params.target_format.lstrip('.'))
+        if not steps:
+            raise ValueError('At least one of the denoise / normalize / convert steps must be specified')
+
+        ff_entry_params.target_dir_prefix = '_'.join(steps)
+        msg_builder = lambda num_files: '{0} media files to process ({1}), in a single pass each'.format(
+                                                                                num_files, ', '.join(steps))
+        # build & run tasks
+        task_builder = lambda media_file, target_dir_path: ChainTask(media_file, target_dir_path,
+                            ff_entry_params.log_level,
+                            ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata,
+                            ff_entry_params.target_format, denoise_filters, normalize)
+        self._process_files(ff_entry_params, task_builder, msg_builder = msg_builder)
@@ -13,6 +13,7 @@
 
 
 from enum import IntEnum
+from batchmp.ffmptools.utils.fftools import FFToolsRegistry
 
 
 class FFmpegCommands:
@@ -38,6 +39,7 @@ class FFmpegCommands:
 
     # Log level
     LOG_LEVEL_ERROR = ' -v error'
+    PROGRESS = ' -nostats -progress pipe:1'
     LOG_LEVEL_QUIET = ' -v quiet'
 
     # Segment
@@ -46,6 +48,16 @@ class FFmpegCommands:
     SEGMENT_TIMES = ' -segment_times'
     SEGMENT_RESET_TIMESTAMPS = ' -reset_timestamps 1'
 
+    @staticmethod
+    def threads(num_threads):
+        ''' Codecs / filtergraphs threads
+            (-filter_threads is not there in older ffmpeg builds)
+        '''
+        threads = ' -threads {0}'.format(num_threads)
+        if FFToolsRegistry.shared().has_option('filter_threads'):
+            threads = ''.join((threads, ' -filter_threads {0}'.format(num_threads)))
+        return threads
+
     @staticmethod
     def exclude_input_stream(stream_idx):
         return ' -map -0:{}'.format(stream_idx)
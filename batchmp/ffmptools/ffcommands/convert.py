@@ -15,13 +15,12 @@
 """ Batch Conversion of media files
 """
 import shutil, sys, os, shlex
-from batchmp.commons.utils import temp_dir
 from batchmp.ffmptools.ffrunner import FFMPRunner, FFMPRunnerTask, LogLevel
 from batchmp.commons.taskprocessor import TaskResult
 from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOptions
+from batchmp.ffmptools.utils.fftools import FFToolsRegistry
 from batchmp.commons.utils import (
     timed,
-    run_cmd,
     CmdProcessingError
 )
 
@@ -40,11 +39,12 @@ class ConvertorTask(FFMPRunnerTask):
         if not self.ff_other_options:
             self.ff_other_options = FFmpegCommands.CONVERT_COPY_VBR_QUALITY
         elif self.ff_other_options == FFmpegCommands.CONVERT_LOSSLESS:
-            # see if lossless is appropriate
+            # see if lossless is appropriate, and supported by the ffmpeg build
             # TBD: video formats
-            if self.target_format == '.flac':
+            fftools = FFToolsRegistry.shared()
+            if self.target_format == '.flac' and fftools.has_encoder('flac'):
                 self.ff_other_options = FFmpegCommands.CONVERT_LOSSLESS_FLAC
-            elif self.target_format == '.m4a':
+            elif self.target_format == '.m4a' and fftools.has_encoder('alac'):
                 self.ff_other_options = FFmpegCommands.CONVERT_LOSSLESS_ALAC
             else:
                 self.ff_other_options = FFmpegCommands.CONVERT_COPY_VBR_QUALITY
@@ -59,6 +59,9 @@ class ConvertorTask(FFMPRunnerTask):
                                          FFmpegCommands.CONVERT_CHANGE_CONTAINER):
                 self.ff_other_options += self._ff_cmd_exclude_artwork_streams()
 
+    def _output_format(self):
+        return self.target_format
+
     def execute(self):
         ''' builds and runs FFmpeg Conversion command in a subprocess
         '''
@@ -67,7 +70,7 @@ class ConvertorTask(FFMPRunnerTask):
 
         task_result = TaskResult()
 
-        with temp_dir() as tmp_dir:
+        with self._stage_dir(task_result) as tmp_dir:
             # prepare the tmp output path
             conv_fname = ''.join((os.path.splitext(os.path.basename(self.fpath))[0], self.target_format))
             conv_fpath = os.path.join(tmp_dir, conv_fname)
@@ -78,18 +81,15 @@ class ConvertorTask(FFMPRunnerTask):
 
             # run ffmpeg command as a subprocess
             try:
-                _, task_elapsed = run_cmd(p_in)
+                _, task_elapsed = self._run_ff_cmd(p_in, task_result)
                 task_result.add_task_step_duration(task_elapsed)
             except CmdProcessingError as e:
                 task_result.add_task_step_info_msg('A problem while processing media file:\n\t{0}' \
                                                    '\nOriginal error message:\n\t{1}' \
                                                         .format(self.fpath, e.args[0]))
             else:
-                # restore tags if needed
-                self._restore_tags(conv_fpath)
-
-                # move converted file to target dir
-                shutil.move(conv_fpath, self.target_dir)
+                # restore tags if needed, and move converted file to target dir
+                self._finalize_output(conv_fpath, task_result)
 
                 # all well
                 task_result.succeeded = True
@@ -103,7 +103,6 @@ class Convertor(FFMPRunner):
 
         ''' Converts media to specified format
         '''
-        tasks = []
         if ff_entry_params.target_format:
             if ff_entry_params.target_format.startswith('.'):
                 target_dir_prefix = '{}'.format(ff_entry_params.target_format[1:])
@@ -112,18 +111,14 @@ class Convertor(FFMPRunner):
                 target_format = '.{}'.format(ff_entry_params.target_format)
             ff_entry_params.target_dir_prefix = target_dir_prefix
 
-            media_files, target_dirs = self._prepare_files(ff_entry_params)
-            # build tasks
-            tasks_params = [(media_file, target_dir_path, ff_entry_params.log_level,
+            # build & run tasks
+            task_builder = lambda media_file, target_dir_path: ConvertorTask(media_file, target_dir_path,
+                                ff_entry_params.log_level,
                                 ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata,
                                 ff_entry_params.target_format)
-                                    for media_file, target_dir_path in zip(media_files, target_dirs)]
-            for task_param in tasks_params:
-                task = ConvertorTask(*task_param)
-                tasks.append(task)
-
-        # run tasks
-        self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
+            self._process_files(ff_entry_params, task_builder)
+        else:
+            self.run_tasks([], serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
 
 
 
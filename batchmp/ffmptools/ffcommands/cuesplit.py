@@ -16,7 +16,6 @@
 """
 import shutil, sys, os, shlex, re
 from datetime import timedelta
-from batchmp.commons.utils import temp_dir
 from batchmp.ffmptools.ffrunner import FFMPRunner, LogLevel
 from batchmp.commons.taskprocessor import TaskResult
 from batchmp.fstools.walker import DWalker
@@ -25,7 +24,6 @@ from batchmp.tags.handlers.tagsholder import TagHolder
 from batchmp.ffmptools.ffcommands.convert import ConvertorTask
 from batchmp.commons.descriptors import PropertyDescriptor
 from batchmp.commons.utils import (
-    run_cmd,
     CmdProcessingError
 )
 
@@ -96,7 +94,7 @@ class CueSplitterTask(ConvertorTask):
 
         task_result = TaskResult()
 
-        with temp_dir() as tmp_dir:
+        with self._stage_dir(task_result) as tmp_dir:
             # prepare the tmp output path
             conv_fname = '{0:02d} {1}'.format(self.track_number, self.track_title)
             conv_fname = re.sub(r'[^\w\-_\. ]', '_', conv_fname)
@@ -109,18 +107,15 @@ class CueSplitterTask(ConvertorTask):
 
             # run ffmpeg command as a subprocess
             try:
-                _, task_elapsed = run_cmd(p_in)
+                _, task_elapsed = self._run_ff_cmd(p_in, task_result)
                 task_result.add_task_step_duration(task_elapsed)
             except CmdProcessingError as e:
                 task_result.add_task_step_info_msg('A problem while processing media file:\n\t{0}' \
                                                    '\nOriginal error message:\n\t{1}' \
                                                         .format(self.fpath, e.args[0]))
             else:
-                # restore tags if needed
-                self._restore_tags(conv_fpath)
-
-                # move converted file to target dir
-                shutil.move(conv_fpath, self.target_dir)
+                # restore tags if needed, and move converted file to target dir
+                self._finalize_output(conv_fpath, task_result)
 
                 # all well
                 task_result.succeeded = True
@@ -134,24 +129,25 @@ class CueSplitter(FFMPRunner):
 
         ''' Converts media to specified format
         '''
-        tasks = []
-        if ff_entry_params.target_format:
-            if not ff_entry_params.target_format.startswith('.'):
-                ff_entry_params.target_format = '.{}'.format(ff_entry_params.target_format)
-            ff_entry_params.target_dir_prefix = '{}'.format(ff_entry_params.target_format[1:])
-
-            cue_tagholders, target_dirs = self._prepare_cue_data(ff_entry_params, encoding = encoding)
-            # build tasks
-            tasks_params = [(cue_tag_holder, target_dir_path, ff_entry_params.log_level,
-                                ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata,
-                                ff_entry_params.target_format)
-                                    for cue_tag_holder, target_dir_path in zip(cue_tagholders, target_dirs)]
-            for task_param in tasks_params:
-                task = CueSplitterTask(*task_param)
-                tasks.append(task)
-
-        # run tasks
-        self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
+        with self._probes_scope(self._run_probe_profile(ff_entry_params)):
+            tasks = []
+            if ff_entry_params.target_format:
+                if not ff_entry_params.target_format.startswith('.'):
+                    ff_entry_params.target_format = '.{}'.format(ff_entry_params.target_format)
+                ff_entry_params.target_dir_prefix = '{}'.format(ff_entry_params.target_format[1:])
+
+                cue_tagholders, target_dirs = self._prepare_cue_data(ff_entry_params, encoding = encoding)
+                # build tasks
+                tasks_params = [(cue_tag_holder, target_dir_path, ff_entry_params.log_level,
+                                    ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata,
+                                    ff_entry_params.target_format)
+                                        for cue_tag_holder, target_dir_path in zip(cue_tagholders, target_dirs)]
+                for task_param in tasks_params:
+                    task = CueSplitterTask(*task_param)
+                    tasks.append(task)
+
+            # run tasks
+            self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
 
 
     ## Internal helpers
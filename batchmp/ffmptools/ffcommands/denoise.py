@@ -17,13 +17,11 @@
     Supports multi-passes processing, e.g. 3 times for each media file
 """
 import shutil, sys, os, datetime, math, shlex
-from batchmp.commons.utils import temp_dir
 from batchmp.ffmptools.ffrunner import FFMPRunner, FFMPRunnerTask, LogLevel
 from batchmp.commons.taskprocessor import TaskResult
 from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOptions
 from batchmp.commons.utils import (
     timed,
-    run_cmd,
     CmdProcessingError
 )
 
@@ -34,16 +32,7 @@ class DenoiserTask(FFMPRunnerTask):
                             ff_general_options, ff_other_options, preserve_metadata,
                                                         highpass, lowpass, num_passes):
         # build ffmpeg '-af' parameter
-        if highpass and lowpass:
-            af_str = 'highpass=f={0}, lowpass=f={1}'.format(highpass, lowpass)
-        elif lowpass:
-            af_str = 'lowpass=f={}'.format(lowpass)
-        elif highpass:
-            af_str = 'highpass=f={}'.format(highpass)
-        else:
-            raise ValueError('At least one of the highpass / lowpass values must be specified')
-
-        self.af_str = af_str
+        self.af_str = self.af_filters(highpass, lowpass)
         self.num_passes = num_passes
         self.excluded_artwork_streams = False
 
@@ -62,6 +51,20 @@ class DenoiserTask(FFMPRunnerTask):
                 self.excluded_artwork_streams = True
 
 
+    @staticmethod
+    def af_filters(highpass, lowpass, num_passes = 1):
+        ''' Denoise audio filters, repeated for the number of passes
+        '''
+        if highpass and lowpass:
+            af_str = 'highpass=f={0}, lowpass=f={1}'.format(highpass, lowpass)
+        elif lowpass:
+            af_str = 'lowpass=f={}'.format(lowpass)
+        elif highpass:
+            af_str = 'highpass=f={}'.format(highpass)
+        else:
+            raise ValueError('At least one of the highpass / lowpass values must be specified')
+        return ', '.join([af_str] * num_passes)
+
     def ff_denoise_cmd(self, fpath, pass_cnt):
         ''' Denoise command builder
         '''
@@ -73,7 +76,11 @@ class DenoiserTask(FFMPRunnerTask):
                             ' -i {}'.format(shlex.quote(fpath)),
                             self.ff_general_options,
                             self.ff_other_options if apply_ff_other_options else '',
-                            ' -af {}'.format(shlex.quote(self.af_str))))
+                            ' -af {}'.format(shlex.quote(self.af_str)),
+                            self._ff_cmd_threads()))
+
+    def cost_factor(self, video):
+        return super().cost_factor(video) * self.num_passes
 
     def execute(self):
         ''' builds and runs Denoise command in a subprocess
@@ -88,7 +95,7 @@ class DenoiserTask(FFMPRunnerTask):
         self._store_tags()
         task_result = TaskResult()
 
-        with temp_dir() as tmp_dir:
+        with self._stage_dir(task_result) as tmp_dir:
             # process the file in given number of passes
             for pass_cnt in range(self.num_passes):
 
@@ -103,7 +110,7 @@ class DenoiserTask(FFMPRunnerTask):
 
                 # run ffmpeg command as a subprocess
                 try:
-                    _, pass_elapsed = run_cmd(p_in)
+                    _, pass_elapsed = self._run_ff_cmd(p_in, task_result)
                 except CmdProcessingError as e:
                     task_result.add_task_step_info_msg('\nA problem while processing media file:\n\t{0}' \
                                   '\nSkipping further processing at pass {1} ...' \
@@ -116,11 +123,8 @@ class DenoiserTask(FFMPRunnerTask):
                 if pass_cnt == self.num_passes - 1:
                     # the last pass, rounding up
 
-                    # restore tags if needed
-                    self._restore_tags(fpath_output)
-
-                    # move denoised file to target dir
-                    shutil.move(fpath_output, os.path.join(self.target_dir, fname))
+                    # restore tags if needed, and move denoised file to target dir
+                    self._finalize_output(fpath_output, task_result, target_fname = fname)
 
                     # all well
                     task_result.succeeded = True
@@ -151,23 +155,14 @@ class Denoiser(FFMPRunner):
             num_passes = self.DEFAULT_NUM_PASSES
 
         ff_entry_params.target_dir_prefix = 'denoised'
-        media_files, target_dirs = self._prepare_files(ff_entry_params)
-
-        msg = None if len(media_files) == 0 else \
-                                '{0} media files to process, ({1} {2} each)'.format(
-                                                            len(media_files), num_passes,
+        msg_builder = lambda num_files: '{0} media files to process, ({1} {2} each)'.format(
+                                                            num_files, num_passes,
                                                             'passes' if num_passes > 1 else 'pass')
-        # build tasks
-        tasks = []
-        tasks_params = [(media_file, target_dir_path, ff_entry_params.log_level,
+        # build & run tasks
+        task_builder = lambda media_file, target_dir_path: DenoiserTask(media_file, target_dir_path,
+                            ff_entry_params.log_level,
                             ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata,
                             highpass, lowpass, num_passes)
-                                for media_file, target_dir_path in zip(media_files, target_dirs)]
-        for task_param in tasks_params:
-            task = DenoiserTask(*task_param)
-            tasks.append(task)
-
-        # run tasks
-        self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
+        self._process_files(ff_entry_params, task_builder, msg_builder = msg_builder)
 
 
@@ -15,14 +15,12 @@
 """ Batch Fragmentation of media files
 """
 import shutil, sys, os, shlex
-from batchmp.commons.utils import temp_dir
 from batchmp.ffmptools.ffrunner import FFMPRunner, FFMPRunnerTask, LogLevel
 from batchmp.commons.taskprocessor import TaskResult
 from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOptions
 from batchmp.ffmptools.ffcommands.segment import Segmenter
 from batchmp.commons.utils import (
     timed,
-    run_cmd,
     CmdProcessingError
 )
 
@@ -40,13 +38,15 @@ class FragmenterTask(FFMPRunnerTask):
         super().__init__(fpath, target_dir, log_level,
                                 ff_general_options, ff_other_options, preserve_metadata)
 
+        if self.fragment_trim:
+            # trimmed fragment duration, from the media duration read once per task
+            media_duration = Segmenter._media_duration(self.fpath)
+            self.fragment_duration = media_duration - self.fragment_trim - self.fragment_starttime
+
     @property
     def ff_cmd(self):
         ''' Fragment command builder
         '''
-        if self.fragment_trim:
-            media_duration = Segmenter._media_duration(self.fpath)
-            self.fragment_duration = media_duration - self.fragment_trim - self.fragment_starttime
         return ''.join((super().ff_cmd,
                             ' -ss {}'.format(self.fragment_starttime),
                             ' -t {}'.format(self.fragment_duration)
@@ -60,7 +60,7 @@ class FragmenterTask(FFMPRunnerTask):
 
         task_result = TaskResult()
 
-        with temp_dir() as tmp_dir:
+        with self._stage_dir(task_result) as tmp_dir:
             # prepare the tmp output path
             fragmented_fpath = os.path.join(tmp_dir, os.path.basename(self.fpath))
 
@@ -75,18 +75,15 @@ class FragmenterTask(FFMPRunnerTask):
                                             Negative media duration {1}s, check your input parameters to add up correctly'\
                                             .format(self.fpath, int(self.fragment_duration)))                
 
-                _, task_elapsed = run_cmd(p_in)
+                _, task_elapsed = self._run_ff_cmd(p_in, task_result)
                 task_result.add_task_step_duration(task_elapsed)
             except CmdProcessingError as e:
                 task_result.add_task_step_info_msg('A problem while processing media file:\n\t{0}' \
                                                                     '\nOriginal error message:\n\t{1}' \
                                                                             .format(self.fpath, e.args[0]))
             else:
-                # restore tags if needed
-                self._restore_tags(fragmented_fpath)
-
-                # move fragmented file to target dir
-                shutil.move(fragmented_fpath, self.target_dir)
+                # restore tags if needed, and move fragmented file to target dir
+                self._finalize_output(fragmented_fpath, task_result)
 
                 # all well
                 task_result.succeeded = True
@@ -101,21 +98,16 @@ class Fragmenter(FFMPRunner):
 
         ''' Fragment media file by specified starttime & duration
         '''
-        tasks = []
         if (fragment_starttime is not None) and (fragment_duration is not None):
             ff_entry_params.target_dir_prefix = 'fragmented'
-            media_files, target_dirs = self._prepare_files(ff_entry_params)
-            
-            # build tasks
-            tasks_params = [(media_file, target_dir_path, ff_entry_params.log_level,
+
+            # build & run tasks
+            task_builder = lambda media_file, target_dir_path: FragmenterTask(media_file, target_dir_path,
+                                ff_entry_params.log_level,
                                 ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata,
                                 fragment_starttime, fragment_duration, fragment_trim)
-                                    for media_file, target_dir_path in zip(media_files, target_dirs)]
-            for task_param in tasks_params:
-                task = FragmenterTask(*task_param)
-                tasks.append(task)
-
-        # run tasks
-        self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
+            self._process_files(ff_entry_params, task_builder)
+        else:
+            self.run_tasks([], serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
 
 
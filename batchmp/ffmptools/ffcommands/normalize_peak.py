@@ -15,14 +15,12 @@
 """ Batch Peak Normalization of media files
 """
 import shutil, sys, os, shlex
-from batchmp.commons.utils import temp_dir
 from batchmp.ffmptools.ffutils import FFH
 from batchmp.ffmptools.ffrunner import FFMPRunner, FFMPRunnerTask, LogLevel
 from batchmp.commons.taskprocessor import TaskResult
 from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOptions
 from batchmp.commons.utils import (
     timed,
-    run_cmd,
     CmdProcessingError
 )
 
@@ -50,9 +48,19 @@ class PeakNormalizerTask(FFMPRunnerTask):
         ''' Peak Normalize command builder
         '''
         return ''.join((super().ff_cmd,
-                            ' -af "volume=volume={}dB"'.format(volume_gain)))
+                            ' -af "{}"'.format(self.volume_filter(volume_gain))))
                             #'' if True else ' -c:a pcm_s16le'))
 
+    @staticmethod
+    def volume_filter(volume_gain):
+        ''' Volume gain audio filter
+        '''
+        return 'volume=volume={}dB'.format(volume_gain)
+
+    def cost_factor(self, video):
+        # volume detection, then the normalization
+        return super().cost_factor(video) + self.ANALYSIS_COST_FACTOR
+
     def execute(self):
         ''' builds and runs Peak Normalization command in a subprocess
         '''
@@ -68,7 +76,7 @@ class PeakNormalizerTask(FFMPRunnerTask):
             task_result.add_task_step_info_msg( \
                                         'Already normalized:\n\t{0}'.format(self.fpath))
             # copy source file to target dir
-            shutil.copy(self.fpath, self.target_dir)
+            self._finalize_output(self.fpath, task_result, copy = True, restore_tags = False)
 
             # all well
             task_result.succeeded = True
@@ -76,7 +84,7 @@ class PeakNormalizerTask(FFMPRunnerTask):
             # store tags if needed
             self._store_tags()
 
-            with temp_dir() as tmp_dir:
+            with self._stage_dir(task_result) as tmp_dir:
                 # prepare the tmp output path
                 norm_fname = os.path.basename(self.fpath)
                 norm_fpath = os.path.join(tmp_dir, norm_fname)
@@ -88,18 +96,15 @@ class PeakNormalizerTask(FFMPRunnerTask):
 
                 # run ffmpeg command as a subprocess
                 try:
-                    _, task_elapsed = run_cmd(p_in)
+                    _, task_elapsed = self._run_ff_cmd(p_in, task_result)
                     task_result.add_task_step_duration(task_elapsed)
                 except CmdProcessingError as e:
                     task_result.add_task_step_info_msg('A problem while processing media file:\n\t{0}' \
                                                        '\nOriginal error message:\n\t{1}' \
                                                             .format(self.fpath, e.args[0]))
                 else:
-                    # restore tags if needed
-                    self._restore_tags(norm_fpath)
-
-                    # move converted file to target dir
-                    shutil.move(norm_fpath, self.target_dir)
+                    # restore tags if needed, and move converted file to target dir
+                    self._finalize_output(norm_fpath, task_result)
 
                     # all well
                     task_result.succeeded = True
@@ -118,18 +123,11 @@ class PeakNormalizer(FFMPRunner):
         ''' Peak Normalization of media files
         '''
         ff_entry_params.target_dir_prefix = 'peak_normalized'
-        media_files, target_dirs = self._prepare_files(ff_entry_params)
 
-        # build tasks
-        tasks = []
-        tasks_params = [(media_file, target_dir_path, ff_entry_params.log_level,
+        # build & run tasks
+        task_builder = lambda media_file, target_dir_path: PeakNormalizerTask(media_file, target_dir_path,
+                            ff_entry_params.log_level,
                             ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata)
-                                for media_file, target_dir_path in zip(media_files, target_dirs)]
-        for task_param in tasks_params:
-            task = PeakNormalizerTask(*task_param)
-            tasks.append(task)
-
-        # run tasks
-        self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
+        self._process_files(ff_entry_params, task_builder)
 
 
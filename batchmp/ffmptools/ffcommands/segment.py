@@ -15,16 +15,12 @@
 """ Batch splitting of media files
 """
 import shutil, sys, os, math, fnmatch, shlex
-from batchmp.commons.utils import temp_dir
 from batchmp.ffmptools.ffrunner import FFMPRunner, FFMPRunnerTask, LogLevel
 from batchmp.commons.taskprocessor import TaskResult
-from batchmp.tags.handlers.ffmphandler import FFmpegTagHandler
-from batchmp.tags.handlers.mtghandler import MutagenTagHandler
 from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOptions
 from batchmp.ffmptools.ffutils import FFH
 from batchmp.commons.utils import (
     timed,
-    run_cmd,
     CmdProcessingError,
     MiscHelpers
 )
@@ -70,7 +66,7 @@ class SegmenterTask(FFMPRunnerTask):
 
         task_result = TaskResult()
 
-        with temp_dir() as tmp_dir:
+        with self._stage_dir(task_result) as tmp_dir:
             # compile intermediary output path
             fn_parts = os.path.splitext(os.path.basename(self.fpath))
             fname_ext = fn_parts[1].strip().lower()
@@ -85,7 +81,7 @@ class SegmenterTask(FFMPRunnerTask):
 
             # run ffmpeg command as a subprocess
             try:
-                _, task_elapsed = run_cmd(p_in)
+                _, task_elapsed = self._run_ff_cmd(p_in, task_result)
                 task_result.add_task_step_duration(task_elapsed)
             except CmdProcessingError as e:
                 task_result.add_task_step_info_msg('A problem while processing media file:\n\t{0}' \
@@ -97,11 +93,8 @@ class SegmenterTask(FFMPRunnerTask):
                     if fnmatch.fnmatch(segmented_fname, '*{}'.format(fname_ext)):
                         segmented_fpath = os.path.join(tmp_dir, segmented_fname)
 
-                        # restore tags if needed
-                        self._restore_tags(segmented_fpath)
-
-                        # move fragmented file to target dir
-                        shutil.move(segmented_fpath, self.target_dir)
+                        # restore tags if needed, and move fragmented file to target dir
+                        self._finalize_output(segmented_fpath, task_result)
 
                 # all well
                 task_result.succeeded = True
@@ -118,7 +111,6 @@ class Segmenter(FFMPRunner):
 
         ''' Segment media file by specified size | duration
         '''
-        tasks = []
         if segment_size_MB or segment_length_secs:
 #           if segment_length_secs:
 #               # here need to determine media length
@@ -128,29 +120,21 @@ class Segmenter(FFMPRunner):
 #               pass_filter = lambda fpath: FFH.ffmpeg_supported_media(fpath) and (self._media_size_MB(fpath) > segment_size_MB)
 
             ff_entry_params.target_dir_prefix = 'segmented'
-            media_files, target_dirs = self._prepare_files(ff_entry_params)
 
-            # build tasks
-            tasks_params = [(media_file, target_dir_path, ff_entry_params.log_level,
+            # build & run tasks
+            task_builder = lambda media_file, target_dir_path: SegmenterTask(media_file, target_dir_path,
+                                ff_entry_params.log_level,
                                 ff_entry_params.ff_general_options, ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata,
                                 reset_timestamps, segment_size_MB, segment_length_secs)
-                                    for media_file, target_dir_path in zip(media_files, target_dirs)]
-            for task_param in tasks_params:
-                task = SegmenterTask(*task_param)
-                tasks.append(task)
-
-        # run tasks
-        self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
+            self._process_files(ff_entry_params, task_builder)
+        else:
+            self.run_tasks([], serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
 
 
     # Internal Helpers
     @staticmethod
     def _media_duration(fpath):
-        handler = MutagenTagHandler() + FFmpegTagHandler()
-        if handler.can_handle(fpath):
-            return handler.tag_holder.length
-        else:
-            return 0.0
+        return FFH.media_duration(fpath)
 
     @staticmethod
     def _media_size_MB(fpath):
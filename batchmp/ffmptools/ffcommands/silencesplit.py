@@ -15,7 +15,6 @@
 """ Batch split on silence
 """
 import shutil, sys, os, fnmatch, shlex
-from batchmp.commons.utils import temp_dir
 from batchmp.ffmptools.ffrunner import FFMPRunner, FFMPRunnerTask, LogLevel
 from batchmp.commons.taskprocessor import TaskResult
 from batchmp.tags.handlers.ffmphandler import FFmpegTagHandler
@@ -24,7 +23,6 @@ from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOpt
 from batchmp.ffmptools.ffutils import FFH
 from batchmp.commons.utils import (
     timed,
-    run_cmd,
     CmdProcessingError,
     MiscHelpers
 )
@@ -54,6 +52,10 @@ class SilenceSplitterTask(FFMPRunnerTask):
                             ' {0} {1}'.format(FFmpegCommands.SEGMENT_TIMES, ','.join(segment_start_times)),
                             FFmpegCommands.SEGMENT_RESET_TIMESTAMPS if self.reset_timestamps else ''))
 
+    def cost_factor(self, video):
+        # silence detection, then the split
+        return super().cost_factor(video) + self.ANALYSIS_COST_FACTOR
+
     def execute(self):
         ''' builds and runs Segment FFmpeg command in a subprocess
         '''
@@ -69,7 +71,7 @@ class SilenceSplitterTask(FFMPRunnerTask):
             # store tags if needed
             self._store_tags()
 
-            with temp_dir() as tmp_dir:
+            with self._stage_dir(task_result) as tmp_dir:
                 # compile intermediary output path
                 fn_parts = os.path.splitext(os.path.basename(self.fpath))
                 fname_ext = fn_parts[1].strip().lower()
@@ -84,7 +86,7 @@ class SilenceSplitterTask(FFMPRunnerTask):
 
                 # run ffmpeg command as a subprocess
                 try:
-                    _, task_elapsed = run_cmd(p_in)
+                    _, task_elapsed = self._run_ff_cmd(p_in, task_result)
                     task_result.add_task_step_duration(task_elapsed)
                 except CmdProcessingError as e:
                     task_result.add_task_step_info_msg('A problem while processing media file:\n\t{0}' \
@@ -96,11 +98,8 @@ class SilenceSplitterTask(FFMPRunnerTask):
                         if fnmatch.fnmatch(segmented_fname, '*{}'.format(fname_ext)):
                             segmented_fpath = os.path.join(tmp_dir, segmented_fname)
 
-                            # restore tags if needed
-                            self._restore_tags(segmented_fpath)
-
-                            # move fragmented file to target dir
-                            shutil.move(segmented_fpath, self.target_dir)
+                            # restore tags if needed, and move fragmented file to target dir
+                            self._finalize_output(segmented_fpath, task_result)
 
                     # all well
                     task_result.succeeded = True
@@ -110,26 +109,31 @@ class SilenceSplitterTask(FFMPRunnerTask):
 
     @timed
     def _segment_start_times(self):
-        silence_entries = FFH.silence_detector(self.fpath,
+        # silences are streamed as ffmpeg detects them
+        silence_entries = FFH.silence_entries(self.fpath,
                          min_duration = self.silence_min_duration,
-                         noise_tolerance_amplitude_ratio = self.silence_noise_tolerance_amplitude_ratio)        
-        
+                         noise_tolerance_amplitude_ratio = self.silence_noise_tolerance_amplitude_ratio)
+
         # silence entry duration
         duration = lambda silence_entry: silence_entry.silence_end - silence_entry.silence_start
-        
-        # auto-duration filter
-        if self.silence_auto_duration:            
-            durations = [duration(silence_entry) for silence_entry in silence_entries]
-            min_duration = MiscHelpers.percentile(durations, 25)        
-            silence_entries = [silence_entry for silence_entry in silence_entries if duration(silence_entry) > min_duration]
 
         segment_start_times = []
-        for silence_entry in silence_entries:
-            # trim silences start duration
-            silence_start = lambda silence_entry : silence_entry.silence_start \
-                    if duration(silence_entry) < self.silence_target_trimmed_duration \
-                                              else silence_entry.silence_end - self.silence_target_trimmed_duration
-            segment_start_times.append(str(silence_start(silence_entry)))
+        try:
+            # auto-duration filter, needs all the silences
+            if self.silence_auto_duration:
+                silence_entries = list(silence_entries)
+                durations = [duration(silence_entry) for silence_entry in silence_entries]
+                min_duration = MiscHelpers.percentile(durations, 25)
+                silence_entries = [silence_entry for silence_entry in silence_entries if duration(silence_entry) > min_duration]
+
+            for silence_entry in silence_entries:
+                # trim silences start duration
+                silence_start = lambda silence_entry : silence_entry.silence_start \
+                        if duration(silence_entry) < self.silence_target_trimmed_duration \
+                                                  else silence_entry.silence_end - self.silence_target_trimmed_duration
+                segment_start_times.append(str(silence_start(silence_entry)))
+        except (CmdProcessingError, OSError) as e:
+            return []
 
         return segment_start_times
 
@@ -140,20 +144,12 @@ class SilenceSplitter(FFMPRunner):
         '''
 
         ff_entry_params.target_dir_prefix = 'silence_split'
-        media_files, target_dirs = self._prepare_files(ff_entry_params)
 
-        # build tasks
-        tasks = []        
-        tasks_params = [(media_file, target_dir_path, ff_entry_params.log_level, ff_entry_params.ff_general_options, 
-                            ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata, ff_entry_params.reset_timestamps, 
-                            ff_entry_params.silence_min_duration, ff_entry_params.silence_noise_tolerance_amplitude_ratio, 
+        # build & run tasks
+        task_builder = lambda media_file, target_dir_path: SilenceSplitterTask(media_file, target_dir_path,
+                            ff_entry_params.log_level, ff_entry_params.ff_general_options,
+                            ff_entry_params.ff_other_options, ff_entry_params.preserve_metadata, ff_entry_params.reset_timestamps,
+                            ff_entry_params.silence_min_duration, ff_entry_params.silence_noise_tolerance_amplitude_ratio,
                             ff_entry_params.silence_auto_duration, ff_entry_params.silence_target_trimmed_duration)
-                                for media_file, target_dir_path in zip(media_files, target_dirs)]
-
-        for task_param in tasks_params:
-            task = SilenceSplitterTask(*task_param)
-            tasks.append(task)
-
-        # run tasks
-        self.run_tasks(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet)
+        self._process_files(ff_entry_params, task_builder)
 
@@ -12,22 +12,62 @@
 ## GNU General Public License for more details.
 
 
-import os, sys, shlex
+import os, sys, re, shlex, shutil, tempfile
+from contextlib import contextmanager
 from enum import IntEnum
 from batchmp.fstools.walker import DWalker
-from batchmp.commons.utils import MiscHelpers
+from batchmp.commons.utils import MiscHelpers, timed
+from batchmp.commons.launcher import CmdLauncher, CmdProcessingError, CmdTimeoutError
 from batchmp.commons.taskprocessor import Task, TasksProcessor
+from batchmp.commons.executors import TasksExecutorType
+from batchmp.commons.distributed import TasksWorker
+from batchmp.commons.jobjournal import JobJournal
+from batchmp.commons.taskplan import TasksPlan
+from batchmp.commons.concurrency import AdaptiveConcurrency
+from batchmp.commons.throughput import ThroughputHistory
+from batchmp.commons.cpubudget import CPUBudgetPlanner
+from batchmp.commons.descriptors import LazyFunctionPropertyDescriptor
 from batchmp.ffmptools.ffutils import FFH, FFmpegNotInstalled
+from batchmp.ffmptools.utils.proberegistry import FFProbeRegistry
+from batchmp.ffmptools.utils.probeprofiles import FFProbeProfile
+from batchmp.ffmptools.utils.ffanalysis import FFProgressParser
 from batchmp.tags.handlers.mtghandler import MutagenTagHandler
 from batchmp.tags.handlers.ffmphandler import FFmpegTagHandler
 from batchmp.tags.handlers.tagsholder import TagHolder
-from batchmp.fstools.fsutils import UniqueDirNamesChecker
+from batchmp.fstools.fsutils import UniqueDirNamesChecker, FSH
 from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands, FFmpegBitMaskOptions
 
+# not probed yet, vs. probed with no result
+_NOT_PROBED = object()
+
 
 class FFMPRunnerTask(Task):
     ''' Represents an abstract FFMP Runner task
     '''
+    # relative processing costs per second of media
+    AUDIO_ENCODE_COST_FACTOR = 1.0
+    VIDEO_ENCODE_COST_FACTOR = 20.0
+    STREAM_COPY_COST_FACTOR = 0.05
+    ANALYSIS_COST_FACTOR = 0.3
+
+    # for media of unknown duration
+    DEFAULT_MEDIA_BYTES_PER_SEC = 1 << 16
+
+    # max ffmpeg threads for video encodes
+    VIDEO_ENCODE_MAX_THREADS = 16
+
+    # FFmpeg options naming the encoders, for the throughput keys
+    CODEC_OPTIONS = ('-c', '-codec', '-c:a', '-codec:a', '-acodec', '-c:v', '-codec:v', '-vcodec')
+
+    # FFmpeg commands limits (secs), i.e. the wall-clock time / time without progress
+    # None for no limit
+    timeout = None
+    stall_timeout = None
+
+    # media entry for the duration / media kind, probed on first use
+    # shipped along with the task once probed, the not probed default is not
+    _media_entry = _NOT_PROBED
+
     def __init__(self, fpath, target_dir, log_level,
                         ff_general_options, ff_other_options, preserve_metadata):
         self.fpath = fpath
@@ -41,6 +81,19 @@ class FFMPRunnerTask(Task):
 
         self._check_defaults()
 
+        # ship the already known probe result along with the task
+        probe_registry = FFProbeRegistry.active()
+        self.probe_entry = probe_registry.profiled_entry(self.fpath) if probe_registry is not None else None
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        # unpickled in a pool worker process,
+        # make the shipped probe result available there
+        if self.probe_entry:
+            FFProbeRegistry.current().register(self.fpath, self.probe_entry.entry,
+                                                            profile = self.probe_entry.profile)
+
     @property
     def ff_cmd(self):
         ''' Base FFmpeg command builder
@@ -49,9 +102,87 @@ class FFMPRunnerTask(Task):
                             FFmpegCommands.LOG_LEVEL_ERROR,
                             ' -i {}'.format(shlex.quote(self.fpath)),
                             self.ff_general_options,
-                            self.ff_other_options))
+                            self.ff_other_options,
+                            self._ff_cmd_threads()))
+
+    def estimated_cost(self):
+        ''' Estimated from the media duration (or the file size if not known),
+            and the kind of processing
+        '''
+        media_entry = self._duration_media_entry()
+        duration = self._media_duration(media_entry)
+        if not duration:
+            try:
+                duration = os.path.getsize(self.fpath) / self.DEFAULT_MEDIA_BYTES_PER_SEC
+            except OSError:
+                return None
+
+        video = bool(media_entry and media_entry.video_streams)
+        return duration * self.cost_factor(video)
+
+    def cost_factor(self, video):
+        ''' Relative processing cost per second of media
+        '''
+        if self._stream_copy:
+            return self.STREAM_COPY_COST_FACTOR
+        return self.VIDEO_ENCODE_COST_FACTOR if video else self.AUDIO_ENCODE_COST_FACTOR
+
+    def threads_hint(self):
+        ''' Audio encoders and stream copies are mostly single-threaded,
+            video encoders can make good use of more threads
+        '''
+        if self._stream_copy:
+            return 1
+        media_entry = self._duration_media_entry()
+        return self.VIDEO_ENCODE_MAX_THREADS if media_entry and media_entry.video_streams else 1
+
+    def journal_key(self):
+        return self.fpath
+
+    def finalize(self, task_result):
+        ''' Finalize stage, i.e. restores the outputs tags and moves them to the target dir
+            Runs in the finalize pool, while the FFmpeg commands of the next tasks take over the task pool slot
+        '''
+        state, task_result.finalize_state = task_result.finalize_state, None
+        # tags as stored where the task ran, e.g. in a pool worker process
+        self.tag_holder = state['tag_holder']
+        try:
+            finalize_elapsed = self._finalize_outputs(state['outputs'], task_result)[1]
+            task_result.add_task_step_duration(finalize_elapsed)
+        except OSError as e:
+            task_result.succeeded = False
+            task_result.add_task_step_info_msg('A problem while moving the outputs of media file:\n\t{0}' \
+                                                        '\nOriginal error message:\n\t{1}'.format(self.fpath, e))
+        finally:
+            for tmp_dir in state['tmp_dirs']:
+                shutil.rmtree(tmp_dir, ignore_errors = True)
+        return task_result
+
+    def progress_weight(self):
+        ''' Media duration, i.e. the task progress goes by the processed media time
+        '''
+        return self._media_duration(self._duration_media_entry())
+
+    def throughput_key(self):
+        ''' Operation / media kind / codec, e.g. "Convertor/audio/mp3"
+            The codec is the encoders of the FFmpeg options if given, or else the output format
+        '''
+        media_entry = self._duration_media_entry()
+        return '/'.join((self._operation(), 'video' if media_entry and media_entry.video_streams else 'audio',
+                                                                                                self._codec()))
 
     # Helpers
+    @staticmethod
+    def _media_duration(media_entry):
+        ''' Media duration (secs), None if not known
+        '''
+        duration = None
+        if media_entry:
+            duration = media_entry.format.get('duration') if media_entry.format else None
+            if duration is None and media_entry.audio_streams:
+                duration = media_entry.audio_streams[0].get('duration')
+        return duration
+
     def _check_defaults(self):
         if not self.ff_other_options:
             self.ff_other_options = FFmpegCommands.CONVERT_COPY_VBR_QUALITY
@@ -81,9 +212,119 @@ class FFMPRunnerTask(Task):
             # quick log
             print(msg)
 
+    @timed
+    def _run_ff_cmd(self, cmd, task_result):
+        ''' Runs an FFmpeg command, returning its (error) output
+            Stalls are detected via its -progress output, i.e. when the output time / size do not move on
+            Timed out / stalled runs are recorded in the task result, for retrying the task
+            The command resources usage is accounted in the task result, failed runs included
+            The processed media time / output size are streamed to the task progress reporter, if any
+        '''
+        argv = shlex.split(cmd)
+        argv[1:1] = shlex.split(FFmpegCommands.PROGRESS)
+        progress = FFProgressParser()
+        on_progress = None
+        if self.progress_reporter:
+            def on_progress(line):
+                if progress.is_progress(line):
+                    self.progress_reporter(progress.out_time, progress.total_size)
+        try:
+            result = CmdLauncher.run(argv, capture_stdout = False, on_stdout = on_progress, timeout = self.timeout,
+                                            stall_timeout = self.stall_timeout, is_progress = progress.is_progress)
+        except CmdProcessingError as e:
+            if e.result:
+                task_result.add_rusage(e.result.rusage)
+            if isinstance(e, CmdTimeoutError):
+                task_result.add_timeout(stalled = e.stalled)
+            raise
+        task_result.add_rusage(result.rusage)
+        return result.stderr
+
+    @contextmanager
+    def _stage_dir(self, task_result):
+        ''' Temp dir for the task outputs
+            Kept for the finalize stage when outputs there are deferred to it
+        '''
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            yield tmp_dir
+        finally:
+            if task_result.finalize_pending:
+                task_result.finalize_state['tmp_dirs'].append(tmp_dir)
+            else:
+                shutil.rmtree(tmp_dir)
+
+    def _finalize_output(self, fpath, task_result, target_fname = None, copy = False, restore_tags = True):
+        ''' Restores an output tags and moves (or copies) it to the target dir,
+            or defers that to the finalize stage when staged
+        '''
+        output = (fpath, target_fname, copy, restore_tags)
+        if not self.staged:
+            self._finalize_outputs([output], task_result)
+            return
+        if not task_result.finalize_pending:
+            task_result.finalize_state = dict(outputs = [], tmp_dirs = [], tag_holder = self.tag_holder)
+        task_result.finalize_state['outputs'].append(output)
+
+    @timed
+    def _finalize_outputs(self, outputs, task_result):
+        for fpath, target_fname, copy, restore_tags in outputs:
+            if restore_tags:
+                self._restore_tags(fpath)
+            self._move_to_target(fpath, task_result, target_fname = target_fname, copy = copy)
+
+    def _move_to_target(self, fpath, task_result, target_fname = None, copy = False):
+        ''' Moves (or copies) an output file to the target dir
+            via a temp name there, so the target file is either complete or not there at all
+        '''
+        target_fpath = os.path.join(self.target_dir, target_fname if target_fname else os.path.basename(fpath))
+        part_fpath = '{}.part'.format(target_fpath)
+        if copy:
+            shutil.copy(fpath, part_fpath)
+        else:
+            shutil.move(fpath, part_fpath)
+        os.replace(part_fpath, target_fpath)
+        task_result.add_output_path(target_fpath)
+
+    def _operation(self):
+        operation = type(self).__name__
+        return operation[:-len('Task')] if operation.endswith('Task') else operation
+
+    def _codec(self):
+        if self._stream_copy:
+            return 'copy'
+        try:
+            argv = shlex.split(''.join((self.ff_general_options, self.ff_other_options or '')))
+        except ValueError:
+            argv = []
+        encoders = sorted({value for option, value in zip(argv, argv[1:]) if option in self.CODEC_OPTIONS})
+        if encoders:
+            return '+'.join(encoders)
+        return self._output_format().lstrip('.').lower() or 'default'
+
+    def _output_format(self):
+        ''' Output file extension
+        '''
+        return os.path.splitext(self.fpath)[1]
+
+    def _duration_media_entry(self):
+        ''' Memoized, as asked for by the task costs, progress and throughput helpers
+        '''
+        if self._media_entry is _NOT_PROBED:
+            self._media_entry = FFH.media_file_info_full(self.fpath, header_probe = True,
+                                                                        profile = FFProbeProfile.DURATION)
+        return self._media_entry
+
+    @property
+    def _stream_copy(self):
+        return FFmpegCommands.COPY_CODECS in ''.join((self.ff_general_options, self.ff_other_options or ''))
+
     # FFmpeg command parts builders
+    def _ff_cmd_threads(self):
+        return FFmpegCommands.threads(self.cpu_threads) if self.cpu_threads else ''
+
     def _ff_cmd_exclude_artwork_streams(self):
-        media_entry = FFH.media_file_info_full(self.fpath)
+        media_entry = FFH.media_file_info_full(self.fpath, profile = FFProbeProfile.ARTWORK)
         exclude_artworks_cmd = ''
         if media_entry:
             for artwork_stream in media_entry.artwork_streams:
@@ -108,55 +349,375 @@ class FFMPRunner:
             print(FFmpegNotInstalled().default_message)
             sys.exit(0)
 
-    def run_tasks(self, tasks, msg = None, serial_exec = False, quiet = False):
+        # probes memoization of the latest run, active in its scope
+        self.probe_registry = FFProbeRegistry()
+
+    @LazyFunctionPropertyDescriptor
+    def throughput_history(self):
+        ''' Tasks throughput of the previous runs, for predicting planned runs
+            Read as a run records its results or predicts its tasks, i.e. not when building runners
+        '''
+        return ThroughputHistory.default()
+
+    def run_tasks(self, tasks, msg = None, serial_exec = False, quiet = False, journal = None, coordinator = None,
+                                                                    records_path = None, concurrency_bounds = None,
+                                                                    finalize_workers = None):
+        tasks_report = None
         if tasks and len(tasks) > 0:
             print('{0} media files to process'.format(len(tasks)) if msg is None else msg)
 
-            (tasks_results, cpu_core_time), total_elapsed = TasksProcessor().process_tasks(tasks,
-                                                                            serial_exec = serial_exec,
-                                                                            quiet = quiet)
+            tasks_processor, executor_type = self._tasks_processor(journal, coordinator, records_path,
+                                                                            concurrency_bounds, finalize_workers,
+                                                                            self.throughput_history)
+            _, total_elapsed = tasks_processor.process_tasks(tasks, serial_exec = serial_exec, quiet = quiet,
+                                                             executor_type = executor_type, keep_results = False)
+            tasks_report = tasks_processor.tasks_report
+            if self.throughput_history:
+                self.throughput_history.save()
             # print run report
             if not quiet:
-                self.run_report(tasks_results, cpu_core_time, total_elapsed)
+                self.run_report(tasks_processor.tasks_report, total_elapsed,
+                                            scheduling_report = tasks_processor.scheduling_report,
+                                            num_skipped = tasks_processor.num_skipped,
+                                            cpu_budget = tasks_processor.cpu_budget,
+                                            concurrency_controller = tasks_processor.concurrency_controller)
         else:
             print('No media files to process')
 
+        if journal:
+            self._close_journal(journal, tasks_report)
 
-    def run_report(self, tasks_results, cpu_core_time, total_elapsed):
-        ''' Info summary on executed FFMP commands
-        '''
-        succeeded = sum(1 for result in tasks_results if result.succeeded)
-        failed = sum(1 for result in tasks_results if not result.succeeded)
 
+    def run_report(self, tasks_report, total_elapsed, scheduling_report = None, num_skipped = 0, cpu_budget = None,
+                                                                                    concurrency_controller = None):
+        ''' Info summary on executed FFMP commands, from the run tasks report
+            The cumulative tasks running time is wall-clock,
+            the FFmpeg CPU time is from the commands actual resources usage
+        '''
         total_elapsed_str = MiscHelpers.time_delta_str(total_elapsed)
-        cpu_core_time_str = MiscHelpers.time_delta_str(cpu_core_time)
+        cpu_core_time_str = MiscHelpers.time_delta_str(tasks_report.tasks_duration)
 
-        num_tasks = len(tasks_results)
+        num_tasks = tasks_report.num_tasks
         print('Finished running {0} task{1} '\
                         '(Succeeded: {2}, Failed: {3})'.format(num_tasks,
                                                             '' if num_tasks == 1 else 's',
-                                                            succeeded, failed))
-        print('Cumulative FFmpeg CPU Cores time: {}'.format(cpu_core_time_str))
+                                                            tasks_report.num_succeeded, tasks_report.num_failed))
+        if num_skipped:
+            print('Skipped {0} task{1} completed in a previous run'.format(num_skipped,
+                                                            '' if num_skipped == 1 else 's'))
+        retried = tasks_report.num_retried
+        if retried:
+            print('Retried {0} task{1} (Timeouts: {2}, Stalls: {3})'.format(retried,
+                                                            '' if retried == 1 else 's',
+                                                            tasks_report.num_timeouts, tasks_report.num_stalls))
+        for key, task_output in tasks_report.failure_samples:
+            print('Failed: {0}{1}'.format(key if key else '-', '\n {}'.format(task_output) if task_output else ''))
+        if tasks_report.num_failed > len(tasks_report.failure_samples):
+            print(' ... and {} more failed tasks'.format(tasks_report.num_failed - len(tasks_report.failure_samples)))
+
+        print('Cumulative tasks running time: {}'.format(cpu_core_time_str))
+        durations_histogram = tasks_report.durations_histogram()
+        if durations_histogram:
+            print('Tasks running times: {}'.format(', '.join('{0}: {1}'.format(label, count)
+                                                                        for label, count in durations_histogram)))
         print('Total running time: {}'.format(total_elapsed_str))
+        if tasks_report.records_path:
+            print('Tasks records: {}'.format(tasks_report.records_path))
+        self._usage_report(tasks_report, total_elapsed, cpu_budget)
+        if concurrency_controller and concurrency_controller.concurrency is not None:
+            self._concurrency_report(concurrency_controller)
+        if scheduling_report:
+            print('Tasks scheduling: predicted makespan {0} (in walk order: {1}), actual {2}'.format(
+                                        MiscHelpers.time_delta_str(scheduling_report.predicted_makespan),
+                                        MiscHelpers.time_delta_str(scheduling_report.submit_order_makespan),
+                                        MiscHelpers.time_delta_str(scheduling_report.actual_makespan)))
+        print(self.probe_registry.stats_msg)
+
+
+    def _usage_report(self, tasks_report, total_elapsed, cpu_budget = None):
+        ''' FFmpeg commands resources usage, i.e. for sizing the pool / the nodes
+              . CPU utilization: FFmpeg CPU time vs. the CPUs available over the run
+              . parallel efficiency: the tasks running time vs. the pool workers time over the run
+        '''
+        user_time, system_time = tasks_report.user_time, tasks_report.system_time
+        if not user_time and not system_time:
+            # e.g. no resources usage on the platform
+            return
+        print('FFmpeg CPU time: {0} (user: {1}, system: {2})'.format(
+                                                    MiscHelpers.time_delta_str(user_time + system_time),
+                                                    MiscHelpers.time_delta_str(user_time),
+                                                    MiscHelpers.time_delta_str(system_time)))
+        if cpu_budget and total_elapsed:
+            print('CPU utilization: {0:.0%} of {1} CPU{2}, parallel efficiency: {3:.0%} of {4} worker{5}'.format(
+                                    (user_time + system_time) / (total_elapsed * cpu_budget.num_cpus),
+                                    cpu_budget.num_cpus, '' if cpu_budget.num_cpus == 1 else 's',
+                                    tasks_report.tasks_duration / (total_elapsed * cpu_budget.num_workers),
+                                    cpu_budget.num_workers, '' if cpu_budget.num_workers == 1 else 's'))
+
+        print('FFmpeg I/O blocks: {0} in, {1} out'.format(tasks_report.in_blocks, tasks_report.out_blocks))
+
+        peak_memory = tasks_report.peak_memory
+        if peak_memory:
+            print('Peak memory: {}'.format(', '.join('{0} ({1})'.format(FSH.fs_size(max_rss),
+                                                                os.path.basename(key) if key else '-')
+                                                                            for max_rss, key in peak_memory)))
+
+
+    @staticmethod
+    def _concurrency_report(controller):
+        ''' Adaptive concurrency decisions, i.e. how the run shared the host
+        '''
+        print('Adaptive concurrency: {0} adjustment{1}, ran {2}-{3} tasks concurrently '
+                                        '(bounds: {4}-{5})'.format(controller.num_decisions,
+                                                            '' if controller.num_decisions == 1 else 's',
+                                                            controller.lowest, controller.highest,
+                                                            controller.min_workers, controller.max_workers))
+        if controller.num_decisions > len(controller.decisions):
+            print(' ... latest {} adjustments:'.format(len(controller.decisions)))
+        for decision in controller.decisions:
+            print(' at {0}: {1} -> {2} ({3})'.format(MiscHelpers.time_delta_str(decision.elapsed),
+                                                decision.concurrency, decision.new_concurrency, decision.reason))
+
+
+    def run_tasks_stream(self, tasks_stream, serial_exec = False, quiet = False, journal = None, coordinator = None,
+                                                                    records_path = None, concurrency_bounds = None,
+                                                                    finalize_workers = None):
+        ''' Runs tasks as they are generated
+            The tasks results are not kept, only aggregated into the run report
+        '''
+        tasks_processor, executor_type = self._tasks_processor(journal, coordinator, records_path,
+                                                                            concurrency_bounds, finalize_workers,
+                                                                            self.throughput_history)
+        _, total_elapsed = tasks_processor.process_tasks_stream(tasks_stream, serial_exec = serial_exec, quiet = quiet,
+                                                                executor_type = executor_type, keep_results = False)
+        if not tasks_processor.tasks_report.num_tasks and not tasks_processor.num_skipped:
+            print('No media files to process')
+        elif not quiet:
+            self.run_report(tasks_processor.tasks_report, total_elapsed,
+                                            num_skipped = tasks_processor.num_skipped,
+                                            cpu_budget = tasks_processor.cpu_budget,
+                                            concurrency_controller = tasks_processor.concurrency_controller)
+
+        if journal:
+            self._close_journal(journal, tasks_processor.tasks_report)
+        if self.throughput_history:
+            self.throughput_history.save()
+
+
+    def run_worker(self, coordinator, num_slots = None):
+        ''' Runs tasks served by a coordinator, till it is done
+        '''
+        print('Running tasks served at: {}'.format(coordinator))
+        with self._probes_scope():
+            num_done = TasksWorker(coordinator, num_slots = num_slots).run()
+        print('Finished running {0} task{1}'.format(num_done, '' if num_done == 1 else 's'))
 
 
     ## Internal helpers
     @staticmethod
-    def _prepare_files(ff_entry_params, pass_filter = None):
+    def _close_journal(journal, tasks_report = None):
+        ''' Discards the journal of a run done in full, i.e. keeps it just for resuming failed tasks
+        '''
+        if tasks_report and not tasks_report.num_failed:
+            journal.discard()
+        else:
+            journal.close()
+
+    @staticmethod
+    def _tasks_processor(journal = None, coordinator = None, records_path = None, concurrency_bounds = None,
+                                                            finalize_workers = None, throughput_history = None):
+        ''' Tasks processor and its execution backend, i.e. remote workers when serving at a coordinator address
+            With concurrency bounds (min, max), the running tasks are adapted to the system pressure
+            finalize_workers is the finalize stage pool width (tagging / moving the outputs), 0 for no stage
+            The succeeded tasks are recorded in the throughput history, if any
+        '''
+        if coordinator:
+            return (TasksProcessor(journal = journal, records_path = records_path,
+                                            executor_options = dict(address = coordinator),
+                                            throughput_history = throughput_history),
+                                                                            TasksExecutorType.DISTRIBUTED)
+        concurrency_controller = AdaptiveConcurrency(*concurrency_bounds) if concurrency_bounds else None
+        return TasksProcessor(journal = journal, records_path = records_path,
+                                            concurrency_controller = concurrency_controller,
+                                            finalize_workers = finalize_workers,
+                                            throughput_history = throughput_history), None
+
+    def _process_files(self, ff_entry_params, task_builder, pass_filter = None, msg_builder = None):
+        ''' Builds & runs tasks for matching media files
+            In streaming mode, the tasks are built and dispatched while the source directory is still walked
+            Otherwise, all the tasks are built upfront, to be scheduled most expensive first
+            The tasks progress is journaled in the target dir, for resuming interrupted / failed runs
+            In plan-only mode, writes the tasks manifest instead of running them
+            When sharded, runs only the tasks of the shard, per the manifest if given
+        '''
+        max_probes = FFProbeRegistry.STREAMING_MAX_ENTRIES if ff_entry_params.streaming else None
+        with self._probes_scope(self._run_probe_profile(ff_entry_params), max_entries = max_probes):
+            plan = TasksPlan.load(ff_entry_params.manifest_path) if ff_entry_params.manifest_path else None
+            if plan and plan.info.get('target_path_dir'):
+                target_path_dir = plan.info['target_path_dir']
+            else:
+                target_path_dir = self._target_path_dir(ff_entry_params)
+            journal = JobJournal(target_path_dir, name = self._shard_name(ff_entry_params))
+            task_builder = self._time_limited(task_builder, ff_entry_params)
+            if ff_entry_params.resume and journal.num_completed and not ff_entry_params.quiet:
+                print('Resuming in: {}'.format(target_path_dir))
+
+            if ff_entry_params.streaming:
+                tasks = (task_builder(media_file, target_dir)
+                            for media_file, target_dir in self._stream_files(ff_entry_params, pass_filter = pass_filter,
+                                                                                    target_path_dir = target_path_dir))
+                self.run_tasks_stream(tasks, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet,
+                                                    journal = journal, coordinator = ff_entry_params.coordinator,
+                                                    records_path = ff_entry_params.records_path,
+                                                    concurrency_bounds = ff_entry_params.concurrency_bounds,
+                                                    finalize_workers = ff_entry_params.finalize_workers)
+            else:
+                media_files, target_dirs = self._prepare_files(ff_entry_params, pass_filter = pass_filter,
+                                                                                    target_path_dir = target_path_dir)
+                tasks = [task_builder(media_file, target_dir) for media_file, target_dir in zip(media_files, target_dirs)]
+                if ff_entry_params.plan_path:
+                    self._save_plan(tasks, ff_entry_params, target_path_dir)
+                    return
+                if ff_entry_params.shard:
+                    tasks = self._shard_tasks(tasks, ff_entry_params, plan)
+                msg = msg_builder(len(tasks)) if msg_builder and tasks else None
+                self.run_tasks(tasks, msg = msg, serial_exec = ff_entry_params.serial_exec, quiet = ff_entry_params.quiet,
+                                                    journal = journal, coordinator = ff_entry_params.coordinator,
+                                                    records_path = ff_entry_params.records_path,
+                                                    concurrency_bounds = ff_entry_params.concurrency_bounds,
+                                                    finalize_workers = ff_entry_params.finalize_workers)
+
+    @contextmanager
+    def _probes_scope(self, run_profile = None, max_entries = None):
+        ''' Memoizes the media probes for the duration of a run,
+            probed at the run profile if given
+        '''
+        with FFProbeRegistry.run_scope(run_profile, max_entries) as probe_registry:
+            self.probe_registry = probe_registry
+            yield probe_registry
+
+    @staticmethod
+    def _run_probe_profile(ff_entry_params):
+        ''' Strongest probe profile of a run, i.e. the tasks durations and artwork streams,
+            plus the tags when preserving them
+        '''
+        return FFProbeProfile.FULL if ff_entry_params.preserve_metadata else FFProbeProfile.DURATION
+
+    def _save_plan(self, tasks, ff_entry_params, target_path_dir):
+        ''' Writes the tasks manifest, for running it later e.g. in shards
+            Dry run, i.e. no FFmpeg commands are run: the media durations are from the (cached) probes,
+            the predicted output size / running times are from the throughput history of previous runs
+        '''
+        plan = TasksPlan.build(tasks, src_dir = ff_entry_params.src_dir, target_path_dir = target_path_dir)
+        planned_tasks = [task for task in tasks if task.journal_key() is not None]
+        input_bytes = sum(self._file_size(task.fpath) for task in planned_tasks)
+        estimate = self._plan_estimate(plan, planned_tasks, ff_entry_params)
+        plan.info['estimate'] = dict(estimate._asdict(), input_bytes = input_bytes)
+        plan.save(ff_entry_params.plan_path)
+
+        print('Planned {0} media file{1} (estimated cost: {2:.1f}), manifest: {3}'.format(len(plan.entries),
+                                                        '' if len(plan.entries) == 1 else 's',
+                                                        plan.total_cost, ff_entry_params.plan_path))
+        print('Media duration: {0}, total size: {1}'.format(MiscHelpers.time_delta_str(estimate.work),
+                                                                            FSH.fs_size(input_bytes)))
+        if estimate.num_predicted:
+            print('Predicted output size: {0}, tasks running time: {1}, wall time: {2} ({3} worker{4})'.format(
+                                                        FSH.fs_size(estimate.output_bytes),
+                                                        MiscHelpers.time_delta_str(estimate.tasks_duration),
+                                                        MiscHelpers.time_delta_str(estimate.makespan),
+                                                        estimate.num_workers, '' if estimate.num_workers == 1 else 's'))
+            num_extrapolated = estimate.num_tasks - estimate.num_predicted
+            if num_extrapolated:
+                print(' ... extrapolated for {0} media file{1} with no throughput history'.format(num_extrapolated,
+                                                                            '' if num_extrapolated == 1 else 's'))
+        else:
+            print('No throughput history for the planned tasks yet, predictions are available after running some')
+
+    def _plan_estimate(self, plan, planned_tasks, ff_entry_params):
+        ''' Predicted figures of the planned tasks, as run with the planned pool of workers
+        '''
+        if ff_entry_params.serial_exec:
+            num_workers = 1
+        else:
+            num_workers = CPUBudgetPlanner().plan([task.threads_hint() for task in planned_tasks]).num_workers
+            if ff_entry_params.concurrency_bounds and ff_entry_params.concurrency_bounds[1]:
+                num_workers = ff_entry_params.concurrency_bounds[1]
+        costs = {entry.key: entry.cost for entry in plan.entries}
+        history = self.throughput_history if self.throughput_history else ThroughputHistory()
+        return history.estimate(planned_tasks, [costs[task.journal_key()] for task in planned_tasks], num_workers)
+
+    @staticmethod
+    def _file_size(fpath):
+        try:
+            return os.path.getsize(fpath)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _shard_tasks(tasks, ff_entry_params, plan = None):
+        ''' Tasks of the shard, balanced by cost across the shards
+        '''
+        shard, num_shards = ff_entry_params.shard
+        if not plan:
+            plan = TasksPlan.build(tasks)
+        shard_tasks = plan.shard_tasks(tasks, shard, num_shards)
+        if not ff_entry_params.quiet:
+            print('Shard {0}/{1}: {2} of {3} media files'.format(shard, num_shards, len(shard_tasks), len(tasks)))
+        return shard_tasks
+
+    @staticmethod
+    def _shard_name(ff_entry_params):
+        if not ff_entry_params.shard:
+            return None
+        return 'shard{0}of{1}'.format(*ff_entry_params.shard)
+
+    @staticmethod
+    def _time_limited(task_builder, ff_entry_params):
+        ''' Applies the run time limits to the built tasks
+        '''
+        def _task_builder(media_file, target_dir):
+            task = task_builder(media_file, target_dir)
+            task.timeout = ff_entry_params.task_timeout
+            task.stall_timeout = ff_entry_params.stall_timeout
+            return task
+        return _task_builder
+
+    @staticmethod
+    def _prepare_files(ff_entry_params, pass_filter = None, target_path_dir = None):
         ''' Builds a list of matching media files to process,
             along with their respective target out dirs
         '''
+        media_files, target_dirs = [], []
+        for media_file, target_dir in FFMPRunner._stream_files(ff_entry_params, pass_filter = pass_filter,
+                                                                            target_path_dir = target_path_dir):
+            media_files.append(media_file)
+            target_dirs.append(target_dir)
+
+        return media_files, target_dirs
+
+    @staticmethod
+    def _stream_files(ff_entry_params, pass_filter = None, target_path_dir = None):
+        ''' Generates matching media files to process, along with their respective target out dirs,
+            as the source directory is walked
+        '''
         if not pass_filter:
             pass_filter = lambda fpath: FFH.ffmpeg_supported_media(fpath)
-        
-        media_files = [entry.realpath for entry in DWalker.file_entries(ff_entry_params, pass_filter = pass_filter)]
-
-        target_dirs = FFMPRunner._setup_target_dirs(ff_entry_params, fpathes = media_files)
 
-        return media_files, target_dirs
+        for entry in DWalker.file_entries(ff_entry_params, pass_filter = pass_filter, bulk_probe = True):
+            if target_path_dir is None:
+                target_path_dir = FFMPRunner._target_path_dir(ff_entry_params)
+            yield entry.realpath, FFMPRunner._target_dir(ff_entry_params, target_path_dir, entry.realpath)
 
     @staticmethod
     def _setup_target_dirs(ff_entry_params, fpathes = None):
+        target_path_dir = FFMPRunner._target_path_dir(ff_entry_params)
+        return [FFMPRunner._target_dir(ff_entry_params, target_path_dir, fpath) for fpath in fpathes]
+
+    @staticmethod
+    def _target_path_dir(ff_entry_params):
+        ''' Unique target path, within the target dir
+            When resuming, the target path of the last journaled run
+        '''
         # check inputs
         # target dir prefix
         DEFAULT_TARGET_DIR_PREFIX = 'processed'
@@ -168,22 +729,46 @@ class FFMPRunner:
 
         # target path (within the target dir)
         target_dir_name = '{0}_{1}'.format(os.path.basename(ff_entry_params.src_dir), ff_entry_params.target_dir_prefix)
+        if ff_entry_params.shard:
+            # shared by all the shards
+            return os.path.join(ff_entry_params.target_dir, target_dir_name)
+        if ff_entry_params.resume:
+            resume_path_dir = FFMPRunner._resume_path_dir(ff_entry_params.target_dir, target_dir_name)
+            if resume_path_dir:
+                return resume_path_dir
         target_dir_name = UniqueDirNamesChecker(ff_entry_params.target_dir).unique_name(target_dir_name)
-        target_path_dir = os.path.join(ff_entry_params.target_dir, target_dir_name)
+        return os.path.join(ff_entry_params.target_dir, target_dir_name)
 
-        # target dirs
-        target_dirs = []
-        for fpath in fpathes:
-            relpath = os.path.relpath(os.path.dirname(fpath), ff_entry_params.src_dir)
-            if relpath.startswith(os.pardir):
-                raise ValueError('File not in specified source directory or its subfolders')
-            elif relpath.endswith('{}'.format(os.path.curdir)):
-                relpath = relpath[:-1]
-
-            target_path = os.path.join(target_path_dir, relpath)
-            if not os.path.exists(target_path):
-                os.makedirs(target_path)
-            target_dirs.append(target_path)
-
-        return target_dirs
+    @staticmethod
+    def _resume_path_dir(target_dir, target_dir_name):
+        ''' The most recently journaled of the target path and its unique names variants
+        '''
+        name_pattern = re.compile(r'{}(_\d+)?$'.format(re.escape(target_dir_name)))
+        resume_path_dir, journal_mtime = None, None
+        try:
+            dir_names = os.listdir(target_dir)
+        except OSError:
+            return None
+        for dir_name in dir_names:
+            path_dir = os.path.join(target_dir, dir_name)
+            if name_pattern.match(dir_name) and JobJournal.exists(path_dir):
+                mtime = os.path.getmtime(JobJournal.path(path_dir))
+                if journal_mtime is None or mtime > journal_mtime:
+                    resume_path_dir, journal_mtime = path_dir, mtime
+        return resume_path_dir
 
+    @staticmethod
+    def _target_dir(ff_entry_params, target_path_dir, fpath):
+        ''' Target dir of a media file, mirroring its source dir
+        '''
+        relpath = os.path.relpath(os.path.dirname(fpath), ff_entry_params.src_dir)
+        if relpath.startswith(os.pardir):
+            raise ValueError('File not in specified source directory or its subfolders')
+        elif relpath.endswith('{}'.format(os.path.curdir)):
+            relpath = relpath[:-1]
+
+        target_path = os.path.join(target_path_dir, relpath)
+        if not ff_entry_params.plan_path:
+            # shards might be creating it concurrently
+            os.makedirs(target_path, exist_ok = True)
+        return target_path
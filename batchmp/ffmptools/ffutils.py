@@ -14,14 +14,24 @@
 
 import os, subprocess, shlex, sys
 import time, datetime, json, re
+import filetype
 from collections import namedtuple
-from batchmp.fstools.builders.fsentry import FSMediaEntryType
+from contextlib import closing
+from batchmp.fstools.builders.fsentry import FSMediaEntryType, FSMediaScanLevel
 from batchmp.commons.utils import (
     run_cmd,
     CmdProcessingError,
     MiscHelpers
 )
+from batchmp.commons.launcher import CmdLauncher
 from batchmp.fstools.fsutils import FSH
+from batchmp.ffmptools.utils.probecache import FFProbeCache
+from batchmp.ffmptools.utils.proberegistry import FFProbeRegistry
+from batchmp.ffmptools.utils.hdrprobe import FFHeaderProbe
+from batchmp.ffmptools.utils.fftools import FFToolsRegistry
+from batchmp.ffmptools.utils.proberecords import FFProbeRecords
+from batchmp.ffmptools.utils.probeprofiles import FFProbeProfile
+from batchmp.ffmptools.utils.ffanalysis import FFSilenceParser, FFVolumeParser
 
 class FFmpegNotInstalled(Exception):
     def __init__(self, message = None):
@@ -83,6 +93,7 @@ class FFHDefaults:
     DEFAULT_SILENCE_MIN_DURATION = 2
     DEFAULT_SILENCE_NOISE_TOLERANCE = 0.005
     DEFAULT_SILENCE_TARGET_TRIMMED_DURATION = 2
+    DEFAULT_STALL_TIMEOUT = 600
 
 class FFH:
     ''' FFmpeg-related utilities
@@ -90,24 +101,22 @@ class FFH:
     FFEntry = namedtuple('FFEntry', ['path', 'format', 'audio', 'artwork', 'video'])
     FFFullEntry = namedtuple('FFFullEntry', ['path', 'format', 'audio_streams',
                                                             'video_streams', 'artwork_streams'])
+    # picklable by their nested names, e.g. as shipped along with the tasks to pool workers
+    FFEntry.__qualname__, FFFullEntry.__qualname__ = 'FFH.FFEntry', 'FFH.FFFullEntry'
 
     @staticmethod
     def ffmpeg_installed():
         """ Checks if ffmpeg is installed and in system PATH
+            The lookup is done once per process, via the FFmpeg tools registry
         """
-        ffmpeg_app_name = 'ffmpeg' if os.name != 'nt' else 'ffmpeg.exe'
-        for path in os.environ['PATH'].split(os.pathsep):
-            app_path = os.path.join(path, ffmpeg_app_name)
-            if os.path.isfile(app_path) and os.access(app_path, os.X_OK):
-                return True
-        return False
+        return FFToolsRegistry.shared().ffmpeg_installed
 
     @staticmethod
-    def media_file_info(fpath):
+    def media_file_info(fpath, header_probe = False, profile = FFProbeProfile.FULL):
         ''' Compact media file info
             Extracts main audio / artwork streams
         '''
-        full_entry = FFH.media_file_info_full(fpath)
+        full_entry = FFH.media_file_info_full(fpath, header_probe = header_probe, profile = profile)
         if full_entry:
             audio_stream = artwork_stream = video_stream = None
             if full_entry.audio_streams and len(full_entry.audio_streams) > 0:
@@ -128,47 +137,112 @@ class FFH:
             return None
 
     @staticmethod
-    def media_file_info_full(fpath):
+    def media_file_info_full(fpath, header_probe = False, profile = FFProbeProfile.FULL):
         ''' Gathers full info about a media file
+            The probe profile limits what ffprobe looks for, e.g. to just stream types
+            or durations. Narrower profiles results leave out the not-asked-for entries
+            Within a run, probe results are memoized in the active probe registry,
+            probed at the run profile if fuller
+            With header_probe, common audio containers are probed natively in-process,
+            with ffprobe only used when the header probe returns nothing.
+            Header probe results carry no tags / artwork streams,
+            and thus are neither memoized nor cached
+        '''
+        if header_probe:
+            out = FFHeaderProbe.probe(fpath)
+            if out:
+                return FFH._full_entry(fpath, *FFProbeRecords.from_probe(out))
+
+        probe_registry = FFProbeRegistry.active()
+        if probe_registry is not None:
+            # probed at the run profile, i.e. once for all of the run lookups
+            probe_profile = probe_registry.probe_profile(profile)
+            return probe_registry.lookup(fpath,
+                                         lambda fpath: FFH._probe_media_file(fpath, profile = probe_profile),
+                                         profile = profile, probe_profile = probe_profile)
+        return FFH._probe_media_file(fpath, profile = profile)
+
+    @staticmethod
+    def _probe_media_file(fpath, profile = FFProbeProfile.FULL):
+        ''' Probes a media file via ffprobe
+            Probe results are kept in the persistent probe cache,
+            so unchanged media files are only ever probed once per profile
         '''
         if not FFH.ffmpeg_installed():
             return None
 
-        cmd = ''.join(('ffprobe ',
-                            ' -v quiet',
-                            ' -show_streams',
-                            #' -select_streams a',
-                            ' -show_format',
-                            ' -print_format json',
-                            ' {}'.format(shlex.quote(fpath))))
+        probe_cache = FFProbeCache.shared()
+        identity = FFProbeCache.file_identity(fpath) if probe_cache is not None else None
+        data = probe_cache.get(fpath, identity = identity, profile = profile) if identity else None
+        if data:
+            return FFH._full_entry(fpath, *FFProbeRecords.loads(data))
+
+        # e.g. next to ffmpeg, not in $PATH
+        ffprobe_path = FFToolsRegistry.shared().ffprobe_path
+        if not ffprobe_path:
+            return None
+        argv = [ffprobe_path, '-v', 'quiet']
+        argv.extend(profile.ffprobe_args)
+        argv.extend(('-print_format', 'json', fpath))
         try:
-            output, _ = run_cmd(cmd)
+            output = CmdLauncher.run(argv).stdout
         except CmdProcessingError as e:
+            # e.g. not a media file
+            output = e.result.stdout if e.result else None
+        except OSError:
+            # ffprobe did not run, e.g. out of processes
             return None
-        else:
-            out = json.loads(output)
-            if not out:
-                return None
 
-            streams = out.get('streams')
-            format = out.get('format')
-            audio_streams = video_streams = artwork_streams = None
-            if streams:
-                is_audio_stream = lambda stream: True if stream.get('codec_type') == 'audio' else False
-                is_video_stream = lambda stream: True if (stream.get('codec_type') == 'video' and format.get('format_name') != 'tty') else False
+        try:
+            out = json.loads(output) if output else None
+        except ValueError:
+            # truncated output, e.g. a killed ffprobe
+            return None
+        if not out:
+            # not a media file, or a failed probe: neither is persisted
+            return None
+
+        format, streams = FFProbeRecords.from_probe(out)
+        if identity:
+            probe_cache.put(fpath, FFProbeRecords.dumps(format, streams),
+                                                        identity = identity, profile = profile)
+        return FFH._full_entry(fpath, format, streams)
+
+    @staticmethod
+    def _full_entry(fpath, format, streams):
+        ''' Builds full entry from format / stream probe records
+        '''
+        audio_streams = video_streams = artwork_streams = ()
+        if streams:
+            is_audio_stream = lambda stream: True if stream.get('codec_type') == 'audio' else False
+            is_video_stream = lambda stream: True if (stream.get('codec_type') == 'video' and \
+                                                    not (format and format.get('format_name') == 'tty')) else False
+
+            is_image_stream = lambda stream: True if \
+                    stream.get('codec_name', '').lower() in FFH.common_media_extensions(FSMediaEntryType.IMAGE) else False
 
-                is_image_stream = lambda stream: True if \
-                        stream['codec_name'].lower() in FFH.common_media_extensions(FSMediaEntryType.IMAGE) else False
 
+            audio_streams = tuple(stream for stream in streams if is_audio_stream(stream))
+            video_streams = tuple(stream for stream in streams if \
+                                    is_video_stream(stream) and not is_image_stream(stream))
+            artwork_streams = tuple(stream for stream in streams if \
+                                    is_video_stream(stream) and is_image_stream(stream))
 
-                audio_streams = [stream for stream in streams if is_audio_stream(stream)]
-                video_streams = [stream for stream in streams if \
-                                        is_video_stream(stream) and not is_image_stream(stream)]
-                artwork_streams = [stream for stream in streams if \
-                                        is_video_stream(stream) and is_image_stream(stream)]
+        return FFH.FFFullEntry(fpath, format, audio_streams, video_streams, artwork_streams)
 
-            format = out.get('format')
-            return FFH.FFFullEntry(fpath, format, audio_streams, video_streams, artwork_streams)
+    @staticmethod
+    def media_duration(fpath):
+        ''' Media duration in seconds, 0.0 if not available
+            Tries the native header probe first
+        '''
+        full_entry = FFH.media_file_info_full(fpath, header_probe = True, profile = FFProbeProfile.DURATION)
+        if full_entry:
+            duration = full_entry.format.get('duration') if full_entry.format else None
+            if duration is None and full_entry.audio_streams:
+                duration = full_entry.audio_streams[0].get('duration')
+            if duration is not None:
+                return duration
+        return 0.0
 
     @staticmethod
     def ffmpeg_supported_media(fpath = None, ffentry = None):
@@ -178,21 +252,28 @@ class FFH:
         return media_type in (FSMediaEntryType.VIDEO, FSMediaEntryType.AUDIO)
 
     @staticmethod
-    def media_type(fpath = None, ffentry = None, fast_scan = False):
+    def media_type(fpath = None, ffentry = None, fast_scan = False, scan_level = None):
         ''' Determines file media type
+            scan_level (FSMediaScanLevel):
+                EXTENSION:  trusts the file extension
+                CONTENT:    classifies by content signature,
+                            falling back to probing when that can't tell
+                FULL:       probes the media file
+            if not specified, defaults to EXTENSION for fast_scan and FULL otherwise
         '''
-        if fast_scan and fpath and not ffentry:
-            fpath_ext = FSH.path_extension(fpath)
-            if fpath_ext in FFH.common_media_extensions(FSMediaEntryType.IMAGE):
-                return FSMediaEntryType.IMAGE
-            elif fpath_ext in FFH.common_media_extensions(FSMediaEntryType.AUDIO):
-                return FSMediaEntryType.AUDIO
-            elif fpath_ext in FFH.common_media_extensions(FSMediaEntryType.VIDEO):
-                return FSMediaEntryType.VIDEO
-            else:
-                return FSMediaEntryType.NONMEDIA
-
-        ffentry = ffentry if ffentry else FFH.media_file_info(fpath)
+        if scan_level is None:
+            scan_level = FSMediaScanLevel.EXTENSION if fast_scan else FSMediaScanLevel.FULL
+
+        if fpath and not ffentry:
+            if scan_level == FSMediaScanLevel.EXTENSION:
+                return FFH.extension_media_type(fpath)
+            elif scan_level == FSMediaScanLevel.CONTENT:
+                media_type = FFH.content_media_type(fpath)
+                if media_type is not None:
+                    return media_type
+
+        ffentry = ffentry if ffentry else FFH.media_file_info(fpath, header_probe = True,
+                                                                        profile = FFProbeProfile.TYPE)
         if ffentry:
             if hasattr(ffentry, "video")and ffentry.video:
                 return FSMediaEntryType.VIDEO
@@ -203,6 +284,52 @@ class FFH:
 
         return FSMediaEntryType.NONMEDIA            
 
+    @staticmethod
+    def extension_media_type(fpath):
+        ''' Determines file media type from file extension
+        '''
+        fpath_ext = FSH.path_extension(fpath)
+        if fpath_ext in FFH.common_media_extensions(FSMediaEntryType.IMAGE):
+            return FSMediaEntryType.IMAGE
+        elif fpath_ext in FFH.common_media_extensions(FSMediaEntryType.AUDIO):
+            return FSMediaEntryType.AUDIO
+        elif fpath_ext in FFH.common_media_extensions(FSMediaEntryType.VIDEO):
+            return FSMediaEntryType.VIDEO
+        else:
+            return FSMediaEntryType.NONMEDIA
+
+    # number of leading bytes used for content signatures
+    CONTENT_SIGNATURE_SIZE = 512
+
+    # containers that can hold either audio or video streams, i.e. need a deeper look
+    MULTIPURPOSE_CONTAINERS = ('video/mp4', 'audio/mp4', 'video/quicktime', 'video/3gpp',
+                               'video/x-matroska', 'video/webm', 'audio/ogg',
+                               'video/x-ms-wmv', 'video/x-flv')
+
+    @staticmethod
+    def content_media_type(fpath):
+        ''' Determines file media type from the file content signature (magic bytes)
+            Returns None if the signature is either not known or not conclusive
+        '''
+        try:
+            with open(fpath, 'rb') as f:
+                header = f.read(FFH.CONTENT_SIGNATURE_SIZE)
+        except OSError:
+            return None
+
+        kind = filetype.guess(header)
+        if not kind or kind.mime in FFH.MULTIPURPOSE_CONTAINERS:
+            # leave it to the header probe / ffprobe
+            return None
+        elif kind.mime.startswith('image/'):
+            return FSMediaEntryType.IMAGE
+        elif kind.mime.startswith('audio/'):
+            return FSMediaEntryType.AUDIO
+        elif kind.mime.startswith('video/'):
+            return FSMediaEntryType.VIDEO
+        else:
+            # a known non-media signature, e.g. archives, documents, fonts
+            return FSMediaEntryType.NONMEDIA
 
     @staticmethod
     def common_media_extensions(media_type):
@@ -217,82 +344,62 @@ class FFH:
     @staticmethod
     def silence_detector(fpath, *,
                                 min_duration = FFHDefaults.DEFAULT_SILENCE_MIN_DURATION,
-                                noise_tolerance_amplitude_ratio = FFHDefaults.DEFAULT_SILENCE_NOISE_TOLERANCE):
+                                noise_tolerance_amplitude_ratio = FFHDefaults.DEFAULT_SILENCE_NOISE_TOLERANCE,
+                                max_entries = None):
         ''' Detects silence
             If successful, returns a list of SilenceEntry tuples
         '''
         if not FFH.ffmpeg_installed():
             return None
-
-        cmd = ''.join(('ffmpeg',
-                            ' -i {}'.format(shlex.quote(fpath)),
-                            ' -af silencedetect=',
-                            'n={}'.format(noise_tolerance_amplitude_ratio),
-                            ':d={}'.format(min_duration),
-                            ' -vn',
-                            ' -sn',
-                            ' -f null - '))
-
-        # print(cmd)
         try:
-            output, _ = run_cmd(cmd)
-        except CmdProcessingError as e:
+            return list(FFH.silence_entries(fpath, min_duration = min_duration,
+                                            noise_tolerance_amplitude_ratio = noise_tolerance_amplitude_ratio,
+                                            max_entries = max_entries))
+        except (CmdProcessingError, OSError) as e:
             return None
-        else:
-            silence_starts = re.findall(r'(?<=silence_start:)(?:\D*)(\d*\.?\d+)', output)
-            silence_ends = re.findall(r'(?<=silence_end:)(?:\D*)(\d*\.?\d+)', output)
-
-            SilenceEntry = namedtuple('SilenceEntry', ['silence_start', 'silence_end'])
-            silence_entries = []
-            for ss, se in zip(silence_starts, silence_ends):
-                silence_entries.append(SilenceEntry(float(ss), float(se)))
-
-            if len(silence_entries) < len(silence_starts):
-                # matched non-balanced silence at the end
-                # try to parse output audio duration and use it as the silence_end value
-                found = re.findall(r'(?<=Duration:)(?:\D*)([\d:\.]*)', output)
-                if found:
-                    duration = MiscHelpers.time_delta(found[0]).total_seconds()
-                else:
-                    duration = float(sys.maxsize)
-                silence_entries.append(SilenceEntry(float(silence_starts[-1]), duration))
-
-            return silence_entries
 
     @staticmethod
-    def volume_detector(fpath):
+    def silence_entries(fpath, *,
+                                min_duration = FFHDefaults.DEFAULT_SILENCE_MIN_DURATION,
+                                noise_tolerance_amplitude_ratio = FFHDefaults.DEFAULT_SILENCE_NOISE_TOLERANCE,
+                                max_entries = None):
+        ''' Generates SilenceEntry tuples as ffmpeg detects them
+            Stops ffmpeg once max_entries silences are detected, or when the generator is closed
+            Raises CmdProcessingError if ffmpeg fails
+        '''
+        argv = [FFToolsRegistry.shared().ffmpeg_path or 'ffmpeg', '-nostats', '-hide_banner',
+                    '-i', fpath,
+                    '-af', 'silencedetect=n={0}:d={1}'.format(noise_tolerance_amplitude_ratio, min_duration),
+                    '-vn', '-sn',
+                    '-f', 'null', '-']
+
+        if max_entries is not None and max_entries <= 0:
+            return
+        with closing(CmdLauncher.ilines(argv)) as lines:
+            for num_entries, silence_entry in enumerate(FFSilenceParser().parse(lines), 1):
+                yield silence_entry
+                if max_entries and num_entries >= max_entries:
+                    return
+
+    @staticmethod
+    def volume_detector(fpath, af_filters = None):
         ''' Detect the volume of input media file
             Returns Mean Volume and Max Volume in decibels, relative to max PCM value
+            With af_filters, the volume is detected on the filtered audio
         '''
         if not FFH.ffmpeg_installed():
             return None
 
-        cmd = ''.join(('ffmpeg',
-                            ' -i {}'.format(shlex.quote(fpath)),
-                            ' -filter:a "volumedetect"',
-                            ' -vn',
-                            ' -sn',
-                            ' -f null - '))
-        #print(cmd)
+        argv = [FFToolsRegistry.shared().ffmpeg_path, '-nostats', '-hide_banner',
+                    '-i', fpath,
+                    '-filter:a', '{}, volumedetect'.format(af_filters) if af_filters else 'volumedetect',
+                    '-vn', '-sn',
+                    '-f', 'null', '-']
         try:
-            output, _ = run_cmd(cmd)
-        except CmdProcessingError as e:
+            with closing(CmdLauncher.ilines(argv)) as lines:
+                return FFVolumeParser().volume_entry(lines)
+        except (CmdProcessingError, OSError) as e:
             return None
-        else:
-            mean_volume = max_volume = 0
-
-            # mean volume
-            found = re.findall(r'(?<=mean_volume:)(?:\D*)(\d*\.?\d+)', output)
-            if found:
-                mean_volume = float(found[0])
-
-            # max volume
-            found = re.findall(r'(?<=max_volume:)(?:\D*)(\d*\.?\d+)', output)
-            if found:
-                max_volume = float(found[0])
-
-            VolumeEntry = namedtuple('VolumeEntry', ['mean_volume', 'max_volume'])
-            return VolumeEntry(mean_volume, max_volume)
 
 
 # Quick dev test
@@ -30,6 +30,17 @@ class FFEntryParamsExt(FFEntryParams):
     target_dir_prefix = PropertyDescriptor()
     log_level = PropertyDescriptor()
     serial_exec = BooleanPropertyDescriptor()
+    streaming = BooleanPropertyDescriptor()
+    resume = BooleanPropertyDescriptor()
+    task_timeout = PropertyDescriptor()
+    stall_timeout = PropertyDescriptor()
+    coordinator = PropertyDescriptor()
+    plan_path = PropertyDescriptor()
+    manifest_path = PropertyDescriptor()
+    shard = PropertyDescriptor()
+    records_path = PropertyDescriptor()
+    concurrency_bounds = PropertyDescriptor()
+    finalize_workers = PropertyDescriptor()
     preserve_metadata = BooleanPropertyDescriptor()
 
     target_format = PropertyDescriptor() 
@@ -41,6 +52,20 @@ class FFEntryParamsExt(FFEntryParams):
         self.target_dir = args.get('target_dir')
         self.log_level = args.get('log_level', LogLevel.QUIET)
         self.serial_exec = args.get('serial_exec', False)
+        self.streaming = args.get('streaming', False)
+        self.resume = args.get('resume', False)
+
+        task_timeout = args.get('task_timeout')
+        self.task_timeout = task_timeout.total_seconds() if task_timeout else None
+        stall_timeout = args.get('stall_timeout')
+        self.stall_timeout = stall_timeout.total_seconds() if stall_timeout else FFHDefaults.DEFAULT_STALL_TIMEOUT
+        self.coordinator = args.get('coordinator')
+        self.plan_path = args.get('plan_path')
+        self.manifest_path = args.get('manifest_path')
+        self.shard = args.get('shard')
+        self.records_path = args.get('records_path')
+        self.concurrency_bounds = args.get('concurrency_bounds')
+        self.finalize_workers = args.get('finalize_workers')
 
         self.target_format = args.get('target_format') 
         self.ff_general_options = args.get('ff_general_options', 0)
@@ -0,0 +1,140 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" Streaming parsers of FFmpeg analysis filters output
+      . consume ffmpeg stderr line by line, holding on to just the current state
+      . generate results as soon as they show up in the output,
+        so consumers can act on them (or stop) before ffmpeg is done
+      . ffmpeg -progress output, for telling if a running ffmpeg still makes progress
+"""
+import sys, re
+from collections import namedtuple
+from batchmp.commons.utils import MiscHelpers
+
+
+SilenceEntry = namedtuple('SilenceEntry', ['silence_start', 'silence_end'])
+VolumeEntry = namedtuple('VolumeEntry', ['mean_volume', 'max_volume'])
+
+
+class FFSilenceParser:
+    ''' Parses silencedetect filter output
+    '''
+    SILENCE_START = re.compile(r'(?<=silence_start:)(?:\D*)(\d*\.?\d+)')
+    SILENCE_END = re.compile(r'(?<=silence_end:)(?:\D*)(\d*\.?\d+)')
+    DURATION = re.compile(r'(?<=Duration:)(?:\D*)([\d:\.]*)')
+
+    def __init__(self):
+        self.duration = None
+        self._silence_start = None
+
+    def parse(self, lines):
+        ''' Generates SilenceEntry tuples
+            A silence still going on at the end of the output lasts till the media duration
+        '''
+        for line in lines:
+            if 'silence_' in line:
+                found = self.SILENCE_START.search(line)
+                if found:
+                    self._silence_start = float(found.group(1))
+                    continue
+                found = self.SILENCE_END.search(line)
+                if found and self._silence_start is not None:
+                    silence_start, self._silence_start = self._silence_start, None
+                    yield SilenceEntry(silence_start, float(found.group(1)))
+            elif self.duration is None and 'Duration:' in line:
+                found = self.DURATION.search(line)
+                if found:
+                    try:
+                        self.duration = MiscHelpers.time_delta(found.group(1)).total_seconds()
+                    except ValueError:
+                        pass
+
+        if self._silence_start is not None:
+            # non-balanced silence at the end
+            silence_start, self._silence_start = self._silence_start, None
+            yield SilenceEntry(silence_start, self.duration if self.duration is not None else float(sys.maxsize))
+
+
+class FFVolumeParser:
+    ''' Parses volumedetect filter output
+    '''
+    MEAN_VOLUME = re.compile(r'(?<=mean_volume:)(?:\D*)(\d*\.?\d+)')
+    MAX_VOLUME = re.compile(r'(?<=max_volume:)(?:\D*)(\d*\.?\d+)')
+
+    def parse(self, lines):
+        ''' Generates (volume name, volume) events, as mean / max volumes show up
+            Volumes are in decibels, relative to max PCM value
+        '''
+        for line in lines:
+            if '_volume:' in line:
+                for name, pattern in (('mean_volume', self.MEAN_VOLUME), ('max_volume', self.MAX_VOLUME)):
+                    found = pattern.search(line)
+                    if found:
+                        yield name, float(found.group(1))
+                        break
+
+    def volume_entry(self, lines):
+        ''' VolumeEntry, as soon as both the mean and the max volume are known
+        '''
+        volumes = {}
+        for name, volume in self.parse(lines):
+            volumes[name] = volume
+            if len(volumes) == 2:
+                break
+        return VolumeEntry(volumes.get('mean_volume', 0), volumes.get('max_volume', 0))
+
+
+class FFProgressParser:
+    ''' Parses ffmpeg -progress output, i.e. periodic blocks of key=value lines
+    '''
+    def __init__(self):
+        self.out_time = 0.0
+        self.total_size = 0
+        self.done = False
+        self._line, self._moved = None, False
+
+    def is_progress(self, line):
+        ''' Consumes a progress output line, telling if the output has moved on
+            A stalled ffmpeg can still print progress blocks, just with the same output time / size
+            Asking again about the same line gives the same answer,
+            i.e. the parser can serve both a stall watchdog and progress reporting
+        '''
+        if line is not self._line:
+            self._line, self._moved = line, self._parse(line)
+        return self._moved
+
+    def _parse(self, line):
+        key, sep, value = line.partition('=')
+        if not sep:
+            return False
+        key, value = key.strip(), value.strip()
+        try:
+            if key in ('out_time_us', 'out_time_ms'):
+                # both are in microseconds
+                out_time = int(value) / 1e6
+                if out_time > self.out_time:
+                    self.out_time = out_time
+                    return True
+            elif key == 'total_size':
+                total_size = int(value)
+                if total_size > self.total_size:
+                    self.total_size = total_size
+                    return True
+            elif key == 'progress' and value == 'end':
+                self.done = True
+                return True
+        except ValueError:
+            # N/A
+            pass
+        return False
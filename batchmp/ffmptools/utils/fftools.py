@@ -0,0 +1,243 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" FFmpeg tools discovery and capabilities
+      . resolves ffmpeg / ffprobe paths once per process ($PATH changes are picked up)
+      . detects ffmpeg version, available encoders, filters, muxers and options
+      . capabilities are persisted in the user cache dir,
+        keyed by the ffmpeg binary path / size / mtime
+"""
+import os, re, json, shutil, threading
+from batchmp.fstools.fsutils import FSH
+from batchmp.commons.utils import run_cmd, CmdProcessingError
+
+
+class FFToolsRegistry:
+    ''' Process-wide registry of FFmpeg tools
+    '''
+    DEFAULT_CACHE_FNAME = 'fftools.json'
+
+    # skipping the legend lines, e.g. ' V..... = Video'
+    ENCODER_PATTERN = re.compile(r'^ ([VAS.][F.][S.][X.][B.][D.]) ([^=\s]\S*)')
+    FILTER_PATTERN = re.compile(r'^ ([T.][S.][C.]) ([^=\s]\S*)\s+\S*->\S*')
+    MUXER_PATTERN = re.compile(r'^ ([D ])E([d ]?)\s+(\S+)')
+    # e.g. '-filter_threads      number of non-complex filter threads'
+    OPTION_PATTERN = re.compile(r'^-([^\s<]+)')
+
+    CAPABILITIES = ('encoders', 'filters', 'muxers', 'options')
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_path = None):
+        self.cache_path = cache_path
+        self._lock = threading.RLock()
+        self._path_env = None
+        self._ffmpeg_path = self._ffprobe_path = None
+        self._capabilities = None
+
+    @classmethod
+    def shared(cls):
+        ''' Process-wide registry instance
+        '''
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    # Tools paths
+    @property
+    def ffmpeg_path(self):
+        self._resolve()
+        return self._ffmpeg_path
+
+    @property
+    def ffprobe_path(self):
+        self._resolve()
+        return self._ffprobe_path
+
+    @property
+    def ffmpeg_installed(self):
+        return self.ffmpeg_path is not None
+
+    # Capabilities
+    @property
+    def version(self):
+        capabilities = self._detected_capabilities()
+        return capabilities.get('version') if capabilities else None
+
+    @property
+    def encoders(self):
+        capabilities = self._detected_capabilities()
+        return frozenset(capabilities.get('encoders', ())) if capabilities else frozenset()
+
+    @property
+    def filters(self):
+        capabilities = self._detected_capabilities()
+        return frozenset(capabilities.get('filters', ())) if capabilities else frozenset()
+
+    @property
+    def muxers(self):
+        capabilities = self._detected_capabilities()
+        return frozenset(capabilities.get('muxers', ())) if capabilities else frozenset()
+
+    @property
+    def options(self):
+        capabilities = self._detected_capabilities()
+        return frozenset(capabilities.get('options', ())) if capabilities else frozenset()
+
+    def has_encoder(self, encoder):
+        ''' Checks if an encoder is available
+            When capabilities can not be detected, optimistically assumes it is
+        '''
+        return self._has_capability('encoders', encoder)
+
+    def has_filter(self, filter):
+        return self._has_capability('filters', filter)
+
+    def has_muxer(self, muxer):
+        return self._has_capability('muxers', muxer)
+
+    def has_option(self, option):
+        ''' Checks if ffmpeg supports a command-line option, e.g. 'filter_threads'
+        '''
+        return self._has_capability('options', option)
+
+    def reset(self):
+        ''' Forgets resolved paths and capabilities
+        '''
+        with self._lock:
+            self._path_env = None
+            self._ffmpeg_path = self._ffprobe_path = None
+            self._capabilities = None
+
+    # Internal helpers
+    def _has_capability(self, kind, name):
+        capabilities = self._detected_capabilities()
+        return name in capabilities.get(kind, ()) if capabilities else True
+
+    def _resolve(self):
+        path_env = os.environ.get('PATH', '')
+        if path_env == self._path_env:
+            return
+        with self._lock:
+            if path_env == self._path_env:
+                return
+            ffmpeg_path = shutil.which('ffmpeg', path = path_env)
+            ffprobe_path = None
+            if ffmpeg_path:
+                # prefer ffprobe from the same build
+                ffmpeg_path = os.path.realpath(ffmpeg_path)
+                ffprobe_path = shutil.which('ffprobe', path = os.path.dirname(ffmpeg_path))
+            if not ffprobe_path:
+                ffprobe_path = shutil.which('ffprobe', path = path_env)
+
+            if ffmpeg_path != self._ffmpeg_path:
+                self._capabilities = None
+            self._ffmpeg_path, self._ffprobe_path = ffmpeg_path, ffprobe_path
+            self._path_env = path_env
+
+    def _detected_capabilities(self):
+        ffmpeg_path = self.ffmpeg_path
+        if not ffmpeg_path:
+            return None
+        with self._lock:
+            if self._capabilities is None:
+                self._capabilities = self._load_capabilities(ffmpeg_path)
+            return self._capabilities
+
+    def _load_capabilities(self, ffmpeg_path):
+        ''' Capabilities from the persisted cache,
+            detected via running ffmpeg if not there or the binary has changed
+        '''
+        try:
+            st = os.stat(ffmpeg_path)
+        except OSError:
+            return None
+        binary_key = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+        cached = self._read_cache()
+        entry = cached.get(ffmpeg_path)
+        if entry and entry.get('binary') == binary_key \
+                    and all(kind in entry for kind in self.CAPABILITIES):
+            return entry
+
+        capabilities = self._detect(ffmpeg_path)
+        if capabilities:
+            capabilities['binary'] = binary_key
+            cached[ffmpeg_path] = capabilities
+            self._write_cache(cached)
+        return capabilities
+
+    @staticmethod
+    def _detect(ffmpeg_path):
+        def run(*options):
+            output, _ = run_cmd([ffmpeg_path, '-hide_banner'] + list(options))
+            return output.splitlines()
+
+        try:
+            version_lines = run('-version')
+            encoder_lines, filter_lines, muxer_lines = run('-encoders'), run('-filters'), run('-muxers')
+            option_lines = run('-h', 'long')
+        except (CmdProcessingError, OSError):
+            return None
+
+        version = None
+        if version_lines:
+            version_info = version_lines[0].split()
+            if len(version_info) > 2 and version_info[1] == 'version':
+                version = version_info[2]
+
+        matches = lambda pattern, lines: (match for match in (pattern.match(line) for line in lines) if match)
+        muxers = set()
+        for match in matches(FFToolsRegistry.MUXER_PATTERN, muxer_lines):
+            muxers.update(match.group(3).split(','))
+
+        return {'version': version,
+                'encoders': sorted(match.group(2) for match in matches(FFToolsRegistry.ENCODER_PATTERN, encoder_lines)),
+                'filters': sorted(match.group(2) for match in matches(FFToolsRegistry.FILTER_PATTERN, filter_lines)),
+                'muxers': sorted(muxers),
+                'options': sorted(match.group(1) for match in matches(FFToolsRegistry.OPTION_PATTERN, option_lines))}
+
+    def _cache_fpath(self):
+        if self.cache_path:
+            return self.cache_path
+        try:
+            return os.path.join(FSH.user_cache_dir(), self.DEFAULT_CACHE_FNAME)
+        except OSError:
+            return None
+
+    def _read_cache(self):
+        cache_fpath = self._cache_fpath()
+        if cache_fpath:
+            try:
+                with open(cache_fpath, 'r') as f:
+                    cached = json.load(f)
+                if isinstance(cached, dict):
+                    return cached
+            except (OSError, ValueError):
+                pass
+        return {}
+
+    def _write_cache(self, cached):
+        cache_fpath = self._cache_fpath()
+        if not cache_fpath:
+            return
+        tmp_fpath = '{0}.{1}.tmp'.format(cache_fpath, os.getpid())
+        try:
+            with open(tmp_fpath, 'w') as f:
+                json.dump(cached, f)
+            os.replace(tmp_fpath, cache_fpath)
+        except OSError:
+            pass
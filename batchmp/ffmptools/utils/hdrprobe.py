@@ -0,0 +1,566 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" Native in-process media header probe
+      . reads duration, codec, channels and sample rate
+        from a few KB of WAV / AIFF / FLAC / MP3 / OGG / MP4 headers
+      . returns ffprobe-like output, i.e. {'format': {...}, 'streams': [...]}
+      . conservative by design: for anything not recognised returns None,
+        so that the caller can fall back to ffprobe
+"""
+import os, struct
+
+
+class FFHeaderProbe:
+    ''' Native media header probe
+    '''
+    HEADER_READ_SIZE = 64 * 1024
+    TAIL_READ_SIZE = 64 * 1024
+
+    MP4_FORMAT_NAME = 'mov,mp4,m4a,3gp,3g2,mj2'
+
+    @staticmethod
+    def probe(fpath):
+        ''' Probes media file headers
+            Returns ffprobe-like output dict, or None if not recognised
+        '''
+        try:
+            fsize = os.path.getsize(fpath)
+            with open(fpath, 'rb') as f:
+                head = f.read(12)
+                parser = FFHeaderProbe._parser(head)
+                if not parser:
+                    return None
+                f.seek(0)
+                parsed = parser(f, fsize)
+        except (OSError, struct.error, ValueError, IndexError, ZeroDivisionError):
+            return None
+
+        if not parsed:
+            return None
+        format_name, duration, streams = parsed
+        if not streams or not duration or duration <= 0:
+            return None
+
+        for idx, stream in enumerate(streams):
+            stream['index'] = idx
+            if stream.get('duration') is None:
+                stream['duration'] = duration
+            stream['duration'] = '{:.6f}'.format(stream['duration'])
+            if 'sample_rate' in stream:
+                stream['sample_rate'] = str(stream['sample_rate'])
+            if 'bit_rate' in stream:
+                stream['bit_rate'] = str(int(stream['bit_rate']))
+
+        return {'format': {'filename': fpath,
+                           'format_name': format_name,
+                           'nb_streams': len(streams),
+                           'duration': '{:.6f}'.format(duration),
+                           'size': str(fsize),
+                           'bit_rate': str(int(fsize * 8 / duration))},
+                'streams': streams}
+
+    @staticmethod
+    def _parser(head):
+        if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            return FFHeaderProbe._probe_wav
+        elif head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+            return FFHeaderProbe._probe_aiff
+        elif head[:4] == b'fLaC':
+            return FFHeaderProbe._probe_flac
+        elif head[:4] == b'OggS':
+            return FFHeaderProbe._probe_ogg
+        elif head[4:8] == b'ftyp':
+            return FFHeaderProbe._probe_mp4
+        elif head[:3] == b'ID3':
+            # ID3-tagged, either FLAC or MPEG audio
+            return FFHeaderProbe._probe_id3_tagged
+        elif len(head) > 1 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0:
+            return FFHeaderProbe._probe_mp3
+        return None
+
+    ## WAV
+    @staticmethod
+    def _probe_wav(f, fsize):
+        f.seek(12)
+        fmt = data_size = None
+        while True:
+            chunk_hdr = f.read(8)
+            if len(chunk_hdr) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_hdr)
+            if chunk_id == b'fmt ':
+                chunk = f.read(chunk_size)
+                fmt = struct.unpack('<HHIIHH', chunk[:16])
+                if fmt[0] == 0xFFFE and len(chunk) >= 26:
+                    # WAVE_FORMAT_EXTENSIBLE, the actual format is in the sub-format GUID
+                    fmt = (struct.unpack('<H', chunk[24:26])[0],) + fmt[1:]
+                f.seek(chunk_size & 1, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                data_size = min(chunk_size, fsize - f.tell())
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+        if not fmt or data_size is None:
+            return None
+        audio_format, channels, sample_rate, byte_rate, _, bits_per_sample = fmt
+        if audio_format == 1:
+            codec_name = 'pcm_u8' if bits_per_sample == 8 else 'pcm_s{}le'.format(bits_per_sample)
+        elif audio_format == 3:
+            codec_name = 'pcm_f{}le'.format(bits_per_sample)
+        elif audio_format == 6:
+            codec_name = 'pcm_alaw'
+        elif audio_format == 7:
+            codec_name = 'pcm_mulaw'
+        else:
+            return None
+
+        duration = data_size / byte_rate
+        return 'wav', duration, [FFHeaderProbe._audio_stream(codec_name, sample_rate, channels,
+                                                bits_per_sample = bits_per_sample, bit_rate = byte_rate * 8)]
+
+    ## AIFF
+    @staticmethod
+    def _probe_aiff(f, fsize):
+        form_type = f.read(12)[8:12]
+        while True:
+            chunk_hdr = f.read(8)
+            if len(chunk_hdr) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('>4sI', chunk_hdr)
+            if chunk_id == b'COMM':
+                chunk = f.read(chunk_size)
+                channels, num_frames, bits_per_sample = struct.unpack('>hIh', chunk[:8])
+                sample_rate = FFHeaderProbe._ieee_extended(chunk[8:18])
+                compression = chunk[18:22] if form_type == b'AIFC' else b'NONE'
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+        if compression in (b'NONE', b'twos'):
+            codec_name = 'pcm_s{}be'.format(bits_per_sample)
+        elif compression == b'sowt':
+            codec_name = 'pcm_s{}le'.format(bits_per_sample)
+        else:
+            return None
+
+        duration = num_frames / sample_rate
+        return 'aiff', duration, [FFHeaderProbe._audio_stream(codec_name, int(sample_rate), channels,
+                                                bits_per_sample = bits_per_sample,
+                                                bit_rate = sample_rate * channels * bits_per_sample)]
+
+    @staticmethod
+    def _ieee_extended(data):
+        ''' 80-bit IEEE 754 extended precision float
+        '''
+        exponent, mantissa = struct.unpack('>HQ', data)
+        sign = -1 if exponent & 0x8000 else 1
+        exponent &= 0x7FFF
+        if exponent == 0 and mantissa == 0:
+            return 0.0
+        return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+    ## FLAC
+    @staticmethod
+    def _probe_flac(f, fsize, offset = 0):
+        f.seek(offset)
+        if f.read(4) != b'fLaC':
+            return None
+        block_hdr = f.read(4)
+        if (block_hdr[0] & 0x7F) != 0:
+            # STREAMINFO is required to be the first block
+            return None
+        stream_info = f.read(34)
+        sample_rate, channels, bits_per_sample, total_samples = FFHeaderProbe._flac_stream_info(stream_info)
+        if not sample_rate or not total_samples:
+            return None
+
+        duration = total_samples / sample_rate
+        return 'flac', duration, [FFHeaderProbe._audio_stream('flac', sample_rate, channels,
+                                                bits_per_sample = bits_per_sample,
+                                                bit_rate = (fsize - offset) * 8 / duration)]
+
+    @staticmethod
+    def _flac_stream_info(stream_info):
+        bits = int.from_bytes(stream_info[10:18], 'big')
+        sample_rate = bits >> 44
+        channels = ((bits >> 41) & 0x07) + 1
+        bits_per_sample = ((bits >> 36) & 0x1F) + 1
+        total_samples = bits & 0xFFFFFFFFF
+        return sample_rate, channels, bits_per_sample, total_samples
+
+    ## ID3-tagged
+    @staticmethod
+    def _probe_id3_tagged(f, fsize):
+        id3_hdr = f.read(10)
+        size = FFHeaderProbe._syncsafe(id3_hdr[6:10])
+        offset = 10 + size + (10 if id3_hdr[5] & 0x10 else 0)
+        f.seek(offset)
+        if f.read(4) == b'fLaC':
+            return FFHeaderProbe._probe_flac(f, fsize, offset = offset)
+        return FFHeaderProbe._probe_mp3(f, fsize, offset = offset)
+
+    @staticmethod
+    def _syncsafe(data):
+        return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+    ## MPEG audio
+    MPEG_BITRATES = {
+        (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+        (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    }
+    MPEG_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+    @staticmethod
+    def _mpeg_frame_header(data):
+        ''' Parses MPEG audio frame header,
+            returns (version, layer, bitrate, sample_rate, channels, frame_length) or None
+        '''
+        if len(data) < 4 or data[0] != 0xFF or (data[1] & 0xE0) != 0xE0:
+            return None
+        version = {0: 2.5, 2: 2, 3: 1}.get((data[1] >> 3) & 0x03)
+        layer = {1: 3, 2: 2, 3: 1}.get((data[1] >> 1) & 0x03)
+        bitrate_idx, sample_rate_idx = data[2] >> 4, (data[2] >> 2) & 0x03
+        if not version or not layer or bitrate_idx in (0, 15) or sample_rate_idx == 3:
+            return None
+
+        bitrate = FFHeaderProbe.MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_idx] * 1000
+        sample_rate = FFHeaderProbe.MPEG_SAMPLE_RATES[version][sample_rate_idx]
+        padding = (data[2] >> 1) & 0x01
+        channels = 1 if (data[3] >> 6) == 0x03 else 2
+
+        if layer == 1:
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        elif layer == 3 and version != 1:
+            frame_length = 72 * bitrate // sample_rate + padding
+        else:
+            frame_length = 144 * bitrate // sample_rate + padding
+        return version, layer, bitrate, sample_rate, channels, frame_length
+
+    @staticmethod
+    def _probe_mp3(f, fsize, offset = 0):
+        f.seek(offset)
+        data = f.read(FFHeaderProbe.HEADER_READ_SIZE)
+
+        # allow for some zero padding before the first frame
+        pos = 0
+        while pos < len(data) and data[pos] == 0:
+            pos += 1
+        header = FFHeaderProbe._mpeg_frame_header(data[pos:pos + 4])
+        if not header:
+            return None
+        version, layer, bitrate, sample_rate, channels, frame_length = header
+
+        # make sure it's not a random sync pattern, by checking the next frame
+        next_pos = pos + frame_length
+        if next_pos + 4 <= len(data) and not FFHeaderProbe._mpeg_frame_header(data[next_pos:next_pos + 4]):
+            return None
+
+        audio_start = offset + pos
+        samples_per_frame = 384 if layer == 1 else (576 if (layer == 3 and version != 1) else 1152)
+
+        # VBR headers
+        num_frames = None
+        if layer == 3:
+            if version == 1:
+                side_info_len = 17 if channels == 1 else 32
+            else:
+                side_info_len = 9 if channels == 1 else 17
+            xing_pos = pos + 4 + side_info_len
+            if data[xing_pos:xing_pos + 4] in (b'Xing', b'Info'):
+                flags = struct.unpack('>I', data[xing_pos + 4:xing_pos + 8])[0]
+                if flags & 0x01:
+                    num_frames = struct.unpack('>I', data[xing_pos + 8:xing_pos + 12])[0]
+            elif data[pos + 36:pos + 40] == b'VBRI':
+                num_frames = struct.unpack('>I', data[pos + 50:pos + 54])[0]
+
+        audio_size = fsize - audio_start
+        if num_frames:
+            duration = num_frames * samples_per_frame / sample_rate
+            bitrate = audio_size * 8 / duration
+        else:
+            f.seek(max(fsize - 128, 0))
+            if f.read(3) == b'TAG':
+                audio_size -= 128
+            duration = audio_size * 8 / bitrate
+
+        codec_name = {1: 'mp1', 2: 'mp2', 3: 'mp3'}[layer]
+        return 'mp3', duration, [FFHeaderProbe._audio_stream(codec_name, sample_rate, channels,
+                                                                                bit_rate = bitrate)]
+
+    ## OGG
+    @staticmethod
+    def _ogg_page(data, pos):
+        ''' Parses an OGG page at pos,
+            returns (header_type, granule, serial, first packet, next page pos)
+        '''
+        if data[pos:pos + 4] != b'OggS':
+            return None
+        header_type, granule, serial = struct.unpack('<BqI', data[pos + 5:pos + 18])
+        num_segments = data[pos + 26]
+        segments = data[pos + 27:pos + 27 + num_segments]
+        body_pos = pos + 27 + num_segments
+        packet_len = 0
+        for segment_len in segments:
+            packet_len += segment_len
+            if segment_len < 255:
+                break
+        packet = data[body_pos:body_pos + packet_len]
+        return header_type, granule, serial, packet, body_pos + sum(segments)
+
+    @staticmethod
+    def _probe_ogg(f, fsize):
+        data = f.read(FFHeaderProbe.HEADER_READ_SIZE)
+
+        # beginning-of-stream pages, one per logical stream
+        logical_streams = []
+        pos = 0
+        while True:
+            page = FFHeaderProbe._ogg_page(data, pos)
+            if not page or not (page[0] & 0x02):
+                break
+            _, _, serial, packet, pos = page
+            if packet.startswith(b'\x01vorbis'):
+                channels, sample_rate, _, nominal_bitrate = struct.unpack('<BIiI', packet[11:24])
+                stream = FFHeaderProbe._audio_stream('vorbis', sample_rate, channels, bit_rate = nominal_bitrate)
+                granule_rate, pre_skip = sample_rate, 0
+            elif packet.startswith(b'OpusHead'):
+                channels, pre_skip = struct.unpack('<BH', packet[9:12])
+                stream = FFHeaderProbe._audio_stream('opus', 48000, channels)
+                granule_rate = 48000
+            elif packet.startswith(b'\x7fFLAC') and packet[9:13] == b'fLaC':
+                sample_rate, channels, bits_per_sample, _ = FFHeaderProbe._flac_stream_info(packet[17:51])
+                stream = FFHeaderProbe._audio_stream('flac', sample_rate, channels, bits_per_sample = bits_per_sample)
+                granule_rate, pre_skip = sample_rate, 0
+            elif packet.startswith(b'\x80theora'):
+                stream = {'codec_type': 'video', 'codec_name': 'theora'}
+                granule_rate = pre_skip = None
+            else:
+                # not something to deal with here
+                return None
+            logical_streams.append((serial, stream, granule_rate, pre_skip))
+
+        if not logical_streams:
+            return None
+
+        # durations from the last pages granule positions
+        f.seek(max(fsize - FFHeaderProbe.TAIL_READ_SIZE, 0))
+        tail = f.read(FFHeaderProbe.TAIL_READ_SIZE)
+        last_granules = {}
+        pos = tail.find(b'OggS')
+        while pos >= 0:
+            page = FFHeaderProbe._ogg_page(tail, pos)
+            if page and page[1] >= 0:
+                last_granules[page[2]] = page[1]
+            pos = tail.find(b'OggS', pos + 4)
+
+        duration = 0.0
+        streams = []
+        for serial, stream, granule_rate, pre_skip in logical_streams:
+            if granule_rate and serial in last_granules:
+                stream['duration'] = max(last_granules[serial] - pre_skip, 0) / granule_rate
+                duration = max(duration, stream['duration'])
+            streams.append(stream)
+        if not duration:
+            return None
+
+        return 'ogg', duration, streams
+
+    ## MP4
+    MP4_CODECS = {
+        b'mp4a': ('audio', 'aac'), b'alac': ('audio', 'alac'), b'ac-3': ('audio', 'ac3'),
+        b'ec-3': ('audio', 'eac3'), b'.mp3': ('audio', 'mp3'), b'fLaC': ('audio', 'flac'),
+        b'Opus': ('audio', 'opus'), b'lpcm': ('audio', 'pcm_s16le'),
+        b'avc1': ('video', 'h264'), b'avc3': ('video', 'h264'), b'hvc1': ('video', 'hevc'),
+        b'hev1': ('video', 'hevc'), b'mp4v': ('video', 'mpeg4'), b'av01': ('video', 'av1'),
+        b'vp09': ('video', 'vp9'), b's263': ('video', 'h263'), b'apcn': ('video', 'prores'),
+        b'apch': ('video', 'prores'), b'apcs': ('video', 'prores'), b'apco': ('video', 'prores'),
+        b'ap4h': ('video', 'prores'),
+    }
+    MP4_HANDLER_TYPES = {b'soun': 'audio', b'vide': 'video'}
+
+    @staticmethod
+    def _mp4_boxes(f, start, end):
+        ''' Generates (box type, body start, box end) for boxes in [start, end)
+        '''
+        pos = start
+        while pos + 8 <= end:
+            f.seek(pos)
+            size, box_type = struct.unpack('>I4s', f.read(8))
+            header_len = 8
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                header_len = 16
+            elif size == 0:
+                size = end - pos
+            if size < header_len:
+                return
+            yield box_type, pos + header_len, pos + size
+            pos += size
+
+    @staticmethod
+    def _mp4_child(f, start, end, box_type):
+        for child_type, child_start, child_end in FFHeaderProbe._mp4_boxes(f, start, end):
+            if child_type == box_type:
+                return child_start, child_end
+        return None
+
+    @staticmethod
+    def _mp4_duration(f, start):
+        ''' timescale-based duration from a mvhd / mdhd box
+        '''
+        f.seek(start)
+        version = f.read(4)[0]
+        if version == 1:
+            _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+        else:
+            _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+        return duration / timescale if timescale else 0.0
+
+    @staticmethod
+    def _probe_mp4(f, fsize):
+        moov = FFHeaderProbe._mp4_child(f, 0, fsize, b'moov')
+        if not moov:
+            return None
+
+        duration = 0.0
+        streams = []
+        for box_type, start, end in FFHeaderProbe._mp4_boxes(f, *moov):
+            if box_type == b'mvhd':
+                duration = FFHeaderProbe._mp4_duration(f, start)
+            elif box_type == b'trak':
+                stream = FFHeaderProbe._mp4_track_stream(f, start, end)
+                if stream is False:
+                    # a media track this probe can't deal with
+                    return None
+                elif stream:
+                    streams.append(stream)
+
+        if not duration and streams:
+            duration = max(stream.get('duration') or 0.0 for stream in streams)
+        return FFHeaderProbe.MP4_FORMAT_NAME, duration, streams
+
+    @staticmethod
+    def _mp4_track_stream(f, start, end):
+        ''' Parses audio / video track
+            returns None for non-media tracks, False for unknown codecs
+        '''
+        mdia = FFHeaderProbe._mp4_child(f, start, end, b'mdia')
+        if not mdia:
+            return None
+        hdlr = FFHeaderProbe._mp4_child(f, *mdia, b'hdlr')
+        if not hdlr:
+            return None
+        f.seek(hdlr[0] + 8)
+        codec_type = FFHeaderProbe.MP4_HANDLER_TYPES.get(f.read(4))
+        if not codec_type:
+            return None
+
+        mdhd = FFHeaderProbe._mp4_child(f, *mdia, b'mdhd')
+        track_duration = FFHeaderProbe._mp4_duration(f, mdhd[0]) if mdhd else None
+
+        stsd = None
+        minf = FFHeaderProbe._mp4_child(f, *mdia, b'minf')
+        stbl = FFHeaderProbe._mp4_child(f, *minf, b'stbl') if minf else None
+        stsd = FFHeaderProbe._mp4_child(f, *stbl, b'stsd') if stbl else None
+        if not stsd:
+            return False
+
+        # the first sample entry
+        f.seek(stsd[0] + 8)
+        entry_size, fourcc = struct.unpack('>I4s', f.read(8))
+        entry_start, entry_end = stsd[0] + 8, stsd[0] + 8 + entry_size
+        codec = FFHeaderProbe.MP4_CODECS.get(fourcc)
+        if not codec or codec[0] != codec_type:
+            return False
+
+        if codec_type == 'video':
+            return {'codec_type': 'video', 'codec_name': codec[1], 'duration': track_duration}
+
+        f.seek(entry_start + 24)
+        channels, bits_per_sample, _, _, sample_rate = struct.unpack('>HHHHI', f.read(12))
+        sample_rate >>= 16
+        codec_name = codec[1]
+        children_start = entry_start + 36
+        if fourcc == b'alac':
+            alac = FFHeaderProbe._mp4_child(f, children_start, entry_end, b'alac')
+            if alac:
+                f.seek(alac[0] + 4 + 5)
+                bits_per_sample = f.read(1)[0]
+                f.seek(alac[0] + 4 + 13)
+                channels = f.read(1)[0]
+                f.seek(alac[0] + 4 + 20)
+                sample_rate = struct.unpack('>I', f.read(4))[0]
+        elif fourcc == b'mp4a':
+            esds = FFHeaderProbe._mp4_child(f, children_start, entry_end, b'esds')
+            if esds:
+                object_type = FFHeaderProbe._mp4_esds_object_type(f, *esds)
+                if object_type in (0x69, 0x6B):
+                    codec_name = 'mp3'
+                elif object_type is not None and object_type not in (0x40, 0x66, 0x67, 0x68):
+                    return False
+            bits_per_sample = 0
+
+        stream = FFHeaderProbe._audio_stream(codec_name, sample_rate, channels, bits_per_sample = bits_per_sample)
+        stream['duration'] = track_duration
+        return stream
+
+    @staticmethod
+    def _mp4_esds_object_type(f, start, end):
+        ''' objectTypeIndication from the decoder config descriptor
+        '''
+        f.seek(start + 4)
+        data = f.read(min(end - start - 4, 64))
+
+        def descriptor(pos):
+            tag, length = data[pos], 0
+            pos += 1
+            for _ in range(4):
+                byte = data[pos]
+                pos += 1
+                length = (length << 7) | (byte & 0x7F)
+                if not byte & 0x80:
+                    break
+            return tag, pos
+
+        tag, pos = descriptor(0)
+        if tag != 0x03:
+            return None
+        es_flags = data[pos + 2]
+        pos += 3
+        if es_flags & 0x80:
+            pos += 2
+        if es_flags & 0x40:
+            pos += 1 + data[pos]
+        if es_flags & 0x20:
+            pos += 2
+        tag, pos = descriptor(pos)
+        return data[pos] if tag == 0x04 else None
+
+    ## Helpers
+    @staticmethod
+    def _audio_stream(codec_name, sample_rate, channels, bits_per_sample = 0, bit_rate = None):
+        stream = {'codec_type': 'audio',
+                  'codec_name': codec_name,
+                  'sample_rate': sample_rate,
+                  'channels': channels,
+                  'bits_per_sample': bits_per_sample}
+        if bit_rate:
+            stream['bit_rate'] = bit_rate
+        return stream
@@ -0,0 +1,195 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" Persistent on-disk cache of ffprobe results
+      . entries hold serialized compact probe records
+      . entries are keyed by file identity (realpath, size, mtime_ns, inode),
+        so any change to a file automatically invalidates its cached probe
+      . entries record their probe profile, so a fuller probe also answers
+        narrower lookups and is never replaced by a narrower one
+      . least recently used entries are evicted above the max entries limit
+      . safe to share between threads and pool worker processes
+"""
+import os, time, sqlite3, threading
+from collections import namedtuple
+from batchmp.fstools.fsutils import FSH
+from batchmp.ffmptools.utils.probeprofiles import FFProbeProfile
+
+
+FileIdentity = namedtuple('FileIdentity', ['realpath', 'size', 'mtime_ns', 'inode'])
+
+
+class FFProbeCache:
+    ''' SQLite-backed ffprobe results cache
+    '''
+    DEFAULT_CACHE_FNAME = 'ffprobe_cache.sqlite'
+    DEFAULT_MAX_ENTRIES = 500000
+
+    # number of inserts between LRU eviction checks
+    EVICTION_CHECK_INTERVAL = 1000
+    # min interval (secs) between refreshing an entry access time
+    ACCESS_REFRESH_INTERVAL = 3600
+
+    SCHEMA_VERSION = 3
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_path = None, max_entries = DEFAULT_MAX_ENTRIES):
+        if not db_path:
+            db_path = os.path.join(FSH.user_cache_dir(), self.DEFAULT_CACHE_FNAME)
+        self.db_path = db_path
+        self.max_entries = max_entries
+
+        self._local = threading.local()
+        self._num_inserts = 0
+        self._disabled = False
+
+    @classmethod
+    def shared(cls):
+        ''' Process-wide cache instance,
+            None if disabled via the BATCHMP_NO_PROBE_CACHE environment variable
+        '''
+        if os.environ.get('BATCHMP_NO_PROBE_CACHE'):
+            return None
+        with cls._shared_lock:
+            if cls._shared is None:
+                try:
+                    cls._shared = cls()
+                except OSError:
+                    return None
+            return cls._shared
+
+    @staticmethod
+    def file_identity(fpath):
+        ''' Identity of a file, as used for the cache keys
+        '''
+        try:
+            realpath = os.path.realpath(fpath)
+            st = os.stat(realpath)
+        except OSError:
+            return None
+        return FileIdentity(realpath, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def get(self, fpath, identity = None, profile = FFProbeProfile.FULL):
+        ''' Returns cached probe data for a file,
+            or None if the file is not in the cache, has changed since
+            or was only probed with a narrower profile
+        '''
+        identity = identity or self.file_identity(fpath)
+        if not identity:
+            return None
+
+        def _get(db):
+            row = db.execute('SELECT size, mtime_ns, inode, profile, data, accessed FROM probes WHERE path = ?',
+                                                                        (identity.realpath,)).fetchone()
+            if not row:
+                return None
+            size, mtime_ns, inode, probed_profile, data, accessed = row
+            if (size, mtime_ns, inode) != (identity.size, identity.mtime_ns, identity.inode):
+                # stale entry
+                with db:
+                    db.execute('DELETE FROM probes WHERE path = ?', (identity.realpath,))
+                return None
+            if probed_profile < profile:
+                return None
+
+            now = time.time()
+            if now - accessed > self.ACCESS_REFRESH_INTERVAL:
+                with db:
+                    db.execute('UPDATE probes SET accessed = ? WHERE path = ?', (now, identity.realpath))
+            return data
+
+        return self._execute(_get)
+
+    def put(self, fpath, data, identity = None, profile = FFProbeProfile.FULL):
+        ''' Stores probe data for a file,
+            unless there already is a fuller probe of the same file
+        '''
+        identity = identity or self.file_identity(fpath)
+        if not identity:
+            return
+
+        def _put(db):
+            with db:
+                row = db.execute('SELECT size, mtime_ns, inode, profile FROM probes WHERE path = ?',
+                                                                        (identity.realpath,)).fetchone()
+                if row and row[:3] == (identity.size, identity.mtime_ns, identity.inode) and row[3] > profile:
+                    return
+                db.execute('INSERT OR REPLACE INTO probes (path, size, mtime_ns, inode, profile, data, accessed) '
+                                                                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (identity.realpath, identity.size, identity.mtime_ns, identity.inode,
+                                                                        int(profile), data, time.time()))
+            self._num_inserts += 1
+            if self._num_inserts % self.EVICTION_CHECK_INTERVAL == 0:
+                self._evict(db)
+
+        self._execute(_put)
+
+    def evict(self):
+        ''' Evicts least recently used entries above the max entries limit
+        '''
+        self._execute(self._evict)
+
+    def clear(self):
+        ''' Removes all cached entries
+        '''
+        def _clear(db):
+            with db:
+                db.execute('DELETE FROM probes')
+        self._execute(_clear)
+
+    def __len__(self):
+        count = self._execute(lambda db: db.execute('SELECT COUNT(*) FROM probes').fetchone()[0])
+        return count or 0
+
+    # Internal helpers
+    def _evict(self, db):
+        with db:
+            db.execute('DELETE FROM probes WHERE path IN '
+                            '(SELECT path FROM probes ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                                                                                    (self.max_entries,))
+
+    def _execute(self, db_op):
+        ''' Runs a db operation, disabling the cache on db errors
+            so that probing just falls back to running ffprobe
+        '''
+        if self._disabled:
+            return None
+        try:
+            return db_op(self._connection())
+        except sqlite3.Error:
+            self._disabled = True
+            return None
+
+    def _connection(self):
+        ''' Per-thread / per-process db connection
+        '''
+        pid = os.getpid()
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != pid:
+            db = sqlite3.connect(self.db_path, timeout = 30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            schema_version = db.execute('PRAGMA user_version').fetchone()[0]
+            if schema_version != self.SCHEMA_VERSION:
+                with db:
+                    db.execute('DROP TABLE IF EXISTS probes')
+                    db.execute('PRAGMA user_version = {}'.format(self.SCHEMA_VERSION))
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, '
+                                'size INTEGER, mtime_ns INTEGER, inode INTEGER, profile INTEGER, data TEXT, accessed REAL)')
+                db.execute('CREATE INDEX IF NOT EXISTS probes_accessed ON probes (accessed)')
+            self._local.db, self._local.pid = db, pid
+        return db
@@ -0,0 +1,48 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" Use-case specific ffprobe query profiles
+      . each profile asks ffprobe only for the entries its use case needs
+      . profiles are ordered, i.e. a fuller profile result satisfies any narrower profile:
+            ARTWORK < TYPE < DURATION < FULL
+"""
+from enum import IntEnum
+
+
+class FFProbeProfile(IntEnum):
+    ARTWORK     =  0x10000      # video streams indices / codecs, e.g. to exclude artwork streams
+    TYPE        =  0x10001      # all streams types / codecs, e.g. to determine media type
+    DURATION    =  0x10002      # streams types / codecs, plus format / streams durations
+    FULL        =  0x10003      # everything, including tags
+
+    @property
+    def ffprobe_args(self):
+        ''' ffprobe arguments selecting the profile entries
+        '''
+        return FFProbeProfile._PROFILE_ARGS[self]
+
+    def satisfies(self, profile):
+        ''' Checks if a result probed with this profile also answers the (narrower) profile
+        '''
+        return self >= profile
+
+
+FFProbeProfile._PROFILE_ARGS = {
+    FFProbeProfile.ARTWORK:     ('-select_streams', 'v',
+                                 '-show_entries', 'stream=index,codec_type,codec_name:format=format_name'),
+    FFProbeProfile.TYPE:        ('-show_entries', 'stream=index,codec_type,codec_name:format=format_name'),
+    FFProbeProfile.DURATION:    ('-show_entries', 'stream=index,codec_type,codec_name,duration'
+                                                                ':format=format_name,duration'),
+    FFProbeProfile.FULL:        ('-show_streams', '-show_format'),
+}
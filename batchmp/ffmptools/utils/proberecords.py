@@ -0,0 +1,162 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" Compact media probe records
+      . keep only the ffprobe fields actually used across the project,
+        with numeric values stored as numbers and common strings interned
+      . dict-like read access, i.e. record.get('duration', 0.0)
+      . cheap pickling (for IPC) and JSON serialization (for the probe cache)
+"""
+import sys, json
+
+
+class FFProbeRecord:
+    ''' Base slotted probe record
+    '''
+    __slots__ = ()
+
+    # field name -> value converter
+    CONVERTERS = {}
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+        for field in self.__slots__[len(values):]:
+            setattr(self, field, None)
+
+    @classmethod
+    def from_probe(cls, probe_dict):
+        ''' Builds a record from ffprobe JSON output (stream / format dict)
+        '''
+        if probe_dict is None:
+            return None
+        return cls.from_values(probe_dict.get(field) for field in cls.__slots__)
+
+    @classmethod
+    def from_values(cls, values):
+        ''' Builds a record from raw field values, in the slots order
+        '''
+        converted = []
+        for field, value in zip(cls.__slots__, values):
+            if value is not None:
+                try:
+                    value = cls.CONVERTERS.get(field, FFProbeRecord._as_is)(value)
+                except (TypeError, ValueError):
+                    # e.g. 'N/A' durations
+                    value = None
+            converted.append(value)
+        return cls(*converted)
+
+    # dict-like read access
+    def get(self, field, default = None):
+        value = getattr(self, field, None) if field in self.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self.get(field) is not None
+
+    # serialization
+    def values(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __reduce__(self):
+        return (self.__class__, self.values())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __repr__(self):
+        fields = ('{0}={1!r}'.format(field, getattr(self, field))
+                                        for field in self.__slots__ if getattr(self, field) is not None)
+        return '{0}({1})'.format(self.__class__.__name__, ', '.join(fields))
+
+    # Converters
+    @staticmethod
+    def _as_is(value):
+        return value
+
+    @staticmethod
+    def _interned(value):
+        return sys.intern(str(value))
+
+    @staticmethod
+    def _int(value):
+        return int(value)
+
+    @staticmethod
+    def _float(value):
+        return float(value)
+
+    @staticmethod
+    def _tags(value):
+        return {sys.intern(k): v for k, v in value.items()} if value else None
+
+
+class FFStreamRecord(FFProbeRecord):
+    ''' Media stream probe record
+    '''
+    __slots__ = ('index', 'codec_type', 'codec_name', 'duration',
+                            'bit_rate', 'sample_rate', 'channels', 'bits_per_sample', 'tags')
+
+    CONVERTERS = {'index': FFProbeRecord._int,
+                  'codec_type': FFProbeRecord._interned,
+                  'codec_name': FFProbeRecord._interned,
+                  'duration': FFProbeRecord._float,
+                  'bit_rate': FFProbeRecord._int,
+                  'sample_rate': FFProbeRecord._int,
+                  'channels': FFProbeRecord._int,
+                  'bits_per_sample': FFProbeRecord._int,
+                  'tags': FFProbeRecord._tags}
+
+
+class FFFormatRecord(FFProbeRecord):
+    ''' Media container format probe record
+    '''
+    __slots__ = ('format_name', 'format_long_name', 'duration', 'bit_rate', 'tags')
+
+    CONVERTERS = {'format_name': FFProbeRecord._interned,
+                  'format_long_name': FFProbeRecord._interned,
+                  'duration': FFProbeRecord._float,
+                  'bit_rate': FFProbeRecord._int,
+                  'tags': FFProbeRecord._tags}
+
+
+class FFProbeRecords:
+    ''' Probe records serialization helpers
+    '''
+    @staticmethod
+    def from_probe(probe_output):
+        ''' (format record, stream records) from parsed ffprobe-like output
+        '''
+        format = FFFormatRecord.from_probe(probe_output.get('format'))
+        streams = tuple(FFStreamRecord.from_probe(stream) for stream in probe_output.get('streams') or ())
+        return format, streams
+
+    @staticmethod
+    def dumps(format, streams):
+        return json.dumps([format.values() if format else None,
+                                [stream.values() for stream in streams]], separators = (',', ':'))
+
+    @staticmethod
+    def loads(data):
+        format_values, streams_values = json.loads(data)
+        format = FFFormatRecord.from_values(format_values) if format_values else None
+        streams = tuple(FFStreamRecord.from_values(values) for values in streams_values)
+        return format, streams
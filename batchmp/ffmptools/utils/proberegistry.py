@@ -0,0 +1,155 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+""" Run-scoped memoization of media probes
+      . shared by the walker filters, tasks planning, tag handlers, etc.
+      . probe results are shipped along with the tasks to pool workers,
+        so that each file is probed at most once per run
+      . memoized results record their probe profile,
+        so a fuller probe also answers narrower lookups
+      . streamed runs keep a bounded number of (the most recently used) entries,
+        i.e. well past the tasks in flight that still need them
+      . a run probes at the strongest profile it needs, e.g. already when walking the source files,
+        so that its later (narrower or fuller) lookups are answered without probing again
+"""
+import threading
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from batchmp.ffmptools.utils.probecache import FFProbeCache
+from batchmp.ffmptools.utils.probeprofiles import FFProbeProfile
+
+
+ProfiledEntry = namedtuple('ProfiledEntry', ['profile', 'entry'])
+
+
+class FFProbeRegistry:
+    ''' Run-scoped registry of media probe results
+    '''
+    _active = None
+
+    # entries kept in streamed runs
+    STREAMING_MAX_ENTRIES = 4096
+
+    def __init__(self, run_profile = None, max_entries = None):
+        # the strongest profile of the run lookups, if known
+        self.run_profile = run_profile
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def active(cls):
+        ''' The currently active registry, if any
+        '''
+        return cls._active
+
+    @classmethod
+    def current(cls):
+        ''' The currently active registry,
+            activates a new one if needed (e.g. in a pool worker process)
+        '''
+        if cls._active is None:
+            cls().activate()
+        return cls._active
+
+    @classmethod
+    @contextmanager
+    def run_scope(cls, run_profile = None, max_entries = None):
+        ''' Activates a new registry for the duration of a run
+        '''
+        registry = cls(run_profile, max_entries)
+        registry.activate()
+        try:
+            yield registry
+        finally:
+            registry.deactivate()
+
+    def activate(self):
+        FFProbeRegistry._active = self
+
+    def deactivate(self):
+        if FFProbeRegistry._active is self:
+            FFProbeRegistry._active = None
+
+    def probe_profile(self, profile):
+        ''' Profile to probe at for a lookup, i.e. the run profile if fuller
+        '''
+        if self.run_profile is not None and self.run_profile.satisfies(profile):
+            return self.run_profile
+        return profile
+
+    def lookup(self, fpath, probe, profile = FFProbeProfile.FULL, probe_profile = None):
+        ''' Returns memoized probe result for fpath,
+            running the probe function unless there already is a result
+            that satisfies the probe profile
+            probe_profile is what the probe function actually probes at, if fuller than the profile
+        '''
+        identity = FFProbeCache.file_identity(fpath)
+        if not identity:
+            return probe(fpath)
+
+        with self._lock:
+            profiled_entry = self._entries.get(identity)
+            if profiled_entry and profiled_entry.profile.satisfies(profile):
+                self.hits += 1
+                self._entries.move_to_end(identity)
+                return profiled_entry.entry
+
+        entry = probe(fpath)
+        self._register(identity, entry, probe_profile if probe_profile is not None else profile, miss = True)
+        return entry
+
+    def entry(self, fpath, profile = FFProbeProfile.FULL):
+        ''' Memoized probe result for fpath that satisfies the probe profile, without probing
+        '''
+        profiled_entry = self.profiled_entry(fpath)
+        if profiled_entry and profiled_entry.profile.satisfies(profile):
+            return profiled_entry.entry
+        return None
+
+    def profiled_entry(self, fpath):
+        ''' Memoized (profile, probe result) for fpath, without probing
+        '''
+        identity = FFProbeCache.file_identity(fpath)
+        with self._lock:
+            return self._entries.get(identity) if identity else None
+
+    def register(self, fpath, entry, profile = FFProbeProfile.FULL):
+        ''' Registers a known probe result, e.g. shipped along with a task
+        '''
+        identity = FFProbeCache.file_identity(fpath)
+        if identity:
+            self._register(identity, entry, profile)
+
+    def _register(self, identity, entry, profile, miss = False):
+        with self._lock:
+            if miss:
+                self.misses += 1
+            profiled_entry = self._entries.get(identity)
+            if not profiled_entry or profile.satisfies(profiled_entry.profile):
+                self._entries[identity] = ProfiledEntry(FFProbeProfile(profile), entry)
+            self._entries.move_to_end(identity)
+            if self.max_entries:
+                # least recently used first
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last = False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats_msg(self):
+        return 'Media probes cache: {0} hits, {1} misses'.format(self.hits, self.misses)
@@ -205,7 +205,7 @@ class FSEntryBuilderOrganizeWorker(FSEntryBuilder):
                             indent=fs_entry_params.siblings_indent)
 
             if fs_entry_params.by == 'type':
-                media_type = FFH.media_type(fpath=fpath, fast_scan=fs_entry_params.fast_scan)
+                media_type = FFH.media_type(fpath=fpath, scan_level=fs_entry_params.media_scan)
                 subdir = str(media_type.name).lower()
                 target_dir = os.path.join(base_target_dir, subdir)
             elif fs_entry_params.by == 'date':
@@ -49,12 +49,19 @@ class FSMediaEntryGroupType(IntEnum):
     ANY         =  0x00103
 
 
+class FSMediaScanLevel(IntEnum):
+    EXTENSION   =  0x01000
+    CONTENT     =  0x01001
+    FULL        =  0x01002
+
+
 class FSEntryDefaults:    
     DEFAULT_NESTED_INDENT = '  '
     DEFAULT_INCLUDE = '*'
     DEFAULT_EXCLUDE = '.*' #exclude hidden files
     DEFAULT_SORT = 'na'
     DEFAULT_FILE_TYPE = 'any'
+    DEFAULT_MEDIA_SCAN = 'extension'
     DEFAULT_MEDIA_TYPE = 'playable'
 
 
@@ -17,7 +17,8 @@ from enum import IntEnum
 from abc import ABCMeta, abstractmethod
 from batchmp.fstools.fsutils import FSH
 from batchmp.ffmptools.ffutils import FFH
-from batchmp.fstools.builders.fsentry import FSEntryDefaults, FSMediaEntryType, FSMediaEntryGroupType
+from batchmp.commons.bulkprober import BulkProber
+from batchmp.fstools.builders.fsentry import FSEntryDefaults, FSMediaEntryType, FSMediaEntryGroupType, FSMediaScanLevel
 from batchmp.commons.descriptors import (
          PropertyDescriptor,
          LazyFunctionPropertyDescriptor,
@@ -47,7 +48,7 @@ class FSEntryFilteredFilesValueDescriptor(FSEntryRuntimeAttributeDescriptor):
 
             # file types
             if instance.file_type != FSMediaEntryGroupType.ANY:
-                fnames = [fname for fname in fnames if instance.is_of_required_type(os.path.join(instance.rpath, fname))]
+                fnames = instance.of_required_type(fnames)
 
             # sorting
             if instance.by_size:
@@ -122,6 +123,27 @@ class FSEntryFileTypeDescriptor(PropertyDescriptor):
             raise TypeError("Not a FSEntryParamsBase Type: {}".format(instance.__class__))
 
 
+class FSEntryMediaScanDescriptor(PropertyDescriptor):
+    ''' Media scan level property descriptor
+        For backward compatibility, boolean values map to the full / extension levels
+    '''
+    def __set__(self, instance, value):
+        if isinstance(instance, FSEntryParamsBase):
+            media_scan_map =  {
+              'extension': FSMediaScanLevel.EXTENSION,
+              'content': FSMediaScanLevel.CONTENT,
+              'full': FSMediaScanLevel.FULL
+            }
+            if isinstance(value, FSMediaScanLevel):
+                media_scan = value
+            elif isinstance(value, bool) or value is None:
+                media_scan = FSMediaScanLevel.FULL if value else FSMediaScanLevel.EXTENSION
+            else:
+                media_scan = media_scan_map.get(value, FSMediaScanLevel.EXTENSION)
+            super().__set__(instance, media_scan)
+        else:
+            raise TypeError("Not a FSEntryParamsBase Type: {}".format(instance.__class__))
+
 
 class FSEntryParamsBase():
     ''' Base Entry attributes
@@ -140,7 +162,7 @@ class FSEntryParamsBase():
     nested_indent = PropertyDescriptor()
     sort = PropertyDescriptor()
     file_type = FSEntryFileTypeDescriptor()
-    media_scan = BooleanPropertyDescriptor()
+    media_scan = FSEntryMediaScanDescriptor()
 
     fs_entry_builder = LazyClassPropertyDescriptor('batchmp.fstools.builders.fsb.FSEntryBuilderBase')
     '''Runtime attrbutes
@@ -161,7 +183,7 @@ class FSEntryParamsBase():
         self.filter_dirs = not args.get('all_dirs', False)
         self.filter_files = not args.get('all_files', False)   
         self.show_size = args.get('show_size', False)
-        self.fast_scan = not args.get('media_scan', False)
+        self.media_scan = args.get('media_scan', FSEntryDefaults.DEFAULT_MEDIA_SCAN)
 
         #self._media_extensions_cache = set()
 
@@ -192,6 +214,11 @@ class FSEntryParamsBase():
     def current_level(self):
         return FSH.level_from_root(self.src_dir, self.rpath)        
 
+    # Media scan
+    @property
+    def fast_scan(self):
+        return self.media_scan == FSMediaScanLevel.EXTENSION
+
     # Sorting
     @property
     def descending(self):
@@ -232,9 +259,19 @@ class FSEntryParamsBase():
 
 
     def is_of_required_type(self, fpath):
-        media_type = FFH.media_type(fpath = fpath, fast_scan = self.fast_scan)
+        media_type = FFH.media_type(fpath = fpath, scan_level = self.media_scan)
         return self.is_of_entry_type(media_type)
 
+    def of_required_type(self, fnames):
+        ''' filters file names in the current dir by required type
+            media scans are bulk-probed, ahead of the filtering
+        '''
+        fpath = lambda fname: os.path.join(self.rpath, fname)
+        if self.fast_scan:
+            return [fname for fname in fnames if self.is_of_required_type(fpath(fname))]
+        else:
+            return list(BulkProber(self.is_of_required_type).filter(fnames, key = fpath))
+
     @property
     def scan_for_enclosing_directories(self):
         return self. filter_dirs and (self.file_type != FSMediaEntryGroupType.ANY or self.include != FSEntryDefaults.DEFAULT_INCLUDE) and self.end_level > 0    
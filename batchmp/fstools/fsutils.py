@@ -54,6 +54,25 @@ class FSH:
 
         return path if path else None
 
+    @staticmethod
+    def user_cache_dir(app_name = 'batchmp'):
+        ''' Platform-specific user cache directory,
+            can be overridden via the BATCHMP_CACHE_DIR environment variable
+        '''
+        cache_dir = os.environ.get('BATCHMP_CACHE_DIR')
+        if not cache_dir:
+            if sys.platform == 'win32':
+                base_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+                cache_dir = os.path.join(base_dir, app_name, 'Cache')
+            elif sys.platform == 'darwin':
+                cache_dir = os.path.join(os.path.expanduser('~'), 'Library', 'Caches', app_name)
+            else:
+                base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+                cache_dir = os.path.join(base_dir, app_name)
+        cache_dir = FSH.full_path(cache_dir)
+        os.makedirs(cache_dir, exist_ok = True)
+        return cache_dir
+
     @staticmethod
     def path_components(path):
         path = FSH.full_path(path)
@@ -16,6 +16,7 @@ import os, sys
 from batchmp.fstools.builders.fsentry import FSEntry, FSEntryType
 from batchmp.fstools.builders.fsprms import FSEntryParamsBase
 from batchmp.fstools.builders.fsb import FSEntryBuilderBase
+from batchmp.commons.bulkprober import BulkProber
 
 class DWalker:
     ''' Walks content of a directory, generating
@@ -48,19 +49,24 @@ class DWalker:
             yield from fs_entry_params.fs_entry_builder.build_entry(fs_entry_params)
 
     @staticmethod
-    def file_entries(fs_entry_params, pass_filter = None):
+    def file_entries(fs_entry_params, pass_filter = None, bulk_probe = False):
+        ''' generates a sequence of file FSEntries passing the pass_filter
+            with bulk_probe, runs expensive pass filters (e.g. media probes)
+            in a bounded thread pool, ahead of the consumer
+        '''
         if not pass_filter:
             pass_filter = lambda f: True
 
-        for entry in DWalker.entries(fs_entry_params):
-
-            if entry.type in (FSEntryType.ROOT, FSEntryType.DIR):
-                continue
-
-            if not pass_filter(entry.realpath):
-                continue
-            else:
-                yield entry
+        file_entries = (entry for entry in DWalker.entries(fs_entry_params)
+                                    if entry.type not in (FSEntryType.ROOT, FSEntryType.DIR))
+        if bulk_probe:
+            yield from BulkProber(pass_filter).filter(file_entries, key = lambda entry: entry.realpath)
+        else:
+            for entry in file_entries:
+                if not pass_filter(entry.realpath):
+                    continue
+                else:
+                    yield entry
 
     @staticmethod
     def dir_entries(fs_entry_params, pass_filter = None):
@@ -12,7 +12,22 @@
 ## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 ## GNU General Public License for more details.
 
-import unittest, weakref, gc
+import unittest, weakref, gc, time, random, threading, os, sys, tempfile, json, multiprocessing, socket
+from batchmp.commons.bulkprober import BulkProber
+from batchmp.commons.launcher import CmdLauncher, CmdProcessingError, CmdTimeoutError
+from batchmp.commons.taskprocessor import Task, TaskResult, TasksProcessor
+from batchmp.commons.executors import TasksExecutor, TasksExecutorType
+from batchmp.commons.scheduler import LPTScheduler, UniformCostModel
+from batchmp.commons.cpubudget import CPUBudgetPlanner
+from batchmp.commons.jobjournal import JobJournal
+from batchmp.commons.taskplan import TasksPlan
+from batchmp.commons.taskprogress import TasksProgress
+from batchmp.commons.taskreport import TasksReport
+from batchmp.commons.concurrency import AdaptiveConcurrency, SystemPressureProbe, SystemPressure
+from batchmp.commons.throughput import ThroughputHistory
+from batchmp.commons.distributed import TasksWorker, DistributedTasksExecutor, DistributedMessage, parse_address
+from multiprocessing.connection import Client
+from multiprocessing import AuthenticationError
 from batchmp.commons.descriptors import (
          PropertyDescriptor,
          LazyClassPropertyDescriptor,
@@ -150,6 +165,931 @@ class DescriptorTests(unittest.TestCase):
         gc.collect()
         self.assertIsNone(r())
 
+class BulkProberTests(unittest.TestCase):
+    def test_iprobe_order(self):
+        def probe(item):
+            time.sleep(random.random() / 100)
+            return item * item
+        items = list(range(50))
+        prober = BulkProber(probe, num_workers = 8, read_ahead = 16)
+        self.assertEqual(list(prober.iprobe(items)), [(item, item * item) for item in items])
+        self.assertEqual(list(prober.filter(items, key = lambda item: item % 2)), items[1::2])
+
+    def test_iprobe_read_ahead(self):
+        probed = []
+        lock = threading.Lock()
+        def probe(item):
+            with lock:
+                probed.append(item)
+            return True
+        prober = BulkProber(probe, num_workers = 2, read_ahead = 4)
+        for item, _ in prober.iprobe(iter(range(100))):
+            if item == 10:
+                break
+        # read-ahead is bounded
+        self.assertLessEqual(len(probed), 10 + prober.read_ahead)
+
+@unittest.skipIf(os.name == 'nt', 'skipping for windows')
+class CmdLauncherTests(unittest.TestCase):
+    def test_run_separate_streams(self):
+        result = CmdLauncher.run([sys.executable, '-c',
+                                    'import sys; print("out"); print("err", file = sys.stderr)'])
+        self.assertEqual((result.returncode, result.stdout, result.stderr), (0, 'out\n', 'err\n'))
+        self.assertGreater(result.elapsed, 0)
+        self.assertIsNotNone(result.rusage)
+        self.assertGreater(result.rusage.max_rss, 0)
+
+        result = CmdLauncher.run([sys.executable, '-c',
+                                    'import sys; print("out"); print("err", file = sys.stderr)'], merge_stderr = True)
+        self.assertEqual(sorted(result.stdout.split()), ['err', 'out'])
+
+    def test_run_bounded_capture(self):
+        lines = []
+        result = CmdLauncher.run([sys.executable, '-c',
+                                    'import sys\nfor i in range(10000): print(i, file = sys.stderr)'],
+                                    capture_limit = 10, on_stderr = lines.append)
+        self.assertEqual(result.stderr, '9998\n9999\n')
+        self.assertEqual(lines, [str(i) for i in range(10000)])
+
+    def test_run_raise(self):
+        with self.assertRaises(CmdProcessingError) as ctx:
+            CmdLauncher.run([sys.executable, '-c', 'import sys; sys.exit("failed")'])
+        self.assertEqual(ctx.exception.result.returncode, 1)
+        self.assertIn('failed', str(ctx.exception))
+
+        result = CmdLauncher.run([sys.executable, '-c', 'import sys; sys.exit(3)'], check = False)
+        self.assertEqual(result.returncode, 3)
+
+    def test_ilines(self):
+        lines = CmdLauncher.ilines([sys.executable, '-c',
+                                    'import sys\nfor i in range(3): print(i, file = sys.stderr)'])
+        self.assertEqual(list(lines), ['0', '1', '2'])
+
+        with self.assertRaises(CmdProcessingError) as ctx:
+            list(CmdLauncher.ilines([sys.executable, '-c', 'import sys; sys.exit("failed")']))
+        self.assertIn('failed', str(ctx.exception))
+
+    def test_ilines_early_termination(self):
+        start = time.time()
+        lines = CmdLauncher.ilines([sys.executable, '-u', '-c',
+                                    'import time\nfor i in range(100): print(i); time.sleep(0.1)'], stderr = False)
+        self.assertEqual(next(lines), '0')
+        lines.close()
+        self.assertLess(time.time() - start, 5)
+
+    def test_run_timeouts(self):
+        start = time.time()
+        with self.assertRaises(CmdTimeoutError) as ctx:
+            # the whole process group is killed, i.e. including the background child
+            CmdLauncher.run(['sh', '-c', 'sleep 30 & sleep 30'], timeout = 0.3)
+        self.assertFalse(ctx.exception.stalled)
+        self.assertLess(time.time() - start, 5)
+        # the killed command resources usage
+        self.assertIsNotNone(ctx.exception.result.rusage)
+
+        # prints, but does not progress
+        with self.assertRaises(CmdTimeoutError) as ctx:
+            CmdLauncher.run([sys.executable, '-u', '-c', 'import time\nwhile True: print(0); time.sleep(0.05)'],
+                                                stall_timeout = 0.3, is_progress = lambda line: line != '0')
+        self.assertTrue(ctx.exception.stalled)
+
+        result = CmdLauncher.run([sys.executable, '-u', '-c',
+                                    'import time\nfor i in range(5): print(i); time.sleep(0.1)'], stall_timeout = 0.3)
+        self.assertEqual(result.stdout.split(), ['0', '1', '2', '3', '4'])
+
+class _TasksRuns:
+    ''' Runs of tasks executed in the calling process, in the order started
+    '''
+    def __init__(self, tasks_progress = None):
+        self.lock = threading.Lock()
+        self.started, self.running, self.max_running = [], 0, 0
+        # the number of tasks running as each task starts
+        self.concurrency = []
+        # the run progress, as each task reports half of its weight done
+        self.tasks_progress, self.progress = tasks_progress, []
+
+    def task_started(self, task):
+        with self.lock:
+            self.started.append(task)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.concurrency.append(self.running)
+
+    def task_reported(self, task):
+        if self.tasks_progress:
+            self.progress.append(self.tasks_progress.fraction)
+
+    def task_done(self, task):
+        with self.lock:
+            self.running -= 1
+
+class _TestTask(Task):
+    ''' Test task, outputting its num, pid and thread id
+        Its scheduling / planning hints (cost, threads, progress weight, journal and throughput keys) are as given
+        It can take its time, time out in its first runs, fail, or write its output file to output_dir
+    '''
+    def __init__(self, num, cost = None, threads = 1, weight = None, key = None, throughput_key = None,
+                        duration = 0.0, step_duration = None, max_rss = 0, num_timeouts = 0, failed = False,
+                        output_dir = None, runs = None):
+        self.num = num
+        self.cost, self.threads, self.weight = cost, threads, weight
+        self.key, self.kind = key, throughput_key
+        self.duration, self.step_duration, self.max_rss = duration, step_duration, max_rss
+        self.num_timeouts, self.failed = num_timeouts, failed
+        self.output_dir, self.runs = output_dir, runs
+        self.num_runs = 0
+
+    def estimated_cost(self):
+        return self.cost
+
+    def threads_hint(self):
+        return self.threads
+
+    def progress_weight(self):
+        return self.weight
+
+    def journal_key(self):
+        return self.key
+
+    def throughput_key(self):
+        return self.kind
+
+    def execute(self):
+        self.num_runs += 1
+        if self.runs:
+            self.runs.task_started(self)
+        if self.duration:
+            time.sleep(self.duration)
+        if self.progress_reporter and self.weight:
+            self.progress_reporter(self.weight / 2, 100)
+            if self.runs:
+                self.runs.task_reported(self)
+
+        task_result = TaskResult()
+        task_result.journal_key = self.key
+        task_result.add_task_step_info_msg('{0} {1} {2}'.format(self.num, os.getpid(), threading.get_ident()))
+        if self.step_duration is not None:
+            task_result.add_task_step_duration(self.step_duration)
+        task_result.max_rss = self.max_rss
+        if self.num_runs <= self.num_timeouts:
+            task_result.add_timeout(stalled = self.num_runs % 2 == 0)
+        elif not self.failed:
+            if self.output_dir:
+                output_path = os.path.join(self.output_dir, os.path.basename(self.key))
+                with open(output_path, 'w') as f:
+                    f.write('processed')
+                task_result.add_output_path(output_path)
+            task_result.succeeded = True
+
+        if self.runs:
+            self.runs.task_done(self)
+        return task_result
+
+def _task_nums(tasks_results):
+    return sorted(int(result.task_output.split()[0]) for result in tasks_results)
+
+class TasksProcessorTests(unittest.TestCase):
+    def process_tasks(self, tasks, **kwargs):
+        (tasks_results, _), _ = TasksProcessor().process_tasks(tasks, num_workers = 4, quiet = True, **kwargs)
+        self.assertTrue(all(result.succeeded for result in tasks_results))
+        return sorted(tuple(int(value) for value in result.task_output.split()) for result in tasks_results)
+
+    def test_thread_pool_executor(self):
+        outputs = self.process_tasks([_TestTask(num) for num in range(6)])
+        self.assertEqual([num for num, _, _ in outputs], list(range(6)))
+        # threads of the current process
+        self.assertEqual({pid for _, pid, _ in outputs}, {os.getpid()})
+        self.assertNotIn(threading.get_ident(), {tid for _, _, tid in outputs})
+
+    def test_serial_executor(self):
+        outputs = self.process_tasks([_TestTask(num) for num in range(5)], serial_exec = True)
+        self.assertEqual({tid for _, _, tid in outputs}, {threading.get_ident()})
+
+    @unittest.skipIf(os.name == 'nt', 'skipping for windows')
+    def test_process_pool_executor(self):
+        python_heavy_task = _TestTask(2)
+        python_heavy_task.executor_type = TasksExecutorType.PROCESSES
+        outputs = self.process_tasks([_TestTask(1), python_heavy_task])
+        self.assertEqual([num for num, _, _ in outputs], [1, 2])
+        self.assertNotIn(os.getpid(), {pid for _, pid, _ in outputs})
+
+        outputs = self.process_tasks([_TestTask(num) for num in range(3)],
+                                                        executor_type = TasksExecutorType.PROCESSES)
+        self.assertNotIn(os.getpid(), {pid for _, pid, _ in outputs})
+
+    def test_thread_pool_premature_exit(self):
+        runs = _TasksRuns()
+        with TasksExecutor.create(TasksExecutorType.THREADS, num_workers = 2) as executor:
+            for _ in executor.imap_unordered([_TestTask(num, duration = 0.05, runs = runs) for num in range(50)]):
+                break
+        self.assertLess(len(runs.started), 50)
+
+    def test_bounded_pending(self):
+        generated, results = [], []
+        def tasks():
+            for num in range(12):
+                # tasks are pulled only when less than max_pending are in flight
+                self.assertLess(len(generated) - len(results), 3)
+                generated.append(num)
+                yield _TestTask(num)
+
+        for executor_type in (TasksExecutorType.THREADS, TasksExecutorType.PROCESSES):
+            generated.clear(); results.clear()
+            with TasksExecutor.create(executor_type, num_workers = 2) as executor:
+                for result in executor.imap_unordered(tasks(), max_pending = 3):
+                    results.append(result)
+            self.assertEqual(len(results), 12)
+
+    def test_process_tasks_stream(self):
+        tasks_processor = TasksProcessor(cpu_budget_planner = CPUBudgetPlanner(num_cpus = 2))
+        (tasks_results, _), _ = tasks_processor.process_tasks_stream((_TestTask(num) for num in range(7)),
+                                                                                            quiet = True)
+        self.assertEqual(_task_nums(tasks_results), list(range(7)))
+        self.assertEqual(tasks_processor.cpu_budget.num_workers, 2)
+
+        (tasks_results, _), _ = tasks_processor.process_tasks_stream(iter(()), quiet = True)
+        self.assertEqual(tasks_results, [])
+
+class _StagedTask(_TestTask):
+    next_started = None
+
+    def execute(self):
+        if self.next_started and self.num:
+            self.next_started.set()
+        task_result = super().execute()
+        if self.staged:
+            task_result.finalize_state = os.getpid()
+        return task_result
+
+    def finalize(self, task_result):
+        # the next task runs while this one is finalized
+        if self.next_started and not self.num:
+            self.overlapped = self.next_started.wait(timeout = 5)
+        task_result.add_task_step_info_msg('finalized {0} {1}'.format(task_result.finalize_state, os.getpid()))
+        task_result.finalize_state = None
+        return task_result
+
+class FinalizeStageTests(unittest.TestCase):
+    def process_tasks(self, tasks, **kwargs):
+        tasks_processor = TasksProcessor(finalize_workers = kwargs.pop('finalize_workers', None))
+        (tasks_results, _), _ = tasks_processor.process_tasks(tasks, quiet = True, **kwargs)
+        self.assertEqual(len(tasks_results), len(tasks))
+        self.assertTrue(all(result.succeeded and not result.finalize_pending for result in tasks_results))
+        return [result.task_output.split('\n') for result in tasks_results]
+
+    def test_overlap(self):
+        _StagedTask.next_started = threading.Event()
+        tasks = [_StagedTask(num) for num in range(3)]
+        try:
+            outputs = self.process_tasks(tasks, num_workers = 1, executor_type = TasksExecutorType.THREADS)
+        finally:
+            _StagedTask.next_started = None
+        self.assertTrue(all(len(output) == 2 for output in outputs))
+        self.assertTrue(tasks[0].overlapped)
+
+    @unittest.skipIf(os.name == 'nt', 'skipping for windows')
+    def test_process_pool(self):
+        outputs = self.process_tasks([_StagedTask(num) for num in range(3)], num_workers = 2,
+                                                                    executor_type = TasksExecutorType.PROCESSES)
+        for _, finalized in outputs:
+            _, executed_pid, finalized_pid = finalized.split()
+            # executed in a pool worker, finalized in the calling process
+            self.assertNotEqual(int(executed_pid), os.getpid())
+            self.assertEqual(int(finalized_pid), os.getpid())
+
+    def test_not_staged(self):
+        # serial runs, or no finalize stage
+        outputs = self.process_tasks([_StagedTask(num) for num in range(2)], serial_exec = True)
+        self.assertTrue(all(len(output) == 1 for output in outputs))
+        outputs = self.process_tasks([_StagedTask(num) for num in range(2)], num_workers = 2, finalize_workers = 0)
+        self.assertTrue(all(len(output) == 1 for output in outputs))
+
+class TasksRetryTests(unittest.TestCase):
+    def test_retries(self):
+        # timing out in the first num runs
+        tasks = [_TestTask(num, num_timeouts = num) for num in (0, 1, 2, 3)]
+        tasks_processor = TasksProcessor(max_retries = 2, retry_backoff = 0.01)
+        (tasks_results, _), _ = tasks_processor.process_tasks(tasks, num_workers = 2, quiet = True)
+        results = {int(result.task_output.split()[0]): result for result in tasks_results}
+        self.assertEqual(len(results), 4)
+
+        self.assertEqual([results[num].succeeded for num in range(4)], [True, True, True, False])
+        self.assertEqual([results[num].num_retries for num in range(4)], [0, 1, 2, 2])
+        self.assertEqual([results[num].num_timeouts for num in range(4)], [0, 1, 1, 2])
+        self.assertEqual([results[num].num_stalls for num in range(4)], [0, 0, 1, 1])
+        self.assertEqual([task.num_runs for task in tasks], [1, 2, 3, 3])
+        self.assertEqual(tasks_processor.tasks_report.num_retried, 3)
+
+    def test_rusage(self):
+        task_result = TaskResult()
+        for _ in range(2):
+            task_result.add_rusage(CmdLauncher.run([sys.executable, '-c',
+                                                'x = bytearray(32 << 20); sum(range(10 ** 6))']).rusage)
+        self.assertGreater(task_result.cpu_time, 0)
+        self.assertGreater(task_result.max_rss, 32 << 20)
+
+        # retried runs resources usage counts
+        retried_result = TaskResult()
+        retried_result.add_retried(task_result)
+        self.assertEqual((retried_result.cpu_time, retried_result.max_rss), (task_result.cpu_time, task_result.max_rss))
+
+    def test_stream_retries(self):
+        tasks_processor = TasksProcessor(max_retries = 1, retry_backoff = 0.01)
+        (tasks_results, _), _ = tasks_processor.process_tasks_stream(
+                                                    (_TestTask(num, num_timeouts = num) for num in (0, 1)),
+                                                    serial_exec = True, quiet = True)
+        self.assertTrue(all(result.succeeded for result in tasks_results))
+        self.assertEqual(sorted(result.num_retries for result in tasks_results), [0, 1])
+
+def _reported_task(num):
+    return _TestTask(num, key = 'task{}'.format(num), step_duration = num * 5.0, max_rss = num << 20,
+                                                                                failed = num % 3 == 0)
+
+class TasksReportTests(unittest.TestCase):
+    def test_report(self):
+        tasks_report = TasksReport()
+        for num in range(10):
+            tasks_report.add(_reported_task(num).execute())
+        self.assertEqual((tasks_report.num_tasks, tasks_report.num_succeeded, tasks_report.num_failed), (10, 6, 4))
+        self.assertEqual(tasks_report.tasks_duration, 225.0)
+        self.assertEqual(tasks_report.durations_histogram(), [('0s-1s', 1), ('1s-10s', 2), ('10s-1m', 7)])
+        self.assertEqual([key for key, _ in tasks_report.failure_samples], ['task0', 'task3', 'task6', 'task9'])
+        self.assertEqual(tasks_report.peak_memory, [(9 << 20, 'task9'), (8 << 20, 'task8'), (7 << 20, 'task7')])
+        self.assertEqual(tasks_report.summary_msg(), '10 tasks done (Succeeded: 6, Failed: 4)')
+
+    def test_records(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            records_path = os.path.join(tmp_dir, 'records', 'run.ndjson')
+            with TasksReport(records_path) as tasks_report:
+                for num in range(3):
+                    tasks_report.add(_reported_task(num).execute())
+            with open(records_path, encoding = 'utf-8') as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual([record['key'] for record in records], ['task0', 'task1', 'task2'])
+        self.assertEqual([record['succeeded'] for record in records], [False, True, True])
+        self.assertEqual(records[2]['duration'], 10.0)
+
+    def test_streamed_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            records_path = os.path.join(tmp_dir, 'run.ndjson')
+            tasks_processor = TasksProcessor(records_path = records_path)
+            (tasks_results, cpu_core_time), _ = tasks_processor.process_tasks_stream(
+                                                        (_reported_task(num) for num in range(50)),
+                                                        num_workers = 4, quiet = True, keep_results = False)
+            with open(records_path, encoding = 'utf-8') as f:
+                num_records = len(f.readlines())
+        # results are aggregated, with bounded samples, and recorded in full
+        tasks_report = tasks_processor.tasks_report
+        self.assertEqual(tasks_results, [])
+        self.assertEqual((tasks_report.num_tasks, tasks_report.num_failed), (50, 17))
+        self.assertEqual(len(tasks_report.failure_samples), TasksReport.NUM_FAILURE_SAMPLES)
+        self.assertEqual(tasks_report.peak_memory[0], (49 << 20, 'task49'))
+        self.assertEqual(num_records, 50)
+        self.assertEqual(cpu_core_time, tasks_report.tasks_duration)
+
+    def test_task_output(self):
+        task_result = TaskResult()
+        self.assertIsNone(task_result.task_output)
+        task_result.add_task_step_info_msg('one')
+        task_result.add_task_step_info_msg('two')
+        self.assertEqual(task_result.task_output, 'one\ntwo')
+
+class LPTSchedulerTests(unittest.TestCase):
+    def test_schedule(self):
+        tasks = [_TestTask(num, cost = num or None) for num in (1, 0, 5, 3, 0, 8)]
+        scheduler = LPTScheduler()
+        self.assertEqual([task.num for task in scheduler.schedule(tasks)], [8, 5, 3, 1, 0, 0])
+        self.assertEqual(scheduler.costs, [8, 5, 3, 1, 1.0, 1.0])
+
+        # same cost tasks keep the submit order
+        scheduled = LPTScheduler(UniformCostModel()).schedule(tasks)
+        self.assertEqual(scheduled, tasks)
+
+    def test_makespan(self):
+        # a long task last keeps the pool waiting
+        self.assertEqual(LPTScheduler.makespan([1, 1, 1, 1, 4], 2), 6)
+        self.assertEqual(LPTScheduler.makespan([4, 1, 1, 1, 1], 2), 4)
+        self.assertEqual(LPTScheduler.makespan([3], 4), 3)
+        self.assertEqual(LPTScheduler.makespan([], 4), 0)
+
+    def test_report(self):
+        scheduler = LPTScheduler()
+        scheduler.schedule([_TestTask(num, cost = num) for num in (1, 1, 1, 1, 4)])
+        # cost units calibrated to the actual work secs, i.e. x2
+        report = scheduler.report(num_workers = 2, actual_work = 16.0, actual_makespan = 9.0)
+        self.assertEqual(report, (8.0, 12.0, 9.0))
+
+    def test_dispatch_order(self):
+        runs = _TasksRuns()
+        tasks = [_TestTask(num, cost = num, runs = runs) for num in (1, 3, 2)]
+        tasks_processor = TasksProcessor()
+        tasks_processor.process_tasks(tasks, num_workers = 1, quiet = True)
+        # pooled tasks start longest first
+        self.assertEqual([task.num for task in runs.started], [3, 2, 1])
+        self.assertIsNotNone(tasks_processor.scheduling_report)
+
+        # serial runs keep the submit order
+        runs.started.clear()
+        TasksProcessor().process_tasks(tasks, serial_exec = True, quiet = True)
+        self.assertEqual([task.num for task in runs.started], [1, 3, 2])
+
+def _planned_task(num):
+    return _TestTask(num, cost = num, key = '/media/f{:02d}.flac'.format(num))
+
+class TasksPlanTests(unittest.TestCase):
+    def test_partition(self):
+        tasks = [_planned_task(num) for num in (12, 1, 2, 3, 6)]
+        plan = TasksPlan.build(tasks)
+        shards = plan.partition(2)
+        # balanced by cost, not by count
+        self.assertEqual([[entry.cost for entry in shard] for shard in shards], [[12], [1, 2, 3, 6]])
+        self.assertEqual(plan.partition(3), TasksPlan.build(reversed(tasks)).partition(3))
+
+        shard_tasks = [plan.shard_tasks(tasks, shard, 3) for shard in (1, 2, 3)]
+        self.assertEqual(sorted(task.num for tasks in shard_tasks for task in tasks), sorted(task.num for task in tasks))
+
+    def test_manifest(self):
+        plan = TasksPlan.build([_planned_task(num) for num in (3, 1, 2)], target_path_dir = '/media_processed')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_path = os.path.join(tmp_dir, 'plan.json')
+            plan.save(manifest_path)
+            with open(manifest_path) as f:
+                manifest = f.read()
+            loaded_plan = TasksPlan.load(manifest_path)
+            loaded_plan.save(manifest_path)
+            with open(manifest_path) as f:
+                self.assertEqual(f.read(), manifest)
+        self.assertEqual(loaded_plan.entries, plan.entries)
+        self.assertEqual(loaded_plan.info, {'target_path_dir': '/media_processed'})
+        self.assertEqual([entry.key for entry in plan.entries], ['/media/f01.flac', '/media/f02.flac', '/media/f03.flac'])
+
+    def test_parse_shard(self):
+        self.assertEqual(TasksPlan.parse_shard('2/4'), (2, 4))
+        for shard_spec in ('0/4', '5/4', '2', 'a/b'):
+            with self.assertRaises(ValueError):
+                TasksPlan.parse_shard(shard_spec)
+
+class _PressureProbe:
+    ''' Fixed system pressure
+    '''
+    pressure = SystemPressure(cpu = 0.0, memory = 0.0, io = 0.0, load = 0.1, mem_available = 0.9)
+
+    @classmethod
+    def sample(cls):
+        return cls.pressure
+
+class AdaptiveConcurrencyTests(unittest.TestCase):
+    def controller(self, pressure, **kwargs):
+        probe = type('_Probe', (_PressureProbe,), dict(pressure = pressure))
+        controller = AdaptiveConcurrency(interval = 0, probe = probe, **kwargs)
+        return controller
+
+    def test_probe(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, 'cpu'), 'w') as f:
+                f.write('some avg10=12.50 avg60=3.00 avg300=1.00 total=100\n'
+                        'full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n')
+            meminfo = os.path.join(tmp_dir, 'meminfo')
+            with open(meminfo, 'w') as f:
+                f.write('MemTotal:       16000 kB\nMemFree:         1000 kB\nMemAvailable:    4000 kB\n')
+
+            probe = type('_Probe', (SystemPressureProbe,), dict(PSI_DIR = tmp_dir, MEMINFO = meminfo))
+            pressure = probe.sample()
+        self.assertEqual(pressure.cpu, 12.5)
+        # not available
+        self.assertIsNone(pressure.memory)
+        self.assertEqual(pressure.mem_available, 0.25)
+
+    def test_decisions(self):
+        # low pressure, up to the max
+        controller = self.controller(_PressureProbe.pressure, min_workers = 2, max_workers = 4)
+        self.assertEqual(controller.start(3), 4)
+        self.assertEqual([controller.limit() for _ in range(3)], [4, 4, 4])
+        self.assertEqual(controller.num_decisions, 1)
+
+        # high CPU pressure, one by one down to the min
+        controller = self.controller(_PressureProbe.pressure._replace(cpu = 60.0), min_workers = 2)
+        controller.start(4)
+        self.assertEqual([controller.limit() for _ in range(3)], [3, 2, 2])
+        self.assertEqual(controller.decisions[0].reason, 'CPU pressure 60.0%')
+        self.assertEqual((controller.lowest, controller.highest), (2, 4))
+
+        # memory pressure halves
+        controller = self.controller(_PressureProbe.pressure._replace(mem_available = 0.05))
+        controller.start(8)
+        self.assertEqual(controller.limit(), 4)
+
+        # in between, holds
+        controller = self.controller(_PressureProbe.pressure._replace(load = 1.0))
+        controller.start(4)
+        self.assertEqual(controller.limit(), 4)
+        self.assertEqual(controller.num_decisions, 0)
+
+    def test_backing_off(self):
+        runs = _TasksRuns()
+        controller = self.controller(_PressureProbe.pressure._replace(memory = 50.0), min_workers = 1)
+        tasks_processor = TasksProcessor(concurrency_controller = controller)
+        (tasks_results, _), _ = tasks_processor.process_tasks(
+                                                    [_TestTask(num, duration = 0.02, runs = runs) for num in range(12)],
+                                                    num_workers = 4, quiet = True)
+        self.assertEqual(len(tasks_results), 12)
+        self.assertEqual(controller.concurrency, 1)
+        self.assertGreater(runs.max_running, 1)
+        # once backed off, the tasks run one at a time
+        self.assertEqual(runs.concurrency[-4:], [1, 1, 1, 1])
+
+class CPUBudgetPlannerTests(unittest.TestCase):
+    def test_plan(self):
+        planner = CPUBudgetPlanner(num_cpus = 8)
+        # single-threaded tasks, one worker per CPU
+        self.assertEqual(planner.plan([1] * 20), (8, 8, 1))
+        # multi-threaded tasks, fewer workers with more threads each
+        self.assertEqual(planner.plan([4] * 20), (8, 2, 4))
+        self.assertEqual(planner.plan([16] * 20), (8, 1, 8))
+        # no more workers than tasks
+        self.assertEqual(planner.plan([1] * 3), (8, 3, 2))
+        # explicit num of workers
+        self.assertEqual(planner.plan([1] * 20, num_workers = 2), (8, 2, 4))
+
+    def test_cgroup_cpus(self):
+        class _Planner(CPUBudgetPlanner):
+            CGROUP_V1_CPU_QUOTA = CGROUP_V1_CPU_PERIOD = os.devnull
+        with tempfile.NamedTemporaryFile('w') as cpu_max:
+            _Planner.CGROUP_V2_CPU_MAX = cpu_max.name
+            for quota, cpus in (('250000 100000', 3), ('50000 100000', 1), ('max 100000', None)):
+                cpu_max.seek(0); cpu_max.truncate()
+                cpu_max.write(quota); cpu_max.flush()
+                self.assertEqual(_Planner.cgroup_cpus(), cpus)
+        self.assertGreaterEqual(CPUBudgetPlanner.available_cpus(), 1)
+
+    def test_tasks_threads(self):
+        tasks = [_TestTask(num, threads = num) for num in (1, 4, 4, 8)]
+        tasks_processor = TasksProcessor(cpu_budget_planner = CPUBudgetPlanner(num_cpus = 8))
+        tasks_processor.process_tasks(tasks, quiet = True)
+        self.assertEqual(tasks_processor.cpu_budget, (8, 2, 4))
+        self.assertEqual(sorted(task.cpu_threads for task in tasks), [1, 4, 4, 4])
+
+class JobJournalTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src_dir = os.path.join(self.tmp_dir.name, 'src')
+        self.out_dir = os.path.join(self.tmp_dir.name, 'out')
+        os.makedirs(self.src_dir)
+        os.makedirs(self.out_dir)
+        self.fpathes = []
+        for num in range(4):
+            fpath = os.path.join(self.src_dir, 'f{}.mp3'.format(num))
+            with open(fpath, 'w') as f:
+                f.write('media')
+            self.fpathes.append(fpath)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_journal(self):
+        with JobJournal(self.out_dir) as journal:
+            out_fpath = os.path.join(self.out_dir, 'f0.mp3')
+            with open(out_fpath, 'w') as f:
+                f.write('processed')
+            journal.started(self.fpathes[0])
+            journal.completed(self.fpathes[0], [out_fpath])
+            journal.started(self.fpathes[1])
+        # an interrupted run's torn record
+        with open(journal.journal_path, 'a') as f:
+            f.write('{"event": "compl')
+
+        journal = JobJournal(self.out_dir)
+        self.assertTrue(journal.is_completed(self.fpathes[0]))
+        self.assertFalse(journal.is_completed(self.fpathes[1]))
+
+        # half-written outputs are redone
+        with open(out_fpath, 'a') as f:
+            f.write('more')
+        self.assertFalse(journal.is_completed(self.fpathes[0]))
+
+    def test_journal_planned(self):
+        for _ in range(3):
+            with JobJournal(self.out_dir) as journal:
+                for fpath in self.fpathes:
+                    journal.planned(fpath)
+        # planned once per journal, not per run
+        with open(journal.journal_path) as f:
+            self.assertEqual(len(f.readlines()), len(self.fpathes))
+
+        journal.discard()
+        self.assertFalse(JobJournal.exists(self.out_dir))
+
+    def test_resume(self):
+        def run_tasks(failed = ()):
+            runs = _TasksRuns()
+            tasks_processor = TasksProcessor(journal = JobJournal(self.out_dir))
+            tasks_processor.process_tasks([_TestTask(num, key = fpath, output_dir = self.out_dir,
+                                                        failed = num in failed, runs = runs)
+                                                            for num, fpath in enumerate(self.fpathes)],
+                                                                            num_workers = 2, quiet = True)
+            tasks_processor.journal.close()
+            return tasks_processor, sorted(task.num for task in runs.started)
+
+        # a partially failed run
+        tasks_processor, executed = run_tasks(failed = (1, 3))
+        self.assertEqual((tasks_processor.num_skipped, executed), (0, [0, 1, 2, 3]))
+        self.assertEqual(tasks_processor.tasks_report.num_failed, 2)
+
+        # resumed, only the failed tasks are redone
+        tasks_processor, executed = run_tasks()
+        self.assertEqual((tasks_processor.num_skipped, executed), (2, [1, 3]))
+        self.assertEqual(tasks_processor.tasks_report.num_failed, 0)
+
+        # changed inputs are redone
+        with open(self.fpathes[2], 'a') as f:
+            f.write('changed')
+        tasks_processor, executed = run_tasks()
+        self.assertEqual((tasks_processor.num_skipped, executed), (3, [2]))
+
+        # nothing left to do
+        tasks_processor, executed = run_tasks()
+        self.assertEqual((tasks_processor.num_skipped, executed), (4, []))
+
+class _SlowLeaseExecutor(DistributedTasksExecutor):
+    ''' Takes its time to lease the last task, i.e. while the other workers find no more tasks
+    '''
+    def __init__(self, last_num, **options):
+        super().__init__(**options)
+        self.last_num = last_num
+
+    def _register_lease(self, task, conn_id):
+        if task.num == self.last_num:
+            time.sleep(0.5)
+        return super()._register_lease(task, conn_id)
+
+class DistributedTests(unittest.TestCase):
+    AUTHKEY = b'batchmp-test'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp_dir.name, 'coordinator.sock')
+        self.workers = []
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.join()
+        self.tmp_dir.cleanup()
+
+    def start_worker(self, num_slots = 2):
+        worker = threading.Thread(target = TasksWorker(self.address, authkey = self.AUTHKEY,
+                                                                            num_slots = num_slots).run)
+        worker.start()
+        self.workers.append(worker)
+
+    def coordinator(self, **options):
+        return TasksExecutor.create(TasksExecutorType.DISTRIBUTED,
+                                    address = self.address, authkey = self.AUTHKEY, **options)
+
+    def lease_task(self):
+        ''' Connects as a bare worker, and leases a task
+        '''
+        conn = Client(self.address, authkey = self.AUTHKEY)
+        conn.send((DistributedMessage.HELLO, 'bare', 1))
+        conn.recv()
+        while True:
+            conn.send((DistributedMessage.GET,))
+            reply = conn.recv()
+            if reply[0] == DistributedMessage.TASK:
+                return conn, reply[1]
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('node1:7000'), (('node1', 7000), 'AF_INET'))
+        self.assertEqual(parse_address(':7000'), (('localhost', 7000), 'AF_INET'))
+        self.assertEqual(parse_address('/tmp/bmfp.sock'), ('/tmp/bmfp.sock', 'AF_UNIX'))
+
+    def test_local_workers(self):
+        with self.coordinator() as executor:
+            for _ in range(2):
+                self.start_worker()
+            results = list(executor.imap_unordered(_TestTask(num) for num in range(20)))
+        self.assertEqual(_task_nums(results), list(range(20)))
+        self.assertEqual(executor.num_workers, 4)
+
+    def test_dead_worker(self):
+        with self.coordinator() as executor:
+            results = executor.imap_unordered([_TestTask(num) for num in range(6)])
+            # a worker that dies with a leased task
+            def _die():
+                conn, _ = self.lease_task()
+                conn.close()
+                self.start_worker()
+            threading.Thread(target = _die).start()
+            outputs = _task_nums(results)
+        self.assertEqual(outputs, list(range(6)))
+        self.assertEqual(executor.num_reassigned, 1)
+
+    def test_expired_lease(self):
+        with self.coordinator(lease_timeout = 0.2) as executor:
+            results = executor.imap_unordered([_TestTask(num) for num in range(6)])
+            # a hung worker, i.e. no heartbeats
+            leases = []
+            def _hang():
+                leases.append(self.lease_task())
+                self.start_worker()
+            threading.Thread(target = _hang).start()
+            outputs = _task_nums(results)
+
+            # late results of reassigned leases are dropped
+            conn, lease_id = leases[0]
+            conn.send((DistributedMessage.RESULT, lease_id, _TestTask(0).execute()))
+            conn.recv()
+            conn.close()
+        self.assertEqual(outputs, list(range(6)))
+        self.assertEqual(executor.num_reassigned, 1)
+
+    def test_slow_lease(self):
+        with _SlowLeaseExecutor(5, address = self.address, authkey = self.AUTHKEY) as executor:
+            for _ in range(3):
+                self.start_worker()
+            results = list(executor.imap_unordered(_TestTask(num) for num in range(6)))
+        # the last task result is not dropped
+        self.assertEqual(_task_nums(results), list(range(6)))
+
+    def test_handshake(self):
+        with self.coordinator() as executor:
+            executor.HANDSHAKE_TIMEOUT = 0.5
+            # a silent peer does not hold up the workers
+            silent_peer = socket.socket(socket.AF_UNIX)
+            silent_peer.connect(self.address)
+            with Client(self.address, authkey = self.AUTHKEY) as conn:
+                conn.send((DistributedMessage.HELLO, 'bare', 1))
+                self.assertEqual(conn.recv(), (DistributedMessage.OK,))
+
+            # peers with a wrong key are turned down
+            self.assertRaises(AuthenticationError, Client, self.address, authkey = b'wrong')
+
+            # silent peers are disconnected after the handshake timeout
+            silent_peer.settimeout(5.0)
+            self.assertTrue(silent_peer.recv(256))
+            self.assertEqual(silent_peer.recv(256), b'')
+            silent_peer.close()
+
+            self.start_worker()
+            results = list(executor.imap_unordered(_TestTask(num) for num in range(2)))
+        self.assertEqual(len(results), 2)
+
+    def test_tasks_processor(self):
+        self.start_worker()
+        tasks_processor = TasksProcessor(executor_options = dict(address = self.address, authkey = self.AUTHKEY))
+        (tasks_results, _), _ = tasks_processor.process_tasks([_TestTask(num) for num in range(3)], quiet = True,
+                                                                executor_type = TasksExecutorType.DISTRIBUTED)
+        self.assertTrue(all(result.succeeded for result in tasks_results))
+        self.assertEqual(len(tasks_results), 3)
+
+
+class TasksProgressTests(unittest.TestCase):
+    def test_weighted_progress(self):
+        tasks = [_TestTask(0, weight = 30.0), _TestTask(1, weight = 10.0)]
+        tasks_progress = TasksProgress(tasks)
+        report = tasks_progress.started(tasks[0])
+        report(15.0, 1000)
+        self.assertAlmostEqual(tasks_progress.fraction, 15.0 / 40)
+
+        # reports are monotonic, and do not go past the task weight
+        report(5.0, 10)
+        self.assertAlmostEqual(tasks_progress.fraction, 15.0 / 40)
+        report(60.0, 2000)
+        self.assertAlmostEqual(tasks_progress.fraction, 30.0 / 40)
+
+        tasks_progress.completed(tasks[0])
+        tasks_progress.completed(tasks[1])
+        self.assertAlmostEqual(tasks_progress.fraction, 1.0)
+        self.assertGreater(tasks_progress.speed, 0)
+
+        # a retried task starts over
+        tasks_progress = TasksProgress(tasks)
+        tasks_progress.started(tasks[1])(10.0)
+        tasks_progress.started(tasks[1])
+        self.assertAlmostEqual(tasks_progress.fraction, 0.0)
+
+    def test_unknown_weights(self):
+        # count as the average known weight
+        tasks = [_TestTask(0, weight = 30.0), _TestTask(1, weight = 10.0), _TestTask(2)]
+        tasks_progress = TasksProgress(tasks)
+        self.assertIsNone(tasks_progress.eta)
+        tasks_progress.started(tasks[2])(5.0)
+        tasks_progress.completed(tasks[2])
+        self.assertAlmostEqual(tasks_progress.fraction, 20.0 / 60)
+        self.assertIsNotNone(tasks_progress.eta)
+
+        pct, readout = tasks_progress.status()
+        self.assertAlmostEqual(pct, 100 * 20.0 / 60)
+        self.assertTrue(readout.startswith('33% ETA '))
+        self.assertIn('x, ', readout)
+        self.assertTrue(readout.endswith('MB/s'))
+
+    def test_reported_progress(self):
+        runs = _TasksRuns()
+        tasks = [_TestTask(num, weight = weight, runs = runs) for num, weight in enumerate((30.0, 10.0))]
+        runs.tasks_progress = tasks_progress = TasksProgress(tasks)
+        with TasksExecutor.create(TasksExecutorType.SERIAL) as executor:
+            results = list(TasksProcessor()._execute(executor, tasks, tasks_progress = tasks_progress))
+        self.assertEqual(len(results), 2)
+        # in-process tasks progress is in the run progress as it is reported, i.e. half way through each task
+        self.assertEqual(len(runs.progress), 2)
+        for progress, expected in zip(runs.progress, (15.0 / 40, 35.0 / 40)):
+            self.assertAlmostEqual(progress, expected)
+        self.assertAlmostEqual(tasks_progress.fraction, 1.0)
+
+    def test_collected_progress(self):
+        class _ProgressBar:
+            info_msg, progress = None, 0
+
+        # quick tasks, all done within the info messages interval
+        tasks_processor, p_bar = TasksProcessor(), _ProgressBar()
+        tasks_processor.tasks_report = TasksReport()
+        results = (_TestTask(num).execute() for num in range(3))
+        tasks_processor._collect_results(results, p_bar, lambda: 3)
+        self.assertEqual(p_bar.progress, 100)
+        self.assertEqual(p_bar.info_msg, tasks_processor.tasks_report.summary_msg())
+
+def _throughput_task(num, weight, key = 'encode/audio/mp3'):
+    # i.e. at 10x
+    return _TestTask(num, cost = weight, weight = weight, throughput_key = key, step_duration = weight / 10)
+
+def _save_throughput(history_path, num_saves):
+    history = ThroughputHistory(history_path)
+    for _ in range(num_saves):
+        history.record('encode/audio/mp3', 100.0, 10.0, 1000)
+        history.save()
+
+class ThroughputHistoryTests(unittest.TestCase):
+    def test_predict(self):
+        history = ThroughputHistory()
+        self.assertIsNone(history.predict('encode/audio/mp3', 100.0))
+        history.record('encode/audio/mp3', 100.0, 10.0, 1000)
+        history.record('encode/audio/mp3', 300.0, 10.0, 3000)
+        # work per sec over all the recorded tasks
+        self.assertEqual(history.predict('encode/audio/mp3', 200.0), (10.0, 2000.0))
+        self.assertIsNone(history.predict('encode/video/libx264', 200.0))
+        self.assertIsNone(history.predict('encode/audio/mp3', None))
+
+    def test_fade_out(self):
+        history = ThroughputHistory()
+        for _ in range(ThroughputHistory.MAX_TASKS):
+            history.record('copy', 10.0, 1.0)
+        for _ in range(ThroughputHistory.MAX_TASKS):
+            history.record('copy', 10.0, 4.0)
+        stats = history.stats('copy')
+        self.assertAlmostEqual(stats.num_tasks, ThroughputHistory.MAX_TASKS)
+        # the latest tasks outweigh the older ones
+        self.assertGreater(history.predict('copy', 10.0)[0], 2.5)
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history_path = os.path.join(tmp_dir, 'throughput.json')
+            history, concurrent_history = ThroughputHistory(history_path), ThroughputHistory(history_path)
+            history.record('encode/audio/mp3', 100.0, 10.0, 1000)
+            concurrent_history.record('encode/audio/mp3', 100.0, 30.0, 1000)
+            history.save()
+            concurrent_history.save()
+            # merged, not overwritten
+            stats = ThroughputHistory(history_path).stats('encode/audio/mp3')
+            self.assertEqual((stats.num_tasks, stats.duration), (2, 40.0))
+
+            # concurrent processes saves
+            os.remove(history_path)
+            processes = [multiprocessing.Process(target = _save_throughput, args = (history_path, 20))
+                                                                                        for _ in range(4)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            self.assertEqual(ThroughputHistory(history_path).stats('encode/audio/mp3').num_tasks, 80)
+
+            with open(history_path, 'w') as f:
+                f.write('{not json')
+            self.assertIsNone(ThroughputHistory(history_path).stats('encode/audio/mp3'))
+
+    def test_estimate(self):
+        history = ThroughputHistory()
+        history.record('encode/audio/mp3', 100.0, 10.0, 1000)
+        tasks = [_throughput_task(num, weight) for num, weight in enumerate((100.0, 200.0, 300.0))]
+        tasks.append(_throughput_task(3, 100.0, key = 'encode/video/libx264'))
+        estimate = history.estimate(tasks, [task.estimated_cost() for task in tasks], num_workers = 2)
+        self.assertEqual((estimate.num_tasks, estimate.num_predicted, estimate.work), (4, 3, 700.0))
+        # the task with no history is extrapolated from the others costs
+        self.assertAlmostEqual(estimate.tasks_duration, 70.0)
+        self.assertAlmostEqual(estimate.makespan, 40.0)
+        self.assertAlmostEqual(estimate.output_bytes, 7000.0)
+
+        estimate = ThroughputHistory().estimate(tasks, [1.0] * len(tasks), num_workers = 2)
+        self.assertEqual(estimate.num_predicted, 0)
+        self.assertIsNone(estimate.makespan)
+
+    def test_tasks_processor(self):
+        history = ThroughputHistory()
+        tasks = [_throughput_task(num, 10.0 * (num + 1)) for num in range(4)]
+        TasksProcessor(throughput_history = history).process_tasks(tasks, num_workers = 2, quiet = True)
+        stats = history.stats('encode/audio/mp3')
+        self.assertEqual((stats.num_tasks, stats.work), (4, 100.0))
+        self.assertAlmostEqual(history.predict('encode/audio/mp3', 50.0)[0], 5.0)
+
 # quick dev test
 if __name__ == '__main__':
     #DescriptorTests().test_PropertyDescriptor()
@@ -0,0 +1,27 @@
+# coding=utf8
+## Copyright (c) 2014 Arseniy Kuznetsov
+##
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+
+''' Test runs keep out of the user cache dir, e.g. its probe cache and FFmpeg tools capabilities,
+    and out of the throughput history that predicts the planned runs
+'''
+import os, shutil, tempfile
+
+
+def pytest_configure(config):
+    config.batchmp_cache_dir = tempfile.mkdtemp(prefix = 'batchmp_tests_')
+    os.environ['BATCHMP_CACHE_DIR'] = config.batchmp_cache_dir
+    os.environ['BATCHMP_NO_THROUGHPUT_HISTORY'] = '1'
+
+def pytest_unconfigure(config):
+    shutil.rmtree(config.batchmp_cache_dir, ignore_errors = True)
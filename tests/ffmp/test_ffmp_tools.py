@@ -13,7 +13,7 @@
 ## GNU General Public License for more details.
 
 
-import unittest, os, sys
+import unittest, os, sys, pickle
 from .test_ffmp_base import FFMPTest
 from batchmp.ffmptools.ffutils import FFH
 from batchmp.fstools.fsutils import FSH
@@ -29,6 +29,7 @@ from batchmp.ffmptools.ffcommands.fragment import Fragmenter
 from batchmp.ffmptools.ffcommands.segment import Segmenter
 from batchmp.ffmptools.ffcommands.silencesplit import SilenceSplitter
 from batchmp.ffmptools.ffcommands.cuesplit import CueSplitter
+from batchmp.ffmptools.ffcommands.chain import Chain, ChainTask
 from batchmp.tags.handlers.ffmphandler import FFmpegTagHandler
 from batchmp.tags.handlers.mtghandler import MutagenTagHandler
 from batchmp.ffmptools.processors.ffentry import FFEntryParams, FFEntryParamsExt, FFEntryParamsSilenceSplit
@@ -325,6 +326,55 @@ class FFMPTests(FFMPTest):
         self._check_media_entries(orig_media_entries, processed_media_entries)
 
 
+    def test_chain_audio(self):
+        ## python -m unittest tests.ffmp.test_ffmp_tools.FFMPTests.test_chain_audio
+        ff_entry_params = self._ff_entry(include = 'bmfp_a', filter_files = False, end_level = 2)
+        ff_entry_params.target_format = '.mp3'
+
+        orig_media_entries = self._media_entries(ff_entry_params)
+        self.assertNotEqual(orig_media_entries, [], msg = 'No media files selected')
+
+        print('Denoising, normalizing and converting audio files in a single pass')
+        Chain().chain(ff_entry_params, denoise = True, num_passes = 2, normalize = True)
+
+        ff_entry_params = FFEntryParamsExt()
+        ff_entry_params.src_dir = self.target_dir
+
+        processed_media_entries = self._media_entries(ff_entry_params)
+        self.assertNotEqual(processed_media_entries, [], msg = 'No media files selected')
+        self._check_media_entries(orig_media_entries, processed_media_entries)
+
+    def test_chain_af_filters(self):
+        ## python -m unittest tests.ffmp.test_ffmp_tools.FFMPTests.test_chain_af_filters
+        fpath = os.path.join(self.src_dir, 'chain.mp3')
+        task = ChainTask(fpath, self.target_dir, LogLevel.QUIET, 0, None, True,
+                            target_format = '.m4a', denoise_filters = 'highpass=f=200', normalize = True)
+        # denoising, then the normalization gain
+        self.assertEqual(task.af_filters(3.5), 'highpass=f=200, volume=volume=3.5dB')
+        self.assertEqual(task.af_filters(), 'highpass=f=200')
+        self.assertEqual(task.ff_chain_cmd(task.af_filters()).count(' -af '), 1)
+
+        # the media files keep their own format
+        task = ChainTask(fpath, self.target_dir, LogLevel.QUIET, 0, None, True, normalize = True)
+        self.assertEqual((task.convert, task.target_format), (False, '.mp3'))
+        self.assertEqual(task.af_filters(0), '')
+
+    def test_task_media_entry(self):
+        ## python -m unittest tests.ffmp.test_ffmp_tools.FFMPTests.test_task_media_entry
+        fpath = os.path.join(self.src_dir, 'bmfp_a', '10 background noise.mp3')
+        task = ChainTask(fpath, self.target_dir, LogLevel.QUIET, 0, None, True, normalize = True)
+        media_entry = task._duration_media_entry()
+        self.assertIsNotNone(media_entry)
+
+        # probed once per task, and shipped along with it to pool workers
+        self.assertIs(task._duration_media_entry(), media_entry)
+        self.assertEqual(pickle.loads(pickle.dumps(task))._duration_media_entry(), media_entry)
+
+        # no probe result is memoized as well
+        task = ChainTask(os.path.join(self.src_dir, 'chain.mp3'), self.target_dir, LogLevel.QUIET, 0, None, True)
+        self.assertIsNone(task._duration_media_entry())
+        self.assertIn('_media_entry', task.__dict__)
+
     # Internal helpers
     def _media_entries(self, ff_entry_params):
         if ff_entry_params.src_dir is None:
@@ -13,15 +13,28 @@
 ## GNU General Public License for more details.
 
 
-import unittest, os, sys
+import unittest, os, sys, tempfile, shutil, wave, pickle, json
 from .test_ffmp_base import FFMPTest
 from batchmp.fstools.walker import DWalker
 from batchmp.ffmptools.ffutils import FFH
+from batchmp.ffmptools.utils.probecache import FFProbeCache
+from batchmp.ffmptools.utils.proberegistry import FFProbeRegistry
+from batchmp.ffmptools.utils.hdrprobe import FFHeaderProbe
+from batchmp.ffmptools.utils.fftools import FFToolsRegistry
+from batchmp.ffmptools.utils.proberecords import FFProbeRecords, FFStreamRecord
+from batchmp.ffmptools.utils.probeprofiles import FFProbeProfile
+from batchmp.ffmptools.utils.ffanalysis import (FFSilenceParser, FFVolumeParser, FFProgressParser,
+                                                    SilenceEntry, VolumeEntry)
 from batchmp.commons.utils import (
     run_cmd,
     CmdProcessingError
 )
 from batchmp.fstools.builders.fsprms import FSEntryParamsExt
+from batchmp.ffmptools.processors.ffentry import FFEntryParamsExt
+from batchmp.ffmptools.ffcommands.convert import Convertor
+from batchmp.ffmptools.ffcommands.cmdopt import FFmpegCommands
+from batchmp.commons.jobjournal import JobJournal
+from batchmp.fstools.builders.fsentry import FSMediaEntryType, FSMediaScanLevel
 
 
 class FFMPUtilsTests(FFMPTest):
@@ -55,3 +68,563 @@ class FFMPUtilsTests(FFMPTest):
         self.assertRaises(CmdProcessingError, run_cmd, cmd)
 
 
+
+class FFProbeCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.probe_cache = FFProbeCache(db_path = os.path.join(self.tmp_dir, 'cache.sqlite'), max_entries = 3)
+        self.fpath = os.path.join(self.tmp_dir, 'media.mp3')
+        with open(self.fpath, 'wb') as f:
+            f.write(b'\x00' * 16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_probe_cache_hit(self):
+        self.assertIsNone(self.probe_cache.get(self.fpath))
+        self.probe_cache.put(self.fpath, '{"format": {}}')
+        self.assertEqual(self.probe_cache.get(self.fpath), '{"format": {}}')
+
+        # failed probes are cached as well
+        self.probe_cache.put(self.fpath, '')
+        self.assertEqual(self.probe_cache.get(self.fpath), '')
+
+    def test_probe_cache_invalidation(self):
+        self.probe_cache.put(self.fpath, '{"format": {}}')
+        with open(self.fpath, 'ab') as f:
+            f.write(b'\x00')
+        self.assertIsNone(self.probe_cache.get(self.fpath))
+        self.assertEqual(len(self.probe_cache), 0)
+
+    def test_probe_cache_profiles(self):
+        self.probe_cache.put(self.fpath, 'type', profile = FFProbeProfile.TYPE)
+        self.assertEqual(self.probe_cache.get(self.fpath, profile = FFProbeProfile.ARTWORK), 'type')
+        self.assertIsNone(self.probe_cache.get(self.fpath, profile = FFProbeProfile.DURATION))
+        self.assertIsNone(self.probe_cache.get(self.fpath))
+
+        # a fuller probe satisfies narrower ones, and is not replaced by them
+        self.probe_cache.put(self.fpath, 'full')
+        self.probe_cache.put(self.fpath, 'duration', profile = FFProbeProfile.DURATION)
+        self.assertEqual(self.probe_cache.get(self.fpath, profile = FFProbeProfile.TYPE), 'full')
+        self.assertEqual(self.probe_cache.get(self.fpath), 'full')
+
+    def test_probe_cache_eviction(self):
+        for idx in range(5):
+            fpath = os.path.join(self.tmp_dir, '{}.mp3'.format(idx))
+            with open(fpath, 'wb') as f:
+                f.write(b'\x00')
+            self.probe_cache.put(fpath, '{}')
+        self.probe_cache.evict()
+        self.assertEqual(len(self.probe_cache), 3)
+
+class FFProbeRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.tmp_dir, 'media.mp3')
+        with open(self.fpath, 'wb') as f:
+            f.write(b'\x00' * 16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_probe_registry_lookup(self):
+        probed = []
+        probe = lambda fpath: probed.append(fpath) or 'probe entry'
+
+        with FFProbeRegistry.run_scope() as registry:
+            self.assertIs(FFProbeRegistry.active(), registry)
+            for _ in range(3):
+                self.assertEqual(registry.lookup(self.fpath, probe), 'probe entry')
+            self.assertEqual(len(probed), 1)
+            self.assertEqual((registry.hits, registry.misses), (2, 1))
+
+            # changed files are probed again
+            with open(self.fpath, 'ab') as f:
+                f.write(b'\x00')
+            registry.lookup(self.fpath, probe)
+            self.assertEqual(len(probed), 2)
+
+        self.assertIsNone(FFProbeRegistry.active())
+
+    def test_probe_registry_profiles(self):
+        probed = []
+        probe = lambda profile: lambda fpath: probed.append(profile) or profile.name
+
+        with FFProbeRegistry.run_scope() as registry:
+            self.assertEqual(registry.lookup(self.fpath, probe(FFProbeProfile.TYPE),
+                                                    profile = FFProbeProfile.TYPE), 'TYPE')
+            self.assertEqual(registry.lookup(self.fpath, probe(FFProbeProfile.ARTWORK),
+                                                    profile = FFProbeProfile.ARTWORK), 'TYPE')
+            self.assertIsNone(registry.entry(self.fpath))
+            self.assertEqual(registry.lookup(self.fpath, probe(FFProbeProfile.FULL)), 'FULL')
+            self.assertEqual(registry.lookup(self.fpath, probe(FFProbeProfile.DURATION),
+                                                    profile = FFProbeProfile.DURATION), 'FULL')
+            self.assertEqual(probed, [FFProbeProfile.TYPE, FFProbeProfile.FULL])
+
+            # narrower results do not replace fuller ones
+            registry.register(self.fpath, 'ARTWORK', profile = FFProbeProfile.ARTWORK)
+            self.assertEqual(registry.profiled_entry(self.fpath), (FFProbeProfile.FULL, 'FULL'))
+
+        # narrower lookups are probed at the run profile
+        with FFProbeRegistry.run_scope(FFProbeProfile.DURATION) as registry:
+            self.assertEqual(registry.probe_profile(FFProbeProfile.TYPE), FFProbeProfile.DURATION)
+            self.assertEqual(registry.probe_profile(FFProbeProfile.FULL), FFProbeProfile.FULL)
+            registry.lookup(self.fpath, probe(FFProbeProfile.DURATION), profile = FFProbeProfile.TYPE,
+                                                                    probe_profile = FFProbeProfile.DURATION)
+            self.assertEqual(registry.entry(self.fpath, profile = FFProbeProfile.DURATION), 'DURATION')
+
+    def test_probe_registry_max_entries(self):
+        fpathes = [os.path.join(self.tmp_dir, '{}.mp3'.format(idx)) for idx in range(3)]
+        for fpath in fpathes:
+            with open(fpath, 'wb') as f:
+                f.write(b'\x00')
+
+        with FFProbeRegistry.run_scope(max_entries = 2) as registry:
+            registry.lookup(fpathes[0], lambda fpath: 'first')
+            registry.lookup(fpathes[1], lambda fpath: 'second')
+            # recently used
+            registry.lookup(fpathes[0], lambda fpath: 'probed again')
+            registry.lookup(fpathes[2], lambda fpath: 'third')
+            self.assertEqual(len(registry), 2)
+            self.assertEqual([registry.entry(fpath) for fpath in fpathes], ['first', None, 'third'])
+
+    def test_probe_profiles_options(self):
+        self.assertEqual(FFProbeProfile.ARTWORK.ffprobe_args[:2], ('-select_streams', 'v'))
+        self.assertIn('-show_entries', FFProbeProfile.TYPE.ffprobe_args)
+        self.assertIn('duration', FFProbeProfile.DURATION.ffprobe_args[-1])
+        self.assertIn('-show_streams', FFProbeProfile.FULL.ffprobe_args)
+        self.assertTrue(FFProbeProfile.FULL.satisfies(FFProbeProfile.TYPE))
+        self.assertFalse(FFProbeProfile.TYPE.satisfies(FFProbeProfile.DURATION))
+
+class FFHeaderProbeTests(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_header_probe_audio(self):
+        audio_codecs = {'01 background noise.aiff': 'pcm_s16be',
+                        '03 background noise.flac': 'flac',
+                        '05 background noise.m4a': 'aac',
+                        '10 background noise.mp3': 'mp3',
+                        '12 background noise.ogg': 'vorbis'}
+        for fname, codec_name in audio_codecs.items():
+            fpath = os.path.join(self.data_dir, 'bmfp_a', fname)
+            full_entry = FFH.media_file_info_full(fpath, header_probe = True)
+            self.assertEqual(len(full_entry.audio_streams), 1)
+            audio_stream = full_entry.audio_streams[0]
+            self.assertEqual(audio_stream.get('codec_name'), codec_name)
+            self.assertEqual(audio_stream.get('sample_rate'), 44100)
+            self.assertEqual(audio_stream.get('channels'), 2)
+            self.assertAlmostEqual(FFH.media_duration(fpath), 5.3, delta = 0.1)
+
+    def test_header_probe_video(self):
+        fpath = os.path.join(self.data_dir, 'bmfp_v', '11 background noise.mp4')
+        ffentry = FFH.media_file_info(fpath, header_probe = True)
+        self.assertEqual(ffentry.video.get('codec_name'), 'h264')
+        self.assertEqual(ffentry.audio.get('codec_name'), 'aac')
+
+    def test_header_probe_wav(self):
+        fpath = os.path.join(self.tmp_dir, 'media.wav')
+        with wave.open(fpath, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(8000)
+            wav.writeframes(b'\x00\x00' * 8000 * 3)
+
+        out = FFHeaderProbe.probe(fpath)
+        self.assertEqual(out['format']['format_name'], 'wav')
+        self.assertEqual(out['streams'][0]['codec_name'], 'pcm_s16le')
+        self.assertEqual(float(out['format']['duration']), 3.0)
+
+    def test_header_probe_unknown(self):
+        self.assertIsNone(FFHeaderProbe.probe(os.path.join(self.data_dir, 'bmfp_v', '08 background noise.mkv')))
+
+        fpath = os.path.join(self.tmp_dir, 'media.mp3')
+        with open(fpath, 'wb') as f:
+            f.write(b'\xff\xfb\x90\x64' + b'\x00' * 1024)
+        self.assertIsNone(FFHeaderProbe.probe(fpath))
+
+class FFContentMediaTypeTests(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_content_media_type(self):
+        content_media_types = {('bmfp_a', '03 background noise.flac'): FSMediaEntryType.AUDIO,
+                               ('bmfp_a', '10 background noise.mp3'): FSMediaEntryType.AUDIO,
+                               ('bmfp_v', '02 background noise.avi'): FSMediaEntryType.VIDEO,
+                               ('bmfp_a', 'noise.cue'): None,
+                               # multi-purpose containers are left for probing
+                               ('bmfp_v', '11 background noise.mp4'): None,
+                               ('bmfp_a', '07 background noise.mka'): None}
+        for fpath, media_type in content_media_types.items():
+            self.assertEqual(FFH.content_media_type(os.path.join(self.data_dir, *fpath)), media_type)
+
+    def test_content_scan_level(self):
+        # misleading / missing extensions
+        for fpath, fname in ((('bmfp_a', '12 background noise.ogg'), 'media.txt'),
+                             (('bmfp_v', '11 background noise.mp4'), 'media')):
+            tmp_fpath = os.path.join(self.tmp_dir, fname)
+            shutil.copy(os.path.join(self.data_dir, *fpath), tmp_fpath)
+            self.assertEqual(FFH.media_type(tmp_fpath, fast_scan = True), FSMediaEntryType.NONMEDIA)
+
+        self.assertEqual(FFH.media_type(os.path.join(self.tmp_dir, 'media.txt'),
+                                    scan_level = FSMediaScanLevel.CONTENT), FSMediaEntryType.AUDIO)
+        self.assertEqual(FFH.media_type(os.path.join(self.tmp_dir, 'media'),
+                                    scan_level = FSMediaScanLevel.CONTENT), FSMediaEntryType.VIDEO)
+
+    def test_media_scan_params(self):
+        fs_entry_params = FSEntryParamsExt({'dir': self.tmp_dir, 'media_scan': 'content'})
+        self.assertEqual(fs_entry_params.media_scan, FSMediaScanLevel.CONTENT)
+        self.assertFalse(fs_entry_params.fast_scan)
+
+        # boolean values, as before the scan levels
+        fs_entry_params.media_scan = True
+        self.assertEqual(fs_entry_params.media_scan, FSMediaScanLevel.FULL)
+        fs_entry_params.media_scan = False
+        self.assertTrue(fs_entry_params.fast_scan)
+
+@unittest.skipIf(os.name == 'nt', 'skipping for windows')
+class FFToolsRegistryTests(unittest.TestCase):
+    FAKE_FFMPEG = '''#!/bin/sh
+echo run >> "{runs_fpath}"
+case "$2" in
+    -version) echo "ffmpeg version 7.0.2-test Copyright (c) 2000-2024 the FFmpeg developers";;
+    -encoders) printf " V..... = Video\\n ------\\n A....D alac                 ALAC (Apple Lossless Audio Codec)\\n V....D libx264              H.264\\n";;
+    -filters) printf "  T.. = Timeline support\\n ..C afftdn            A->A       Denoise audio samples.\\n";;
+    -muxers) printf " ---\\n  E  mp4             MP4 (MPEG-4 Part 14)\\n";;
+    -h) printf "Advanced global options:\\n-filter_threads     number of non-complex filter threads\\n";;
+esac
+'''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.runs_fpath = os.path.join(self.tmp_dir, 'runs')
+        self.ffmpeg_path = os.path.join(self.tmp_dir, 'ffmpeg')
+        with open(self.ffmpeg_path, 'w') as f:
+            f.write(self.FAKE_FFMPEG.format(runs_fpath = self.runs_fpath))
+        os.chmod(self.ffmpeg_path, 0o755)
+
+        self.cache_path = os.path.join(self.tmp_dir, 'fftools.json')
+        self.path_env = os.environ.get('PATH', '')
+        os.environ['PATH'] = self.tmp_dir
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path_env
+        shutil.rmtree(self.tmp_dir)
+
+    def ffmpeg_runs(self):
+        if not os.path.exists(self.runs_fpath):
+            return 0
+        with open(self.runs_fpath) as f:
+            return len(f.readlines())
+
+    def test_tools_capabilities(self):
+        fftools = FFToolsRegistry(cache_path = self.cache_path)
+        self.assertTrue(fftools.ffmpeg_installed)
+        self.assertEqual(fftools.ffmpeg_path, os.path.realpath(self.ffmpeg_path))
+        self.assertIsNone(fftools.ffprobe_path)
+
+        self.assertEqual(fftools.version, '7.0.2-test')
+        self.assertEqual(fftools.encoders, {'alac', 'libx264'})
+        self.assertEqual(fftools.filters, {'afftdn'})
+        self.assertTrue(fftools.has_muxer('mp4'))
+        self.assertFalse(fftools.has_encoder('flac'))
+        self.assertTrue(fftools.has_option('filter_threads'))
+        self.assertEqual(self.ffmpeg_runs(), 5)
+
+        # persisted capabilities
+        self.assertTrue(FFToolsRegistry(cache_path = self.cache_path).has_encoder('alac'))
+        self.assertEqual(self.ffmpeg_runs(), 5)
+
+        # changed binary
+        st = os.stat(self.ffmpeg_path)
+        os.utime(self.ffmpeg_path, ns = (st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertEqual(FFToolsRegistry(cache_path = self.cache_path).version, '7.0.2-test')
+        self.assertEqual(self.ffmpeg_runs(), 10)
+
+    def test_tools_threads_options(self):
+        shared_tools = FFToolsRegistry._shared
+        FFToolsRegistry._shared = FFToolsRegistry(cache_path = self.cache_path)
+        try:
+            self.assertEqual(FFmpegCommands.threads(2), ' -threads 2 -filter_threads 2')
+
+            # an older ffmpeg build
+            with open(self.ffmpeg_path) as f:
+                fake_ffmpeg = f.read().replace('-filter_threads', '-filter_complex_threads')
+            with open(self.ffmpeg_path, 'w') as f:
+                f.write(fake_ffmpeg)
+            FFToolsRegistry._shared.reset()
+            self.assertEqual(FFmpegCommands.threads(2), ' -threads 2')
+        finally:
+            FFToolsRegistry._shared = shared_tools
+
+    def test_tools_path_change(self):
+        fftools = FFToolsRegistry(cache_path = self.cache_path)
+        self.assertTrue(fftools.ffmpeg_installed)
+        os.environ['PATH'] = ''
+        self.assertFalse(fftools.ffmpeg_installed)
+        # unknown capabilities
+        self.assertTrue(fftools.has_encoder('flac'))
+
+@unittest.skipIf(os.name == 'nt', 'skipping for windows')
+class FFProbeMediaInfoTests(unittest.TestCase):
+    FAKE_FFPROBE = '''#!/bin/sh
+echo "$@" >> "{runs_fpath}"
+cat "{output_fpath}"
+exit "$(cat "{status_fpath}")"
+'''
+    # writes (an empty) output file
+    FAKE_FFMPEG = '''#!/bin/sh
+for output; do :; done
+case "$output" in /*) touch "$output";; esac
+'''
+    PROBE_OUTPUT = json.dumps({'format': {'format_name': 'mp3', 'duration': '5.0'},
+                               'streams': [{'index': 0, 'codec_type': 'audio', 'codec_name': 'mp3'}]})
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.runs_fpath = os.path.join(self.tmp_dir, 'runs')
+        self.output_fpath = os.path.join(self.tmp_dir, 'output')
+        self.status_fpath = os.path.join(self.tmp_dir, 'status')
+        self.ffprobe_path = os.path.join(self.tmp_dir, 'ffprobe')
+        with open(self.ffprobe_path, 'w') as f:
+            f.write(self.FAKE_FFPROBE.format(runs_fpath = self.runs_fpath,
+                                             output_fpath = self.output_fpath, status_fpath = self.status_fpath))
+        ffmpeg_path = os.path.join(self.tmp_dir, 'ffmpeg')
+        with open(ffmpeg_path, 'w') as f:
+            f.write(self.FAKE_FFMPEG)
+        for tool_path in (self.ffprobe_path, ffmpeg_path):
+            os.chmod(tool_path, 0o755)
+        self.set_probe_output(self.PROBE_OUTPUT)
+
+        self.fpath = os.path.join(self.tmp_dir, 'media.mp3')
+        with open(self.fpath, 'wb') as f:
+            f.write(b'\x00' * 16)
+
+        self.path_env = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join((self.tmp_dir, self.path_env))
+        self.shared_tools, self.shared_cache = FFToolsRegistry._shared, FFProbeCache._shared
+        FFToolsRegistry._shared = FFToolsRegistry(cache_path = os.path.join(self.tmp_dir, 'fftools.json'))
+        FFProbeCache._shared = self.probe_cache = FFProbeCache(db_path = os.path.join(self.tmp_dir, 'cache.sqlite'))
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path_env
+        FFToolsRegistry._shared, FFProbeCache._shared = self.shared_tools, self.shared_cache
+        shutil.rmtree(self.tmp_dir)
+
+    def set_probe_output(self, output, status = 0):
+        with open(self.output_fpath, 'w') as f:
+            f.write(output)
+        with open(self.status_fpath, 'w') as f:
+            f.write(str(status))
+
+    def ffprobe_runs(self):
+        if not os.path.exists(self.runs_fpath):
+            return 0
+        with open(self.runs_fpath) as f:
+            return len(f.readlines())
+
+    def test_media_info_cached(self):
+        # an empty cache is a cache all the same
+        self.assertEqual(len(self.probe_cache), 0)
+        for _ in range(2):
+            media_entry = FFH.media_file_info_full(self.fpath)
+            self.assertEqual(media_entry.format.format_name, 'mp3')
+        self.assertEqual(self.ffprobe_runs(), 1)
+        self.assertEqual(len(self.probe_cache), 1)
+
+    def test_media_info_not_media(self):
+        # not persisted, i.e. not mistaken for a probed media file with nothing in it
+        self.set_probe_output('{}', status = 1)
+        for _ in range(2):
+            self.assertIsNone(FFH.media_file_info_full(self.fpath))
+        self.assertEqual(self.ffprobe_runs(), 2)
+        self.assertEqual(len(self.probe_cache), 0)
+
+    def test_media_info_tools_path(self):
+        # ffprobe next to ffmpeg, out of $PATH
+        tools_dir = os.path.join(self.tmp_dir, 'ffmpeg_build')
+        os.mkdir(tools_dir)
+        for tool in ('ffmpeg', 'ffprobe'):
+            os.rename(os.path.join(self.tmp_dir, tool), os.path.join(tools_dir, tool))
+        os.symlink(os.path.join(tools_dir, 'ffmpeg'), os.path.join(self.tmp_dir, 'ffmpeg'))
+
+        self.assertIsNotNone(FFH.media_file_info_full(self.fpath))
+        self.assertEqual(self.ffprobe_runs(), 1)
+
+    def test_media_info_not_installed(self):
+        # the probe cache is not even opened
+        os.environ['PATH'] = ''
+        FFProbeCache._shared = None
+        self.assertIsNone(FFH.media_file_info_full(self.fpath))
+        self.assertIsNone(FFProbeCache._shared)
+
+    def test_media_info_failed_probes(self):
+        # truncated output
+        self.set_probe_output(self.PROBE_OUTPUT[:20])
+        self.assertIsNone(FFH.media_file_info_full(self.fpath))
+
+        # ffprobe could not run
+        os.chmod(self.ffprobe_path, 0o644)
+        self.assertIsNone(FFH.media_file_info_full(self.fpath))
+        os.chmod(self.ffprobe_path, 0o755)
+
+        # failed probes are not cached
+        self.set_probe_output(self.PROBE_OUTPUT)
+        self.assertIsNotNone(FFH.media_file_info_full(self.fpath))
+        self.assertEqual(self.ffprobe_runs(), 2)
+
+    def test_media_info_pickle(self):
+        media_entry = FFH.media_file_info_full(self.fpath)
+        self.assertEqual(pickle.loads(pickle.dumps(media_entry)), media_entry)
+
+    def test_run_probes(self):
+        ## python -m unittest tests.ffmp.test_ffmp_utils.FFProbeMediaInfoTests.test_run_probes
+        src_dir, target_dir = os.path.join(self.tmp_dir, 'src'), os.path.join(self.tmp_dir, 'target')
+        for dir_path in (src_dir, target_dir):
+            os.mkdir(dir_path)
+        fpathes = [os.path.join(src_dir, '{}.mka'.format(idx)) for idx in range(3)]
+        for fpath in fpathes:
+            with open(fpath, 'wb') as f:
+                f.write(b'\x00' * 16)
+
+        # a convert run with the tags preserved, i.e. the media types, durations, artwork streams and tags
+        os.environ['BATCHMP_NO_PROBE_CACHE'] = '1'
+        try:
+            ff_entry_params = FFEntryParamsExt({'dir': src_dir, 'target_dir': target_dir,
+                                                'serial_exec': True, 'quiet': True, 'target_format': '.mp3'})
+            Convertor().convert(ff_entry_params)
+        finally:
+            del os.environ['BATCHMP_NO_PROBE_CACHE']
+
+        with open(self.runs_fpath) as f:
+            probed = [fpath for fpath in (line.split()[-1] for line in f) if fpath.startswith(src_dir)]
+        # each source media file is probed once per run
+        self.assertEqual(sorted(probed), fpathes)
+
+        # a run done in full leaves no job journal behind
+        self.assertEqual([dir_path for dir_path, _, fnames in os.walk(target_dir)
+                                    if any(fname.startswith(JobJournal.JOURNAL_FNAME) for fname in fnames)], [])
+
+    def test_runner_throughput_history(self):
+        # not read when building runners, and disabled in test runs
+        runner = Convertor()
+        self.assertNotIn('throughput_history', runner.__dict__)
+        self.assertIsNone(runner.throughput_history)
+
+    def test_media_info_registry(self):
+        os.environ['BATCHMP_NO_PROBE_CACHE'] = '1'
+        try:
+            with FFProbeRegistry.run_scope() as registry:
+                # an empty registry is a registry all the same
+                self.assertEqual(len(registry), 0)
+                for _ in range(2):
+                    self.assertIsNotNone(FFH.media_file_info_full(self.fpath))
+                self.assertEqual((registry.hits, registry.misses), (1, 1))
+            self.assertIsNone(FFProbeRegistry.active())
+        finally:
+            del os.environ['BATCHMP_NO_PROBE_CACHE']
+        self.assertEqual(self.ffprobe_runs(), 1)
+
+class FFProbeRecordsTests(unittest.TestCase):
+    FFPROBE_OUTPUT = {
+        'streams': [{'index': 0, 'codec_name': 'mp3', 'codec_long_name': 'MP3 (MPEG audio layer 3)',
+                     'codec_type': 'audio', 'codec_tag_string': '[0][0][0][0]', 'codec_tag': '0x0000',
+                     'sample_fmt': 'fltp', 'sample_rate': '44100', 'channels': 2, 'channel_layout': 'stereo',
+                     'bits_per_sample': 0, 'r_frame_rate': '0/0', 'avg_frame_rate': '0/0',
+                     'time_base': '1/14112000', 'start_pts': 353600, 'start_time': '0.025057',
+                     'duration_ts': 74760192, 'duration': '5.297619', 'bit_rate': '81566',
+                     'disposition': {'default': 0, 'dub': 0, 'original': 0, 'comment': 0, 'lyrics': 0},
+                     'tags': {'encoder': 'LAME3.99r'}},
+                    {'index': 1, 'codec_name': 'png', 'codec_type': 'video', 'width': 535, 'height': 387,
+                     'duration': 'N/A', 'disposition': {'default': 0, 'attached_pic': 1},
+                     'tags': {'comment': 'Cover (front)'}}],
+        'format': {'filename': 'noise.mp3', 'nb_streams': 2, 'nb_programs': 0, 'format_name': 'mp3',
+                   'format_long_name': 'MP2/3 (MPEG audio layer 2/3)', 'start_time': '0.025057',
+                   'duration': '5.328980', 'size': '153698', 'bit_rate': '230735', 'probe_score': 51,
+                   'tags': {'title': 'Background noise', 'artist': 'batchmp', 'track': '10/13'}}}
+
+    def test_probe_records(self):
+        format, streams = FFProbeRecords.from_probe(self.FFPROBE_OUTPUT)
+        self.assertEqual(format.get('format_name'), 'mp3')
+        self.assertEqual(format.get('duration'), 5.32898)
+        self.assertEqual(format['tags']['track'], '10/13')
+        self.assertIsNone(format.get('size'))
+
+        audio, artwork = streams
+        self.assertEqual((audio.get('index'), audio.get('sample_rate'), audio.get('bit_rate')), (0, 44100, 81566))
+        self.assertEqual(artwork.get('duration', 0.0), 0.0)
+        self.assertRaises(KeyError, lambda: artwork['bit_rate'])
+
+        full_entry = FFH._full_entry('noise.mp3', format, streams)
+        self.assertEqual(full_entry.audio_streams, (audio,))
+        self.assertEqual(full_entry.artwork_streams, (artwork,))
+
+    def test_probe_records_serialization(self):
+        format, streams = FFProbeRecords.from_probe(self.FFPROBE_OUTPUT)
+        self.assertEqual(FFProbeRecords.loads(FFProbeRecords.dumps(format, streams)), (format, streams))
+        self.assertEqual(pickle.loads(pickle.dumps(streams)), streams)
+
+        # compared to the raw ffprobe JSON dicts
+        self.assertLess(len(pickle.dumps((format, streams))), len(pickle.dumps(self.FFPROBE_OUTPUT)) / 2)
+        self.assertLess(len(FFProbeRecords.dumps(format, streams)), len(json.dumps(self.FFPROBE_OUTPUT)) / 2)
+        self.assertFalse(hasattr(streams[0], '__dict__'))
+
+class FFAnalysisParsersTests(unittest.TestCase):
+    SILENCEDETECT_OUTPUT = [
+        "Input #0, mp3, from 'noise.mp3':",
+        "  Duration: 00:01:05.50, start: 0.025057, bitrate: 230 kb/s",
+        "[silencedetect @ 0x7f8] silence_start: 0",
+        "[silencedetect @ 0x7f8] silence_end: 2.5 | silence_duration: 2.5",
+        "[silencedetect @ 0x7f8] silence_start: 30.25",
+        "[silencedetect @ 0x7f8] silence_end: 33 | silence_duration: 2.75",
+        "[silencedetect @ 0x7f8] silence_start: 62.1",
+        "size=N/A time=00:01:05.50 bitrate=N/A speed= 612x"]
+
+    def test_silence_parser(self):
+        self.assertEqual(list(FFSilenceParser().parse(self.SILENCEDETECT_OUTPUT)),
+                            [SilenceEntry(0.0, 2.5), SilenceEntry(30.25, 33.0), SilenceEntry(62.1, 65.5)])
+
+    def test_silence_parser_streaming(self):
+        consumed = []
+        def lines():
+            for line in self.SILENCEDETECT_OUTPUT:
+                consumed.append(line)
+                yield line
+
+        silence_entries = FFSilenceParser().parse(lines())
+        self.assertEqual(next(silence_entries), SilenceEntry(0.0, 2.5))
+        # available as soon as the silence end is in the output
+        self.assertEqual(len(consumed), 4)
+
+    def test_volume_parser(self):
+        lines = ["[Parsed_volumedetect_0 @ 0x7f8] n_samples: 467712",
+                 "[Parsed_volumedetect_0 @ 0x7f8] mean_volume: -36.4 dB",
+                 "[Parsed_volumedetect_0 @ 0x7f8] max_volume: -12.0 dB",
+                 "[Parsed_volumedetect_0 @ 0x7f8] histogram_12db: 4"]
+        self.assertEqual(list(FFVolumeParser().parse(lines)), [('mean_volume', 36.4), ('max_volume', 12.0)])
+        self.assertEqual(FFVolumeParser().volume_entry(iter(lines)), VolumeEntry(36.4, 12.0))
+        self.assertEqual(FFVolumeParser().volume_entry([]), VolumeEntry(0, 0))
+
+    def test_progress_parser(self):
+        progress = FFProgressParser()
+        block = ['frame=0', 'total_size=48', 'out_time_us=1500000', 'out_time_ms=1500000', 'progress=continue']
+        self.assertEqual([progress.is_progress(line) for line in block], [False, True, True, False, False])
+        self.assertEqual(progress.out_time, 1.5)
+
+        # asking again about the same line, e.g. by the watchdog and then by a progress reporter
+        line = 'out_time_us=2000000'
+        self.assertEqual([progress.is_progress(line), progress.is_progress(line)], [True, True])
+
+        # stalled, the same block again
+        self.assertFalse(any(progress.is_progress(line) for line in block))
+        self.assertFalse(progress.is_progress('out_time_us=N/A'))
+        self.assertTrue(progress.is_progress('progress=end'))
+        self.assertTrue(progress.done)